@@ -0,0 +1,455 @@
+"""
+碳足跡計算 JSON API 服務
+以 asyncio 提供計算、交通替代方案與環保建議端點，並行的請求會集合成微批次 (依數量或數毫秒延遲送出) 一次向量化計算
+
+用法：
+    python api_server.py --host 127.0.0.1 --port 8765
+    python api_server.py --self-test --requests 20000 --concurrency 64
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from batch_cli import normalize_record
+from functions import (
+    CITY_DISTANCES,
+    COFFEE_OPTIONS,
+    DINING_OPTIONS,
+    NANTOU_ROUTES,
+    TRANSPORT_OPTIONS,
+    NantouCarbonCalculator,
+    NantouTripCalculation,
+    get_recommendation_engine
+)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 微批次：累積到此數量立即送出，否則最多等待此延遲
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_DELAY_MS = 2.0
+
+MAX_BODY_BYTES = 64 * 1024
+
+# 整數代碼對照 (順序與 calculate_batch_arrays 的查找表相同)
+ROUTE_CODES = {key: i for i, key in enumerate(NANTOU_ROUTES)}
+CITY_CODES = {key: i for i, key in enumerate(CITY_DISTANCES)}
+TRANSPORT_CODES = {key: i for i, key in enumerate(TRANSPORT_OPTIONS)}
+DINING_CODES = {key: i for i, key in enumerate(DINING_OPTIONS)}
+COFFEE_CODES = {key: i for i, key in enumerate(COFFEE_OPTIONS)}
+
+INPUT_FIELDS = ('route_option', 'traveler_count', 'transport_mode', 'departure_city', 'dining_choice', 'coffee_choice')
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+class RequestError(Exception):
+    """可直接回應給客戶端的請求錯誤"""
+
+    def __init__(self, status: int, message: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.errors = errors or []
+
+def calculate_trips(calculator: NantouCarbonCalculator, trips: List[dict]) -> List[dict]:
+    """以整數代碼向量化計算一批已驗證的旅程，回傳每筆的計算結果"""
+    computed = calculator.calculate_batch_arrays(
+        np.fromiter((ROUTE_CODES[t['route_option']] for t in trips), dtype=np.int64, count=len(trips)),
+        np.fromiter((CITY_CODES[t['departure_city']] for t in trips), dtype=np.int64, count=len(trips)),
+        np.fromiter((TRANSPORT_CODES[t['transport_mode']] for t in trips), dtype=np.int64, count=len(trips)),
+        np.fromiter((DINING_CODES[t['dining_choice']] for t in trips), dtype=np.int64, count=len(trips)),
+        np.fromiter((COFFEE_CODES[t['coffee_choice']] for t in trips), dtype=np.int64, count=len(trips)),
+        np.fromiter((t['traveler_count'] for t in trips), dtype=np.int64, count=len(trips)),
+    )
+    recommendation_ids = get_recommendation_engine().assign_recommendation_ids(
+        [t['dining_choice'] for t in trips],
+        [t['coffee_choice'] for t in trips],
+        [t['transport_mode'] for t in trips],
+        computed['per_person_emissions']
+    ).tolist()
+
+    calculated_at = datetime.now().isoformat(timespec='milliseconds')
+    names = list(computed)
+    results = []
+    for trip, values, rec_id in zip(trips, zip(*(computed[name].tolist() for name in names)), recommendation_ids):
+        result = {field: trip[field] for field in INPUT_FIELDS}
+        result.update(zip(names, values))
+        result['recommendation_id'] = rec_id
+        result['calculated_at'] = calculated_at
+        results.append(result)
+    return results
+
+@dataclass
+class BatchStats:
+    """微批次統計"""
+    batches: int = 0
+    requests: int = 0
+    largest_batch: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+class MicroBatcher:
+    """收集並行請求，依數量或延遲送出一次向量化計算"""
+
+    def __init__(self, calculator: Optional[NantouCarbonCalculator] = None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_delay_ms: float = DEFAULT_MAX_DELAY_MS):
+        # 未指定計算器時每一批都使用目前的係數快照 (係數檔更新後下一批即套用)
+        self.calculator = calculator
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.stats = BatchStats()
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def submit(self, trip: dict) -> asyncio.Future:
+        """加入一筆已驗證的旅程，回傳計算完成後的 Future"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((trip, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """立即計算目前累積的請求"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        self.stats.batches += 1
+        self.stats.requests += len(pending)
+        self.stats.largest_batch = max(self.stats.largest_batch, len(pending))
+
+        try:
+            results = calculate_trips(self.calculator or NantouCarbonCalculator(), [trip for trip, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(pending, results):
+            # 客戶端中斷連線時 Future 可能已被取消
+            if not future.done():
+                future.set_result(result)
+
+def parse_trip(payload) -> dict:
+    """驗證請求內容並整理為旅程資料"""
+    if not isinstance(payload, dict):
+        raise RequestError(400, "請求內容必須是 JSON 物件")
+    trip, errors = normalize_record(payload)
+    if errors:
+        raise RequestError(400, "輸入資料有誤", errors)
+    return trip
+
+def _alternatives_for(result: dict) -> List[dict]:
+    """依計算結果取得交通替代方案"""
+    trip = NantouTripCalculation(**{field: result[field] for field in INPUT_FIELDS})
+    alternatives = get_recommendation_engine().generate_transport_alternatives(
+        result['transport_mode'], result['total_emissions'], trip
+    )
+    return [asdict(alternative) for alternative in alternatives]
+
+class CarbonApiServer:
+    """碳足跡計算 HTTP/1.1 JSON 服務 (支援 keep-alive)"""
+
+    def __init__(self, batcher: Optional[MicroBatcher] = None):
+        self.batcher = batcher or MicroBatcher()
+        self.started_at = time.time()
+        self.routes = {
+            ('POST', '/calculate'): self.handle_calculate,
+            ('POST', '/alternatives'): self.handle_alternatives,
+            ('POST', '/recommendations'): self.handle_recommendations,
+            ('GET', '/health'): self.handle_health,
+        }
+
+    async def handle_calculate(self, payload) -> dict:
+        """計算單筆旅程，或以陣列一次傳入多筆"""
+        if isinstance(payload, list):
+            trips = [parse_trip(item) for item in payload]
+            return {'results': list(await asyncio.gather(*(self.batcher.submit(t) for t in trips)))}
+        return {'result': await self.batcher.submit(parse_trip(payload))}
+
+    async def handle_alternatives(self, payload) -> dict:
+        result = await self.batcher.submit(parse_trip(payload))
+        return {
+            'total_emissions': result['total_emissions'],
+            'alternatives': _alternatives_for(result),
+        }
+
+    async def handle_recommendations(self, payload) -> dict:
+        result = await self.batcher.submit(parse_trip(payload))
+        return {
+            'per_person_emissions': result['per_person_emissions'],
+            'recommendation_id': result['recommendation_id'],
+            'recommendations': get_recommendation_engine().recommendations_for_id(result['recommendation_id']),
+        }
+
+    async def handle_health(self, payload) -> dict:
+        stats = self.batcher.stats
+        return {
+            'status': 'ok',
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'batches': stats.batches,
+            'requests': stats.requests,
+            'mean_batch_size': round(stats.mean_batch_size, 2),
+            'largest_batch': stats.largest_batch,
+        }
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, dict]:
+        """依方法與路徑分派請求"""
+        path = path.split('?', 1)[0]
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                raise RequestError(405, f"不支援的方法: {method}")
+            raise RequestError(404, f"找不到路徑: {path}")
+
+        payload = None
+        if method == 'POST':
+            try:
+                payload = json.loads(body)
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise RequestError(400, "無法解析的 JSON")
+        return 200, await handler(payload)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """處理一條連線上的所有請求"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                try:
+                    body = b''
+                    if method == 'POST':
+                        if 'content-length' not in headers:
+                            raise RequestError(411, "缺少 Content-Length")
+                        length = int(headers['content-length'])
+                        if length > MAX_BODY_BYTES:
+                            keep_alive = False
+                            raise RequestError(413, "請求內容過大")
+                        body = await reader.readexactly(length)
+                    status, response = await self.dispatch(method, path, body)
+                except RequestError as e:
+                    status, response = e.status, {'error': e.message, 'errors': e.errors}
+                except (asyncio.IncompleteReadError, ValueError):
+                    break
+                except Exception as e:
+                    status, response = 500, {'error': f"伺服器錯誤: {e}"}
+
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """啟動服務直到被中斷"""
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+        print(f"碳足跡 API 服務啟動於 {addresses}", file=sys.stderr, flush=True)
+        async with server:
+            await server.serve_forever()
+
+# 自我測試 (對 localhost 量測吞吐量與延遲)
+SELF_TEST_TRIPS = [
+    {'route_option': route, 'traveler_count': count, 'transport_mode': transport, 'departure_city': city}
+    for route in NANTOU_ROUTES
+    for transport in TRANSPORT_OPTIONS
+    for city, count in (('台北', 2), ('台中', 4), ('高雄', 1))
+]
+
+# 格式錯誤的請求 (每個端點都應回覆 400，而不是伺服器錯誤)
+SELF_TEST_MALFORMED = [
+    {'route_option': ['route_a'], 'traveler_count': 2, 'transport_mode': 'bus', 'departure_city': '台北'},
+    {'route_option': 'route_a', 'traveler_count': 2, 'transport_mode': {'mode': 'bus'}, 'departure_city': ['台北']},
+    {'route_option': 'route_a', 'traveler_count': 1e400, 'transport_mode': 'bus', 'departure_city': '台北'},
+    ['route_a', 2, 'bus', '台北'],
+]
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                   method: str, path: str, payload=None) -> Tuple[int, dict]:
+    """在既有連線上送出一個請求並讀取回應"""
+    body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def _wait_until_ready(host: str, port: int, timeout: float = 15.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("API 服務未能在時限內啟動")
+            await asyncio.sleep(0.05)
+            continue
+        await _request(reader, writer, 'GET', '/health')
+        writer.close()
+        return
+
+async def _run_load(host: str, port: int, total_requests: int, concurrency: int, path: str) -> Tuple[List[float], int, float]:
+    """以多條 keep-alive 連線送出請求，回傳 (延遲秒數, 失敗數, 總耗時)"""
+    latencies: List[float] = []
+    failures = 0
+    counter = iter(range(total_requests))
+
+    async def worker():
+        nonlocal failures
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in counter:
+                payload = SELF_TEST_TRIPS[i % len(SELF_TEST_TRIPS)]
+                started = time.perf_counter()
+                status, _ = await _request(reader, writer, 'POST', path, payload)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    failures += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - started
+
+def run_self_test(total_requests: int, concurrency: int, max_batch_size: int, max_delay_ms: float) -> int:
+    """在子程序啟動服務，並對 localhost 量測各端點的吞吐量與延遲"""
+    host = DEFAULT_HOST
+    port = _free_port(host)
+    server = subprocess.Popen([
+        sys.executable, __file__, '--host', host, '--port', str(port),
+        '--max-batch-size', str(max_batch_size), '--max-delay-ms', str(max_delay_ms)
+    ])
+
+    async def run() -> int:
+        await _wait_until_ready(host, port)
+        exit_code = 0
+        print(f"自我測試：{total_requests} 個請求，{concurrency} 條並行連線")
+        print(f"{'端點':<18}{'請求/秒':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'失敗':>6}")
+        for path in ('/calculate', '/alternatives', '/recommendations'):
+            latencies, failures, elapsed = await _run_load(host, port, total_requests, concurrency, path)
+            p50, p95, p99 = (np.percentile(latencies, (50, 95, 99)) * 1000).tolist()
+            print(f"{path:<18}{total_requests / elapsed:>12,.0f}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}{failures:>6}")
+            exit_code = exit_code or int(failures > 0)
+
+        reader, writer = await asyncio.open_connection(host, port)
+        unexpected = []
+        for path in ('/calculate', '/alternatives', '/recommendations'):
+            for payload in SELF_TEST_MALFORMED:
+                status, _ = await _request(reader, writer, 'POST', path, payload)
+                if status != 400:
+                    unexpected.append(f"{path} {json.dumps(payload, ensure_ascii=False)} → {status}")
+        print(f"格式錯誤的請求：{len(SELF_TEST_MALFORMED) * 3} 個，非 400 回應 {len(unexpected)} 個")
+        for line in unexpected:
+            print(f"  {line}")
+        exit_code = exit_code or int(bool(unexpected))
+
+        _, health = await _request(reader, writer, 'GET', '/health')
+        writer.close()
+        print(f"微批次：共 {health['batches']} 批，平均 {health['mean_batch_size']} 筆，最大 {health['largest_batch']} 筆")
+        return exit_code
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡 JSON API 服務")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="微批次最大筆數")
+    parser.add_argument("--max-delay-ms", type=float, default=DEFAULT_MAX_DELAY_MS, help="微批次最長等待毫秒數")
+    parser.add_argument("--self-test", action="store_true", help="啟動本機服務並量測吞吐量與延遲")
+    parser.add_argument("--requests", type=int, default=10000, help="自我測試每個端點的請求數")
+    parser.add_argument("--concurrency", type=int, default=64, help="自我測試的並行連線數")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    if args.self_test:
+        return run_self_test(args.requests, args.concurrency, args.max_batch_size, args.max_delay_ms)
+
+    server = CarbonApiServer(MicroBatcher(max_batch_size=args.max_batch_size, max_delay_ms=args.max_delay_ms))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
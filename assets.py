@@ -0,0 +1,253 @@
+"""
+靜態資源管理模組
+將圖片以內容雜湊檔名發佈到 Streamlit 靜態檔案目錄，讓瀏覽器快取圖片，而不是每次重新執行都以 base64 內嵌傳送；
+並產生多種寬度的 WebP / JPEG 縮圖，讓行動裝置只下載符合螢幕大小的版本
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from html import escape
+from pathlib import Path
+from typing import List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # 未安裝 Pillow 時僅發佈原始圖片
+    Image = None
+
+# Streamlit 靜態檔案服務 (server.enableStaticServing) 的根目錄與網址前綴
+APP_ROOT = Path(__file__).resolve().parent
+STATIC_DIR = APP_ROOT / "static"
+STATIC_URL_PREFIX = "app/static"
+
+# 發佈後的資源存放子目錄 (內容雜湊檔名，不納入版本控制)
+PUBLISHED_ASSET_DIR = "assets"
+
+# 響應式縮圖設定：寬度 (px) 與輸出格式
+RESPONSIVE_WIDTHS = (480, 960, 1600)
+DERIVATIVE_FORMATS = {
+    'webp': {'mime_type': 'image/webp', 'save_options': {'quality': 78, 'method': 4}},
+    'jpeg': {'mime_type': 'image/jpeg', 'save_options': {'quality': 80, 'optimize': True, 'progressive': True}},
+}
+DERIVATIVE_MANIFEST = "manifest.json"
+
+def file_content_hash(path: Path, length: int = 12) -> str:
+    """計算檔案內容的 SHA-256 雜湊值 (取前 length 碼)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+def static_url(relative_path: str) -> str:
+    """將靜態目錄內的相對路徑轉換為可供瀏覽器使用的網址"""
+    return f"{STATIC_URL_PREFIX}/{relative_path}"
+
+def _resolve_source(image_path: str) -> Path:
+    """相對路徑以應用程式根目錄為基準"""
+    source = Path(image_path)
+    if not source.is_absolute():
+        source = APP_ROOT / source
+    return source
+
+def _atomic_write(destination: Path, write) -> None:
+    """先寫入暫存檔再改名，避免其他 session 讀到寫到一半的檔案"""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=destination.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _atomic_copy(source: Path, destination: Path) -> None:
+    """以原子方式複製檔案"""
+    def write(tmp_file):
+        with open(source, "rb") as src_file:
+            shutil.copyfileobj(src_file, tmp_file)
+    _atomic_write(destination, write)
+
+@lru_cache(maxsize=64)
+def publish_static_asset(image_path: str) -> Optional[str]:
+    """將圖片以內容雜湊檔名發佈到靜態目錄，回傳靜態網址 (找不到檔案時回傳 None)
+
+    檔名隨內容改變，因此網址可長期快取；同一個程序只會計算一次雜湊。
+    """
+    source = _resolve_source(image_path)
+    if not source.is_file():
+        return None
+
+    name = f"{source.stem}.{file_content_hash(source)}{source.suffix}"
+    relative_path = f"{PUBLISHED_ASSET_DIR}/{name}"
+    destination = STATIC_DIR / relative_path
+
+    if not destination.exists():
+        _atomic_copy(source, destination)
+
+    return static_url(relative_path)
+
+@dataclass(frozen=True)
+class ImageVariant:
+    """單一縮圖版本"""
+    width: int          # 寬度 (px)
+    height: int         # 高度 (px)
+    format: str         # 'webp' 或 'jpeg'
+    mime_type: str      # MIME 類型
+    url: str            # 靜態網址
+    size_bytes: int     # 檔案大小
+
+@dataclass(frozen=True)
+class ResponsiveImage:
+    """同一張圖片的所有縮圖版本"""
+    source_hash: str
+    variants: Tuple[ImageVariant, ...]
+
+    def variants_for(self, image_format: str) -> List[ImageVariant]:
+        """依寬度由小到大列出指定格式的版本"""
+        return sorted((v for v in self.variants if v.format == image_format), key=lambda v: v.width)
+
+    def srcset(self, image_format: str) -> str:
+        """產生 <img>/<source> 的 srcset 屬性值"""
+        return ", ".join(f"{v.url} {v.width}w" for v in self.variants_for(image_format))
+
+    def smallest_for_width(self, viewport_width: int, image_format: str = 'webp') -> Optional[ImageVariant]:
+        """挑選寬度足以覆蓋畫面的最小版本 (沒有夠寬的版本時取最大者)"""
+        candidates = self.variants_for(image_format)
+        for variant in candidates:
+            if variant.width >= viewport_width:
+                return variant
+        return candidates[-1] if candidates else None
+
+    def background_image_css(self, viewport_width: int, overlay: str = "") -> str:
+        """產生 CSS 背景圖宣告：先宣告 JPEG，支援 image-set 的瀏覽器改用 WebP"""
+        webp = self.smallest_for_width(viewport_width, 'webp')
+        jpeg = self.smallest_for_width(viewport_width, 'jpeg')
+        return (
+            f'background-image: {overlay}url("{jpeg.url}");\n'
+            f'        background-image: {overlay}image-set(url("{webp.url}") type("image/webp"), url("{jpeg.url}") type("image/jpeg"));'
+        )
+
+    def picture_html(self, alt: str, sizes: str = "(max-width: 768px) 100vw, 1200px", css_class: str = "responsive-image") -> str:
+        """產生讓瀏覽器依畫面寬度自動挑選最小版本的 <picture> 標籤"""
+        fallback = self.smallest_for_width(960, 'jpeg')
+        return (
+            f'<picture class="{css_class}">'
+            f'<source type="image/webp" srcset="{self.srcset("webp")}" sizes="{sizes}">'
+            f'<img src="{fallback.url}" srcset="{self.srcset("jpeg")}" sizes="{sizes}" '
+            f'width="{fallback.width}" height="{fallback.height}" alt="{escape(alt)}" '
+            f'loading="lazy" decoding="async">'
+            f'</picture>'
+        )
+
+def _load_derivative_manifest(manifest_path: Path) -> Optional[ResponsiveImage]:
+    """讀取既有的縮圖清單 (不存在或格式錯誤時回傳 None)"""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            data = json.load(f)
+        return ResponsiveImage(
+            source_hash=data['source_hash'],
+            variants=tuple(ImageVariant(**variant) for variant in data['variants'])
+        )
+    except (FileNotFoundError, KeyError, TypeError, ValueError):
+        return None
+
+def _generate_derivatives(source: Path, source_hash: str, output_dir: Path) -> ResponsiveImage:
+    """以 Pillow 產生各寬度與格式的縮圖，最後寫入清單檔"""
+    variants = []
+
+    with Image.open(source) as original:
+        image = original.convert("RGB")
+
+    # 不放大圖片：超過原圖寬度的版本以原圖寬度代替
+    widths = sorted({min(width, image.width) for width in RESPONSIVE_WIDTHS})
+
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+        for image_format, settings in DERIVATIVE_FORMATS.items():
+            extension = 'jpg' if image_format == 'jpeg' else image_format
+            relative_path = f"{source.stem}-{width}w.{extension}"
+            destination = output_dir / relative_path
+
+            _atomic_write(destination, lambda f: resized.save(f, format=image_format.upper(), **settings['save_options']))
+
+            variants.append(ImageVariant(
+                width=width,
+                height=height,
+                format=image_format,
+                mime_type=settings['mime_type'],
+                url=static_url(destination.relative_to(STATIC_DIR).as_posix()),
+                size_bytes=destination.stat().st_size,
+            ))
+
+    responsive = ResponsiveImage(source_hash=source_hash, variants=tuple(variants))
+    manifest = json.dumps({
+        'source': source.name,
+        'source_hash': source_hash,
+        'variants': [variant.__dict__ for variant in variants],
+    }, ensure_ascii=False, indent=2).encode("utf-8")
+    _atomic_write(output_dir / DERIVATIVE_MANIFEST, lambda f: f.write(manifest))
+
+    return responsive
+
+@lru_cache(maxsize=64)
+def build_image_derivatives(image_path: str) -> Optional[ResponsiveImage]:
+    """取得圖片的響應式縮圖，首次使用時產生並依原圖雜湊快取於磁碟
+
+    找不到圖片或未安裝 Pillow 時回傳 None。
+    """
+    source = _resolve_source(image_path)
+    if Image is None or not source.is_file():
+        return None
+
+    source_hash = file_content_hash(source)
+    output_dir = STATIC_DIR / PUBLISHED_ASSET_DIR / "derived" / source_hash
+
+    cached = _load_derivative_manifest(output_dir / DERIVATIVE_MANIFEST)
+    if cached is not None:
+        return cached
+
+    return _generate_derivatives(source, source_hash, output_dir)
+
+def responsive_image_html(image_path: str, alt: str, **kwargs) -> Optional[str]:
+    """產生響應式 <picture> 標籤；無法產生縮圖時退回原始圖片網址"""
+    responsive = build_image_derivatives(image_path)
+    if responsive is not None:
+        return responsive.picture_html(alt, **kwargs)
+
+    url = publish_static_asset(image_path)
+    if url is None:
+        return None
+    return f'<img class="responsive-image" src="{url}" alt="{escape(alt)}" loading="lazy" decoding="async">'
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """建置階段預先產生 images/ 目錄下所有圖片的縮圖"""
+    parser = argparse.ArgumentParser(description="產生響應式圖片縮圖")
+    parser.add_argument("images", nargs="*", help="圖片路徑 (預設為 images/ 下的所有 PNG/JPEG)")
+    args = parser.parse_args(argv)
+
+    paths = args.images or sorted(
+        str(p) for p in (APP_ROOT / "images").iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg")
+    )
+    for path in paths:
+        responsive = build_image_derivatives(path)
+        if responsive is None:
+            print(f"略過 {path} (找不到檔案或未安裝 Pillow)")
+            continue
+        original_size = _resolve_source(path).stat().st_size
+        print(f"{path} ({original_size / 1024:.0f} KB)")
+        for variant in responsive.variants:
+            print(f"  {variant.format:>4} {variant.width:>5}w  {variant.size_bytes / 1024:>7.1f} KB  {variant.url}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+碳足跡批次計算命令列工具
+從 CSV 或 JSONL (檔案或標準輸入) 讀取旅程資料，以固定大小的區塊驗證與計算，並串流輸出結果與逐列錯誤
+
+用法：
+    python batch_cli.py bookings.csv -o results.csv --errors errors.jsonl
+    cat bookings.jsonl | python batch_cli.py - --input-format jsonl > results.jsonl
+    python batch_cli.py bookings.csv -o results.csv --profile
+    python batch_cli.py bookings.csv -o results.csv --store trips_store
+"""
+
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions import (
+    CITY_DISTANCES,
+    COFFEE_OPTIONS,
+    DINING_OPTIONS,
+    NANTOU_ROUTES,
+    TRANSPORT_OPTIONS,
+    NantouCarbonCalculator,
+    NantouTripValidator,
+    get_recommendation_engine
+)
+from profiling import capture_profile, format_stats
+from trip_store import TripStore
+
+# 旅程輸入欄位 (與 NantouTripValidator.validate_trip_input 檢查的欄位相同，另含用餐與咖啡)
+INPUT_FIELDS = ('route_option', 'traveler_count', 'transport_mode', 'departure_city', 'dining_choice', 'coffee_choice')
+
+DEFAULT_CHUNK_SIZE = 10000
+
+@dataclass
+class BatchSummary:
+    """批次執行統計"""
+    rows: int = 0
+    calculated: int = 0
+    errors: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+def detect_format(path: str, requested: str) -> str:
+    """依參數或副檔名判斷檔案格式 (標準輸入預設為 CSV)"""
+    if requested != 'auto':
+        return requested
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_chunks(stream: TextIO, input_format: str, chunk_size: int) -> Iterator[Tuple[List[int], pd.DataFrame, List[Dict]]]:
+    """逐區塊讀取輸入，產生 (列號, 旅程欄位 DataFrame, 解析錯誤)"""
+    if input_format == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [name.strip() for name in header]
+        row_number = 0
+        # 與 JSONL 相同略過空白列
+        csv_rows = (row for row in reader if row)
+        while True:
+            rows_chunk = list(islice(csv_rows, chunk_size))
+            if not rows_chunk:
+                return
+            row_numbers = []
+            rows = []
+            errors = []
+            for row in rows_chunk:
+                row_number += 1
+                if len(row) != len(header):
+                    # 欄位數與標題列不一致的列不猜測對應方式，整列回報錯誤
+                    errors.append({'row_number': row_number,
+                                   'errors': [f"欄位數與標題列不符: 應為 {len(header)} 欄，實際 {len(row)} 欄"]})
+                    continue
+                row_numbers.append(row_number)
+                rows.append(row)
+            frame = pd.DataFrame(rows, columns=header, dtype=object)
+            yield row_numbers, frame.reindex(columns=INPUT_FIELDS), errors
+        return
+
+    row_number = 0
+    lines = (line for line in stream if line.strip())
+    while True:
+        lines_chunk = list(islice(lines, chunk_size))
+        if not lines_chunk:
+            return
+        row_numbers = []
+        records = []
+        errors = []
+        for line in lines_chunk:
+            row_number += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                errors.append({'row_number': row_number, 'errors': [f"無法解析的 JSON: {e.msg}"]})
+                continue
+            if not isinstance(record, dict):
+                errors.append({'row_number': row_number, 'errors': ["每一列必須是 JSON 物件"]})
+                continue
+            row_numbers.append(row_number)
+            records.append(record)
+        yield row_numbers, pd.DataFrame.from_records(records, columns=INPUT_FIELDS), errors
+
+def _parse_traveler_count(value) -> Tuple[int, Optional[str]]:
+    """解析旅遊人數，接受整數值的數字或字串"""
+    if value is None or isinstance(value, bool):
+        return 0, None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0, f"旅遊人數必須為整數: {value}"
+    if not number.is_integer():
+        return 0, f"旅遊人數必須為整數: {value}"
+    return int(number), None
+
+def normalize_record(record: dict) -> Tuple[dict, List[str]]:
+    """整理單列輸入欄位並驗證，回傳 (旅程資料, 錯誤訊息)"""
+    trip_data = {}
+    for field in INPUT_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        trip_data[field] = None if value is None or value == '' or value != value else value
+
+    trip_data['traveler_count'], count_error = _parse_traveler_count(trip_data['traveler_count'])
+
+    # 選項必須是文字；JSON 的陣列或物件無法用於選項查表，直接回報錯誤
+    type_errors = [
+        f"{field} 必須為文字: {json.dumps(trip_data[field], ensure_ascii=False, default=str)}"
+        for field in OPTION_FIELDS
+        if trip_data[field] is not None and not isinstance(trip_data[field], str)
+    ]
+    if type_errors:
+        return trip_data, type_errors + ([count_error] if count_error else [])
+
+    errors = NantouTripValidator.validate_trip_input(trip_data)
+    if count_error:
+        # 無法解析的人數以解析錯誤取代範圍錯誤
+        errors = [count_error] + [e for e in errors if not e.startswith("旅遊人數")]
+    errors.extend(NantouTripValidator.validate_trip_options(trip_data))
+
+    trip_data['dining_choice'] = trip_data['dining_choice'] or 'local_meat'
+    trip_data['coffee_choice'] = trip_data['coffee_choice'] or 'black_coffee'
+    return trip_data, errors
+
+# 各選項欄位的有效值
+OPTION_FIELDS = {
+    'route_option': list(NANTOU_ROUTES),
+    'transport_mode': list(TRANSPORT_OPTIONS),
+    'departure_city': list(CITY_DISTANCES),
+    'dining_choice': list(DINING_OPTIONS),
+    'coffee_choice': list(COFFEE_OPTIONS),
+}
+
+def _strip_value(value):
+    """去除字串前後空白，空字串視為缺值"""
+    if isinstance(value, str):
+        return value.strip() or None
+    return value
+
+def _normalize_option_column(column: pd.Series, allowed: List[str]) -> pd.Series:
+    """整理選項欄位：已是有效值的列不需處理，其餘列才去除空白"""
+    unmatched = ~column.isin(allowed)
+    if unmatched.any():
+        column = column.copy()
+        column[unmatched] = column[unmatched].map(_strip_value)
+    return column
+
+def normalize_chunk(frame: pd.DataFrame, row_numbers: List[int]) -> Tuple[pd.DataFrame, List[int], List[Dict]]:
+    """向量化驗證整個區塊；只有未通過的列才逐列檢查以產生錯誤訊息"""
+    columns = {
+        field: _normalize_option_column(frame[field].astype(object), allowed)
+        for field, allowed in OPTION_FIELDS.items()
+    }
+
+    raw_counts = frame['traveler_count'].astype(object)
+    counts = pd.to_numeric(raw_counts.where(raw_counts.map(type) != bool), errors='coerce')
+    # inf (CSV 的 "inf" 或 JSON 的 1e400) 與缺值同樣視為無效人數，交由逐列檢查產生錯誤訊息
+    counts = counts.where(np.isfinite(counts))
+    dining = columns['dining_choice']
+    coffee = columns['coffee_choice']
+
+    valid = (
+        columns['route_option'].isin(OPTION_FIELDS['route_option'])
+        & columns['transport_mode'].isin(OPTION_FIELDS['transport_mode'])
+        & columns['departure_city'].isin(OPTION_FIELDS['departure_city'])
+        & (dining.isna() | dining.isin(OPTION_FIELDS['dining_choice']))
+        & (coffee.isna() | coffee.isin(OPTION_FIELDS['coffee_choice']))
+        & counts.notna() & (counts % 1 == 0) & (counts >= 1) & (counts <= 50)
+    ).to_numpy()
+
+    trips = pd.DataFrame({
+        'route_option': columns['route_option'],
+        'traveler_count': counts.fillna(0).astype('int64'),
+        'transport_mode': columns['transport_mode'],
+        'departure_city': columns['departure_city'],
+        'dining_choice': dining.fillna('local_meat'),
+        'coffee_choice': coffee.fillna('black_coffee'),
+    })
+
+    errors = []
+    row_numbers = np.asarray(row_numbers, dtype=np.int64)
+    for position in np.flatnonzero(~valid):
+        trip_data, row_errors = normalize_record(frame.iloc[position].to_dict())
+        if row_errors:
+            errors.append({'row_number': int(row_numbers[position]), 'errors': row_errors})
+        else:
+            valid[position] = True
+            trips.iloc[position] = pd.Series(trip_data)
+
+    return trips[valid].reset_index(drop=True), row_numbers[valid].tolist(), errors
+
+class ResultWriter:
+    """將每個區塊的計算結果串流寫出 (CSV 只在第一個區塊寫入標題列)"""
+
+    def __init__(self, stream: TextIO, output_format: str):
+        self.stream = stream
+        self.output_format = output_format
+        self._csv_writer = csv.writer(stream) if output_format == 'csv' else None
+        self._json_encoder = json.JSONEncoder(ensure_ascii=False)
+        self._header_written = False
+
+    def write(self, results: pd.DataFrame) -> None:
+        if results.empty:
+            return
+
+        # 整批共用同一個計算時間，只需格式化一次
+        results = results.assign(calculated_at=results['calculated_at'].iloc[0].isoformat())
+
+        if self.output_format == 'csv':
+            if not self._header_written:
+                self._csv_writer.writerow(results.columns)
+                self._header_written = True
+            # csv 模組以 repr 格式化浮點數，保留完整精度且比 DataFrame.to_csv 快
+            self._csv_writer.writerows(zip(*(results[name].tolist() for name in results.columns)))
+        else:
+            # json 模組同樣以最短 repr 表示浮點數，與 CSV 輸出一致
+            columns = results.columns.tolist()
+            encode = self._json_encoder.encode
+            self.stream.writelines(
+                encode(dict(zip(columns, row))) + '\n'
+                for row in zip(*(results[name].tolist() for name in columns))
+            )
+
+def process_chunk(row_numbers: List[int], frame: pd.DataFrame, calculator: NantouCarbonCalculator,
+                  with_recommendations: bool = False) -> Tuple[pd.DataFrame, List[Dict]]:
+    """驗證並計算一個區塊，回傳 (計算結果, 錯誤列)"""
+    trips, valid_row_numbers, errors = normalize_chunk(frame, row_numbers)
+
+    if trips.empty:
+        return pd.DataFrame(), errors
+
+    results = calculator.calculate_batch(trips)
+    results.insert(0, 'row_number', valid_row_numbers)
+
+    if with_recommendations:
+        results['recommendation_id'] = get_recommendation_engine().assign_recommendation_ids(
+            results['dining_choice'].to_numpy(),
+            results['coffee_choice'].to_numpy(),
+            results['transport_mode'].to_numpy(),
+            results['per_person_emissions'].to_numpy()
+        )
+
+    return results, errors
+
+def run_batch(input_stream: TextIO, output_stream: TextIO, error_stream: TextIO,
+              input_format: str = 'csv', output_format: str = 'csv',
+              chunk_size: int = DEFAULT_CHUNK_SIZE, with_recommendations: bool = False,
+              store: Optional[TripStore] = None) -> BatchSummary:
+    """串流處理整個輸入，記憶體用量只與區塊大小有關；指定 store 時同時附加到欄式儲存區"""
+    calculator = NantouCarbonCalculator()
+    writer = ResultWriter(output_stream, output_format)
+    summary = BatchSummary()
+    started = time.perf_counter()
+
+    for row_numbers, frame, parse_errors in read_chunks(input_stream, input_format, chunk_size):
+        results, errors = process_chunk(row_numbers, frame, calculator, with_recommendations)
+        writer.write(results)
+        if store is not None:
+            store.append_frame(results, calculator.factor_snapshot)
+
+        all_errors = sorted(parse_errors + errors, key=lambda error: error['row_number'])
+        for error in all_errors:
+            error_stream.write(json.dumps(error, ensure_ascii=False) + '\n')
+
+        summary.rows += len(row_numbers) + len(parse_errors)
+        summary.calculated += len(results)
+        summary.errors += len(all_errors)
+
+    output_stream.flush()
+    error_stream.flush()
+    summary.elapsed_seconds = time.perf_counter() - started
+    return summary
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡批次計算")
+    parser.add_argument("input", nargs="?", default="-", help="輸入檔案路徑 (預設或 '-' 為標準輸入)")
+    parser.add_argument("-o", "--output", default="-", help="輸出檔案路徑 (預設為標準輸出)")
+    parser.add_argument("--errors", default=None, help="錯誤列輸出路徑 (JSONL，預設為標準錯誤)")
+    parser.add_argument("--input-format", choices=("auto", "csv", "jsonl"), default="auto")
+    parser.add_argument("--output-format", choices=("auto", "csv", "jsonl"), default="auto",
+                        help="輸出格式 (預設依輸出副檔名，否則與輸入相同)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每個區塊的列數")
+    parser.add_argument("--with-recommendations", action="store_true", help="加入建議編號欄位")
+    parser.add_argument("--strict", action="store_true", help="有任何錯誤列時以狀態碼 1 結束")
+    parser.add_argument("--store", default=None, help="同時將計算結果附加到此欄式儲存區目錄 (不存在時建立)")
+    parser.add_argument("--profile", action="store_true",
+                        help="剖析整個批次工作，輸出 .prof 與火焰圖用的 .collapsed 檔")
+    parser.add_argument("--profile-dir", default=None, help="剖析輸出目錄 (預設為 NANTOU_PROFILE_DIR 或 profiles)")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    if args.chunk_size <= 0:
+        raise SystemExit("--chunk-size 必須大於 0")
+
+    input_format = detect_format(args.input, args.input_format)
+    if args.output_format != 'auto':
+        output_format = args.output_format
+    elif args.output != '-':
+        output_format = detect_format(args.output, 'auto')
+    else:
+        output_format = input_format
+
+    input_stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8-sig', newline='')
+    output_stream = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    error_stream = sys.stderr if args.errors is None else open(args.errors, 'w', encoding='utf-8')
+
+    try:
+        with capture_profile('batch_cli', enabled=args.profile, output_dir=args.profile_dir) as capture:
+            summary = run_batch(
+                input_stream, output_stream, error_stream,
+                input_format=input_format,
+                output_format=output_format,
+                chunk_size=args.chunk_size,
+                with_recommendations=args.with_recommendations,
+                store=TripStore(args.store, create=True) if args.store else None
+            )
+    finally:
+        for stream, path in ((input_stream, args.input), (output_stream, args.output)):
+            if path != '-':
+                stream.close()
+        if args.errors is not None:
+            error_stream.close()
+
+    print(
+        f"完成：{summary.rows} 列，成功 {summary.calculated} 列，錯誤 {summary.errors} 列，"
+        f"耗時 {summary.elapsed_seconds:.2f} 秒 ({summary.rows_per_second:,.0f} 列/秒)",
+        file=sys.stderr
+    )
+    if capture is not None:
+        print(f"剖析結果：{capture.result.prof_path}、{capture.result.collapsed_path} "
+              f"(取樣 {capture.result.samples} 次)", file=sys.stderr)
+        print(format_stats(capture.result.prof_path, limit=15), file=sys.stderr)
+    return 1 if args.strict and summary.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
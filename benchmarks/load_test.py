@@ -0,0 +1,266 @@
+"""
+多使用者並行負載測試
+以 Streamlit AppTest 代替瀏覽器，讓 N 個模擬 session 同時走完 v1.py 的實際流程
+(開啟頁面、填寫 trip_form 並送出、切換到計算結果)，回報各並行數下的重新執行延遲 p50/p95/p99、吞吐量與記憶體用量。
+所有 session 在同一個程序內以執行緒執行，與 Streamlit 伺服器為每個 session 使用一個執行緒的方式相同。
+
+用法：
+    python benchmarks/load_test.py --concurrency 1 4 8 16 32 --flows 3
+    python benchmarks/load_test.py --concurrency 8 --output load_test.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np  # noqa: E402
+import streamlit.logger  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.runtime.runtime import Runtime  # noqa: E402
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.testing.v1 import app_test as app_test_module  # noqa: E402
+from streamlit.testing.v1 import local_script_runner  # noqa: E402
+from streamlit.testing.v1.util import patch_config_options  # noqa: E402
+
+from functions import CITY_DISTANCES, COFFEE_OPTIONS, DINING_OPTIONS, NANTOU_ROUTES, TRANSPORT_OPTIONS  # noqa: E402
+
+APP_PATH = os.path.join(REPO_ROOT, 'v1.py')
+
+# 表單欄位標籤 (v1.py 的 trip_form)
+ROUTE_LABEL = "🗺️ 選擇您的國姓印象"
+TRANSPORT_LABEL = "🚙 選擇交通工具"
+CITY_LABEL = "🏙️ 您的出發城市"
+DINING_LABEL = "🥘 用餐選擇 (午餐)"
+COFFEE_LABEL = "☕ 咖啡品味"
+TRAVELER_LABEL = "👥 旅遊人數"
+
+# 每個流程的步驟 (每一步都是一次重新執行)
+FLOW_STEPS = ('open', 'submit', 'results')
+
+RSS_SAMPLE_SECONDS = 0.05
+
+def current_rss_bytes() -> int:
+    """目前程序的常駐記憶體 (Linux 讀取 /proc，其他平台退回峰值)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class RssSampler:
+    """在背景定期取樣記憶體用量，記錄期間的峰值"""
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def __enter__(self) -> 'RssSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+@dataclass
+class LevelReport:
+    """單一並行數的測試結果 (延遲以毫秒為單位)"""
+    concurrency: int
+    flows: int
+    reruns: int
+    errors: int
+    elapsed_seconds: float
+    reruns_per_second: float
+    flows_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    step_p95_ms: Dict[str, float] = field(default_factory=dict)
+    rss_before_mb: float = 0.0
+    rss_peak_mb: float = 0.0
+    rss_after_mb: float = 0.0
+
+class SharedTestRuntime:
+    """讓多個 AppTest 在同一程序內並行執行
+
+    AppTest 每次執行都會設定並在結束時清除全域的 Runtime 實例，先結束的 session 會讓其他仍在執行的
+    session 找不到 Runtime。期間改為在全域實例被清除時沿用最近一次設定的模擬 Runtime，
+    並保持 global.appTest 開啟 (否則 widget 的格式化函數不會被記錄)。
+    另外與實際伺服器相同，所有 session 共用一份編譯好的腳本，而不是每次執行各自編譯：
+    實際執行腳本的 LocalScriptRunner 會自行建立 ScriptCache，因此兩個模組都要替換。
+    ScriptCache 在編譯時持有鎖，共用後腳本只會編譯一次，也避免多個執行緒同時 compile()
+    (CPython 3.11 並行編譯偶爾會出現 "AST constructor recursion depth mismatch")。
+    """
+
+    def __enter__(self) -> 'SharedTestRuntime':
+        self._original_instance = Runtime.__dict__['instance']
+        self._original_script_caches = (app_test_module.ScriptCache, local_script_runner.ScriptCache)
+        shared_script_cache = ScriptCache()
+        app_test_module.ScriptCache = local_script_runner.ScriptCache = lambda: shared_script_cache
+        self._config_patch = patch_config_options({'global.appTest': True})
+        self._config_patch.__enter__()
+        last_runtime = []
+
+        def instance(cls):
+            if cls._instance is not None:
+                last_runtime[:] = [cls._instance]
+                return cls._instance
+            if last_runtime:
+                return last_runtime[0]
+            raise RuntimeError("Runtime hasn't been created!")
+
+        Runtime.instance = classmethod(instance)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        Runtime.instance = self._original_instance
+        app_test_module.ScriptCache, local_script_runner.ScriptCache = self._original_script_caches
+        self._config_patch.__exit__(*exc_info)
+
+def _widget(widgets, label: str):
+    return next(widget for widget in widgets if widget.label == label)
+
+def run_flow(rng: random.Random, latencies: Dict[str, List[float]]) -> int:
+    """模擬一位遊客的完整流程，回傳發生錯誤的重新執行次數 (發生錯誤時停止此流程)"""
+
+    def timed(step: str, action) -> bool:
+        started = time.perf_counter()
+        app_test = action()
+        latencies[step].append(time.perf_counter() - started)
+        # 執行失敗時頁面不完整，後續步驟找不到 widget，因此不再繼續
+        return not app_test.exception
+
+    app_test = AppTest.from_file(APP_PATH, default_timeout=60)
+    if not timed('open', app_test.run):
+        return 1
+
+    _widget(app_test.selectbox, ROUTE_LABEL).set_value(rng.choice(list(NANTOU_ROUTES)))
+    _widget(app_test.selectbox, TRANSPORT_LABEL).set_value(rng.choice(list(TRANSPORT_OPTIONS)))
+    _widget(app_test.selectbox, CITY_LABEL).set_value(rng.choice(list(CITY_DISTANCES)))
+    _widget(app_test.selectbox, DINING_LABEL).set_value(rng.choice(list(DINING_OPTIONS)))
+    _widget(app_test.selectbox, COFFEE_LABEL).set_value(rng.choice(list(COFFEE_OPTIONS)))
+    _widget(app_test.number_input, TRAVELER_LABEL).set_value(rng.randint(1, 12))
+    if not timed('submit', lambda: app_test.button[0].click().run()):
+        return 1
+
+    if not timed('results', lambda: app_test.radio(key='active_view').set_value('results').run()):
+        return 1
+    return 0
+
+def run_level(concurrency: int, flows_per_session: int, seed: int) -> LevelReport:
+    """以指定並行數執行所有 session，每個 session 連續走完數次流程"""
+    latencies = {step: [] for step in FLOW_STEPS}
+    errors = 0
+    errors_lock = threading.Lock()
+
+    def session(session_id: int) -> None:
+        nonlocal errors
+        rng = random.Random(seed * 100003 + session_id)
+        for _ in range(flows_per_session):
+            flow_errors = run_flow(rng, latencies)
+            with errors_lock:
+                errors += flow_errors
+
+    rss_before = current_rss_bytes()
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(session, range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = np.array([value for values in latencies.values() for value in values]) * 1000
+    p50, p95, p99 = np.percentile(all_latencies, (50, 95, 99)).tolist()
+    flows = concurrency * flows_per_session
+    return LevelReport(
+        concurrency=concurrency,
+        flows=flows,
+        reruns=len(all_latencies),
+        errors=errors,
+        elapsed_seconds=elapsed,
+        reruns_per_second=len(all_latencies) / elapsed,
+        flows_per_second=flows / elapsed,
+        p50_ms=p50,
+        p95_ms=p95,
+        p99_ms=p99,
+        max_ms=float(all_latencies.max()),
+        step_p95_ms={step: float(np.percentile(values, 95)) * 1000 for step, values in latencies.items() if values},
+        rss_before_mb=rss_before / 2**20,
+        rss_peak_mb=sampler.peak / 2**20,
+        rss_after_mb=current_rss_bytes() / 2**20,
+    )
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡計算器並行負載測試")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16], help="依序測試的並行 session 數")
+    parser.add_argument("--flows", type=int, default=3, help="每個 session 連續執行的流程次數")
+    parser.add_argument("--seed", type=int, default=0, help="隨機選項的種子")
+    parser.add_argument("--p95-budget-ms", type=float, default=1000.0, help="可接受的 p95 重新執行延遲")
+    parser.add_argument("--output", default=None, help="結果 JSON 路徑")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    # v1.py 以相對路徑讀取圖片
+    os.chdir(REPO_ROOT)
+
+    with SharedTestRuntime():
+        return run_load_test(args)
+
+def run_load_test(args: argparse.Namespace) -> int:
+    """依序執行各並行數並輸出報告"""
+    # 預熱：載入模組並建立各程序共用的快取，避免第一個並行數承擔冷啟動成本
+    run_flow(random.Random(args.seed), {step: [] for step in FLOW_STEPS})
+    # 預熱後所有 Streamlit logger 都已建立，一併調高層級以免棄用警告淹沒報告
+    streamlit.logger.set_log_level('error')
+
+    print(f"{'並行':>6}{'重新執行':>10}{'次/秒':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'錯誤':>6}{'RSS 峰值 MB':>14}")
+    reports = []
+    for concurrency in args.concurrency:
+        report = run_level(concurrency, args.flows, args.seed)
+        reports.append(report)
+        print(f"{report.concurrency:>6}{report.reruns:>12}{report.reruns_per_second:>11.1f}"
+              f"{report.p50_ms:>9.1f}{report.p95_ms:>9.1f}{report.p99_ms:>9.1f}{report.errors:>6}"
+              f"{report.rss_peak_mb:>14.1f}", flush=True)
+
+    within_budget = [r.concurrency for r in reports if r.p95_ms <= args.p95_budget_ms and not r.errors]
+    if within_budget:
+        print(f"\np95 ≤ {args.p95_budget_ms:.0f} ms 時可支援的最大並行數：{max(within_budget)}")
+    else:
+        print(f"\n所有並行數的 p95 都超過 {args.p95_budget_ms:.0f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'p95_budget_ms': args.p95_budget_ms,
+                'max_concurrency_within_budget': max(within_budget) if within_budget else None,
+                'levels': [asdict(report) for report in reports],
+            }, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+    return 1 if any(report.errors for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
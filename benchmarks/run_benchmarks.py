@@ -0,0 +1,421 @@
+"""
+效能基準測試
+量測計算引擎、建議產生、結果格式化、樣式與圖片載入，以及 v1.py 透過 Streamlit AppTest 的完整重新執行；
+結果輸出為 JSON，並與基準檔比較，變慢或重新執行內容膨脹超過門檻時標示為退化
+
+用法：
+    python benchmarks/run_benchmarks.py                      # 執行並與 benchmarks/baseline.json 比較
+    python benchmarks/run_benchmarks.py --save-baseline      # 將本次結果存為新的基準
+    python benchmarks/run_benchmarks.py --only recommendations --fail-on-regression
+
+基準檔記錄產生時的 git commit。新增或改變每次重新執行都會做的工作 (或更換量測機器) 後，
+確認新的數字符合預期，再以 --save-baseline 重新產生並與該變更一起提交，之後的比較才有意義。
+"""
+
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from functions import (  # noqa: E402
+    CITY_DISTANCES,
+    COFFEE_OPTIONS,
+    DINING_OPTIONS,
+    NANTOU_ROUTES,
+    TRANSPORT_OPTIONS,
+    EcoRecommendationEngine,
+    NantouCarbonCalculator,
+    NantouTripCalculation,
+    _transport_alternatives,
+    _transport_totals,
+    format_nantou_trip_result
+)
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'latest.json')
+
+# 引擎函數的輸入規模 (每次量測處理的旅程數)
+ENGINE_SIZES = (1, 100, 1000)
+BATCH_SIZES = (1000, 100000)
+
+# 每次重複至少執行這麼久，短時間的操作會自動重複多次
+MIN_REPEAT_SECONDS = 0.05
+
+# 中位數或內容大小超過基準的此倍數視為退化
+DEFAULT_THRESHOLD = 1.25
+
+@dataclass
+class BenchmarkCase:
+    """一個基準測試項目：make() 完成準備並回傳要計時的函數"""
+    name: str
+    size: int
+    make: Callable[[], Callable[[], object]]
+    repeats: int = 7
+    group: str = 'engine'
+
+@dataclass
+class BenchmarkResult:
+    """單一項目的量測結果 (秒為單位，為每次呼叫的時間)"""
+    name: str
+    size: int
+    group: str
+    repeats: int
+    number: int
+    median: float
+    minimum: float
+    mean: float
+    stdev: float
+    per_item_us: float
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+def sample_trip_inputs(count: int) -> List[dict]:
+    """依固定順序輪流取用所有選項組合，產生可重現的旅程輸入"""
+    combinations = itertools.cycle(itertools.product(
+        NANTOU_ROUTES, TRANSPORT_OPTIONS, CITY_DISTANCES, DINING_OPTIONS, COFFEE_OPTIONS
+    ))
+    inputs = []
+    for index, (route, transport, city, dining, coffee) in zip(range(count), combinations):
+        inputs.append({
+            'route_option': route,
+            'traveler_count': index % 50 + 1,
+            'transport_mode': transport,
+            'departure_city': city,
+            'dining_choice': dining,
+            'coffee_choice': coffee,
+        })
+    return inputs
+
+def calculated_trips(count: int) -> List[NantouTripCalculation]:
+    calculator = NantouCarbonCalculator()
+    return [calculator.calculate_total_emissions(NantouTripCalculation(**trip)) for trip in sample_trip_inputs(count)]
+
+def time_case(case: BenchmarkCase) -> BenchmarkResult:
+    """計時單一項目：自動決定每次重複的呼叫次數，取多次重複的統計值"""
+    func = case.make()
+    func()  # 預熱 (載入模組、建立快取)
+
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_REPEAT_SECONDS or number >= 1 << 20:
+            break
+        number *= 10 if elapsed < MIN_REPEAT_SECONDS / 10 else 2
+
+    timings = [elapsed / number]
+    for _ in range(case.repeats - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started) / number)
+
+    median = statistics.median(timings)
+    return BenchmarkResult(
+        name=case.name,
+        size=case.size,
+        group=case.group,
+        repeats=case.repeats,
+        number=number,
+        median=median,
+        minimum=min(timings),
+        mean=statistics.fmean(timings),
+        stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        per_item_us=median / max(case.size, 1) * 1e6,
+        metrics=dict(getattr(func, 'metrics', {})),
+    )
+
+def engine_cases() -> List[BenchmarkCase]:
+    """計算引擎、替代方案、建議與格式化"""
+    cases = []
+
+    for size in ENGINE_SIZES:
+        def make_calculate(size=size):
+            calculator = NantouCarbonCalculator()
+            trips = [NantouTripCalculation(**trip) for trip in sample_trip_inputs(size)]
+            def run():
+                for trip in trips:
+                    calculator.calculate_total_emissions(trip)
+            return run
+
+        def make_alternatives(size=size, cached=False):
+            engine = EcoRecommendationEngine()
+            trips = calculated_trips(size)
+            def run():
+                if not cached:
+                    # 清除快取，量測實際計算而不是快取命中
+                    _transport_alternatives.cache_clear()
+                    _transport_totals.cache_clear()
+                for trip in trips:
+                    engine.generate_transport_alternatives(trip.transport_mode, trip.total_emissions, trip)
+            return run
+
+        def make_recommendations(size=size):
+            engine = EcoRecommendationEngine()
+            trips = calculated_trips(size)
+            def run():
+                for trip in trips:
+                    engine.generate_personalized_recommendations(trip)
+            return run
+
+        def make_format(size=size):
+            trips = calculated_trips(size)
+            def run():
+                for trip in trips:
+                    format_nantou_trip_result(trip)
+            return run
+
+        cases.extend([
+            BenchmarkCase('calculate_total_emissions', size, make_calculate),
+            BenchmarkCase('generate_transport_alternatives', size, make_alternatives),
+            # 重新執行同一旅程時的快取命中
+            BenchmarkCase('generate_transport_alternatives_cached', size,
+                          lambda size=size: make_alternatives(size, cached=True)),
+            BenchmarkCase('generate_personalized_recommendations', size, make_recommendations),
+            BenchmarkCase('format_nantou_trip_result', size, make_format),
+        ])
+
+    for size in BATCH_SIZES:
+        def make_batch(size=size):
+            import pandas as pd
+            calculator = NantouCarbonCalculator()
+            trips = pd.DataFrame(sample_trip_inputs(size))
+            return lambda: calculator.calculate_batch(trips)
+        cases.append(BenchmarkCase('calculate_batch', size, make_batch, repeats=5))
+
+    return cases
+
+def _import_app():
+    """以 bare mode 匯入 v1.py (關閉 Streamlit 在非執行環境下的警告)"""
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+    import v1
+    streamlit.logger.set_log_level('error')
+    return v1
+
+def asset_cases() -> List[BenchmarkCase]:
+    """樣式與圖片載入"""
+    def make_base64():
+        app = _import_app()
+        image_path = os.path.join(REPO_ROOT, app.HERO_IMAGE_PATH)
+        def run():
+            return app.get_base64_image(image_path)
+        run.metrics = {'image_bytes': os.path.getsize(image_path)}
+        return run
+
+    def make_build_css():
+        app = _import_app()
+        def run():
+            # 清除快取以量測實際產生樣式的成本
+            app.build_css.clear()
+            return app.build_css()
+        run.metrics = {'css_bytes': len(app.build_css().encode('utf-8'))}
+        return run
+
+    def make_load_css():
+        app = _import_app()
+        return app.load_css
+
+    return [
+        BenchmarkCase('get_base64_image', 1, make_base64, group='assets'),
+        BenchmarkCase('build_css_cold', 1, make_build_css, group='assets'),
+        BenchmarkCase('load_css', 1, make_load_css, group='assets'),
+    ]
+
+def count_elements(node) -> int:
+    """計算 AppTest 元素樹中的元素數"""
+    children = getattr(node, 'children', None)
+    if not children:
+        return 1
+    return 1 + sum(count_elements(child) for child in children.values())
+
+def markdown_bytes(app_test) -> int:
+    """所有 markdown 元素的內容大小 (重新執行傳送的 HTML 量)"""
+    return sum(len(element.value.encode('utf-8')) for element in app_test.markdown)
+
+def apptest_cases() -> List[BenchmarkCase]:
+    """v1.py 的完整重新執行 (Streamlit AppTest)
+
+    AppTest 每次執行預設各自建立 ScriptCache，每次都重新解析與編譯 v1.py；實際伺服器每個程序只編譯一次，
+    因此所有執行共用一份 ScriptCache (與 load_test.py 的 SharedTestRuntime 相同)，量測的只有腳本執行本身。
+    """
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1 import app_test as app_test_module
+    from streamlit.testing.v1 import local_script_runner
+
+    shared_script_cache = ScriptCache()
+    app_test_module.ScriptCache = local_script_runner.ScriptCache = lambda: shared_script_cache
+
+    app_path = os.path.join(REPO_ROOT, 'v1.py')
+
+    def new_app():
+        app_test = AppTest.from_file(app_path, default_timeout=30)
+        app_test.run()
+        return app_test
+
+    def with_metrics(run, app_test):
+        run.metrics = {
+            'elements': count_elements(app_test._tree),
+            'markdown_bytes': markdown_bytes(app_test),
+        }
+        return run
+
+    def make_initial_run():
+        def run():
+            return new_app()
+        return with_metrics(run, new_app())
+
+    def make_view_rerun(view):
+        def make():
+            app_test = new_app()
+            app_test.radio(key='active_view').set_value(view).run()
+            def run():
+                app_test.run()
+            return with_metrics(run, app_test)
+        return make
+
+    def make_submit():
+        app_test = new_app()
+        def run():
+            app_test.button[0].click().run()
+        run()
+        return with_metrics(run, app_test)
+
+    def make_results_rerun():
+        app_test = new_app()
+        app_test.button[0].click().run()
+        app_test.radio(key='active_view').set_value('results').run()
+        def run():
+            app_test.run()
+        return with_metrics(run, app_test)
+
+    cases = [BenchmarkCase('apptest_initial_run', 1, make_initial_run, repeats=9, group='apptest')]
+    for view in ('calculator', 'routes', 'about'):
+        cases.append(BenchmarkCase(f'apptest_rerun_{view}', 1, make_view_rerun(view), repeats=9, group='apptest'))
+    cases.append(BenchmarkCase('apptest_submit_calculation', 1, make_submit, repeats=9, group='apptest'))
+    cases.append(BenchmarkCase('apptest_rerun_results', 1, make_results_rerun, repeats=9, group='apptest'))
+    return cases
+
+def case_key(name: str, size: int) -> str:
+    return f"{name}[{size}]"
+
+def environment_info() -> dict:
+    """記錄執行環境，比較不同機器的結果時作為參考"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def compare_to_baseline(results: List[BenchmarkResult], baseline: dict, threshold: float) -> List[dict]:
+    """比較中位數時間與內容大小，回傳每個項目的比較結果"""
+    baseline_results = {case_key(r['name'], r['size']): r for r in baseline.get('results', [])}
+    comparisons = []
+    for result in results:
+        previous = baseline_results.get(case_key(result.name, result.size))
+        if previous is None:
+            continue
+        ratio = result.median / previous['median'] if previous['median'] else float('inf')
+        regressions = []
+        if ratio > threshold:
+            regressions.append(f"median x{ratio:.2f}")
+        for metric, value in result.metrics.items():
+            previous_value = previous.get('metrics', {}).get(metric)
+            if previous_value and value / previous_value > threshold:
+                regressions.append(f"{metric} x{value / previous_value:.2f}")
+        comparisons.append({
+            'key': case_key(result.name, result.size),
+            'ratio': ratio,
+            'regressions': regressions,
+        })
+    return comparisons
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} µs"
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡計算器效能基準測試")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="結果 JSON 路徑")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準 JSON 路徑")
+    parser.add_argument("--save-baseline", action="store_true", help="將本次結果寫入基準檔")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="判定退化的倍數門檻")
+    parser.add_argument("--only", default=None, help="只執行名稱包含此字串的項目")
+    parser.add_argument("--skip-apptest", action="store_true", help="略過 Streamlit AppTest 項目")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有退化時以狀態碼 1 結束")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    # v1.py 以相對路徑讀取圖片
+    os.chdir(REPO_ROOT)
+
+    cases = engine_cases() + asset_cases()
+    if not args.skip_apptest:
+        cases += apptest_cases()
+    if args.only:
+        cases = [case for case in cases if args.only in case.name]
+
+    results = []
+    for case in cases:
+        result = time_case(case)
+        results.append(result)
+        extra = ''.join(f"  {name}={value:,.0f}" for name, value in result.metrics.items())
+        print(f"{case_key(case.name, case.size):<48}{format_seconds(result.median):>12}"
+              f"  ±{format_seconds(result.stdev):>10}{extra}", flush=True)
+
+    report = {
+        'environment': environment_info(),
+        'threshold': args.threshold,
+        'results': [asdict(result) for result in results],
+    }
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline'] = {'environment': baseline.get('environment'), 'path': os.path.relpath(args.baseline, REPO_ROOT)}
+        report['comparisons'] = compare_to_baseline(results, baseline, args.threshold)
+        regressions = [c for c in report['comparisons'] if c['regressions']]
+        print(f"\n與基準比較 ({os.path.relpath(args.baseline, REPO_ROOT)})：{len(report['comparisons'])} 項，退化 {len(regressions)} 項")
+        for comparison in regressions:
+            print(f"  退化 {comparison['key']}: {', '.join(comparison['regressions'])}")
+
+    output_path = args.baseline if args.save_baseline else args.output
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    print(f"結果已寫入 {os.path.relpath(output_path, REPO_ROOT)}")
+
+    return 1 if args.fail_on_regression and regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+碳足跡計算快取模組
+全程序共用的 LRU 快取：相同輸入只計算一次，並行的相同請求合併為單次計算 (single-flight)
+"""
+
+from collections import OrderedDict
+from dataclasses import FrozenInstanceError, dataclass
+from typing import Dict, Optional, Tuple
+import threading
+
+from functions import NantouTripCalculation, ScenarioCube, get_scenario_cube
+from tracing import traced
+
+# 快取鍵：(路線, 人數, 交通, 出發城市, 用餐, 咖啡)
+CacheKey = Tuple[str, int, str, str, str, str]
+
+class ImmutableTripCalculation(NantouTripCalculation):
+    """快取共用的唯讀旅程計算結果，各 session 直接引用而不複製"""
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"快取的計算結果不可修改: {name}")
+
+    def __delattr__(self, name):
+        raise FrozenInstanceError(f"快取的計算結果不可修改: {name}")
+
+def freeze_trip_calculation(trip_data: NantouTripCalculation) -> ImmutableTripCalculation:
+    """將計算結果轉為唯讀物件 (串列欄位轉為 tuple)"""
+    frozen = object.__new__(ImmutableTripCalculation)
+    for name, value in vars(trip_data).items():
+        if isinstance(value, list):
+            value = tuple(value)
+        object.__setattr__(frozen, name, value)
+    return frozen
+
+@dataclass(frozen=True)
+class CacheStats:
+    """快取統計"""
+    hits: int           # 直接命中
+    misses: int         # 實際計算次數
+    coalesced: int      # 等待同一個進行中計算的請求數
+    evictions: int      # LRU 淘汰次數
+    size: int           # 目前項目數
+    maxsize: int        # 最大項目數
+
+    @property
+    def hit_rate(self) -> float:
+        """命中率 (合併的請求視為命中)"""
+        total = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+class _InFlight:
+    """進行中的計算，其他相同請求等待其完成"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[ImmutableTripCalculation] = None
+        self.error: Optional[BaseException] = None
+
+class CalculationCache:
+    """全程序共用的碳足跡計算快取 (LRU 淘汰 + single-flight)"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[CacheKey, ImmutableTripCalculation]" = OrderedDict()
+        self._in_flight: Dict[CacheKey, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._cube: Optional[ScenarioCube] = None
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    @staticmethod
+    def normalize_key(trip_data: dict) -> CacheKey:
+        """將輸入資料正規化為快取鍵"""
+        return (
+            str(trip_data['route_option']).strip(),
+            int(trip_data['traveler_count']),
+            str(trip_data['transport_mode']).strip(),
+            str(trip_data['departure_city']).strip(),
+            str(trip_data.get('dining_choice') or 'local_meat').strip(),
+            str(trip_data.get('coffee_choice') or 'black_coffee').strip(),
+        )
+
+    @traced()
+    def get_or_compute(self, trip_data: dict) -> ImmutableTripCalculation:
+        """取得計算結果：命中則直接回傳，否則計算一次並供所有相同請求共用"""
+        key = self.normalize_key(trip_data)
+        cube = get_scenario_cube()
+
+        with self._lock:
+            # 係數表更新後立方體會重建，舊結果全部失效
+            if cube is not self._cube:
+                self._entries.clear()
+                self._cube = cube
+
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return result
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = self._in_flight[key] = _InFlight()
+                is_leader = True
+                self._misses += 1
+            else:
+                is_leader = False
+                self._coalesced += 1
+
+        if not is_leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            route_option, traveler_count, transport_mode, departure_city, dining_choice, coffee_choice = key
+            trip = NantouTripCalculation(
+                route_option=route_option,
+                traveler_count=traveler_count,
+                transport_mode=transport_mode,
+                departure_city=departure_city,
+                dining_choice=dining_choice,
+                coffee_choice=coffee_choice
+            )
+            in_flight.result = freeze_trip_calculation(cube.apply(trip))
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if in_flight.result is not None and self._cube is cube:
+                    self._entries[key] = in_flight.result
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self._evictions += 1
+            in_flight.done.set()
+
+        return in_flight.result
+
+    def stats(self) -> CacheStats:
+        """取得目前的快取統計"""
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                coalesced=self._coalesced,
+                evictions=self._evictions,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+            )
+
+    def clear(self) -> None:
+        """清除所有快取項目 (統計數字保留)"""
+        with self._lock:
+            self._entries.clear()
+
+_calculation_cache = CalculationCache()
+
+def get_calculation_cache() -> CalculationCache:
+    """取得全程序共用的計算快取"""
+    return _calculation_cache
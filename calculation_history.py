@@ -0,0 +1,241 @@
+"""
+碳足跡計算歷史紀錄 (SQLite)
+每次計算都排入背景寫入佇列，由單一寫入執行緒批次 executemany 寫入，介面執行緒不會等待磁碟；
+資料庫使用 WAL 模式，讀取查詢與寫入可同時進行，每個工作執行緒重複使用自己的讀取連線。
+
+啟用方式：
+    環境變數 NANTOU_HISTORY_DB 指定資料庫路徑 (未設定時不記錄)
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+
+HISTORY_DB_ENV_VAR = 'NANTOU_HISTORY_DB'
+
+# 每次寫入交易最多的筆數
+WRITE_BATCH_SIZE = 500
+# 佇列上限；寫入跟不上時丟棄新紀錄並計數，而不是讓介面等待
+MAX_PENDING_RECORDS = 100_000
+
+# 紀錄的數值欄位 (與 NantouTripCalculation 同名)
+VALUE_COLUMNS = (
+    'intercity_distance', 'route_distance', 'walking_distance', 'total_distance',
+    'intercity_emissions', 'route_emissions', 'dining_emissions', 'coffee_emissions',
+    'total_emissions', 'per_person_emissions', 'walking_carbon_saved', 'tree_equivalent'
+)
+INPUT_COLUMNS = ('route_option', 'departure_city', 'transport_mode', 'dining_choice', 'coffee_choice', 'traveler_count')
+RECORD_COLUMNS = ('recorded_at', 'session_id') + INPUT_COLUMNS + VALUE_COLUMNS
+
+# 可用於分組查詢的欄位
+GROUP_COLUMNS = ('route_option', 'departure_city', 'transport_mode', 'dining_choice', 'coffee_choice')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS calculations (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    session_id TEXT,
+    route_option TEXT NOT NULL,
+    departure_city TEXT NOT NULL,
+    transport_mode TEXT NOT NULL,
+    dining_choice TEXT NOT NULL,
+    coffee_choice TEXT NOT NULL,
+    traveler_count INTEGER NOT NULL,
+    {', '.join(f'{name} REAL NOT NULL' for name in VALUE_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS idx_calculations_recorded_at ON calculations (recorded_at);
+CREATE INDEX IF NOT EXISTS idx_calculations_route ON calculations (route_option, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_calculations_city ON calculations (departure_city, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_calculations_transport ON calculations (transport_mode, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_calculations_session ON calculations (session_id, recorded_at);
+"""
+
+INSERT_SQL = (
+    f"INSERT INTO calculations ({', '.join(RECORD_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in RECORD_COLUMNS)})"
+)
+
+_STOP = object()
+
+def connect(path: str, readonly: bool = False) -> sqlite3.Connection:
+    """開啟資料庫連線並套用 WAL 設定"""
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    # WAL 模式下 NORMAL 只在斷電時可能遺失最後幾筆交易，不會損壞資料庫
+    connection.execute('PRAGMA synchronous=NORMAL')
+    if readonly:
+        connection.execute('PRAGMA query_only=ON')
+    return connection
+
+def format_timestamp(value: datetime) -> str:
+    """ISO 格式時間字串 (字典順序即時間順序，可直接用於範圍查詢)"""
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+def trip_record(trip_data, recorded_at: datetime, session_id: Optional[str] = None) -> tuple:
+    """將計算結果轉為資料表的一列"""
+    return (
+        format_timestamp(recorded_at),
+        session_id,
+        *(getattr(trip_data, name) for name in INPUT_COLUMNS),
+        *(float(getattr(trip_data, name)) for name in VALUE_COLUMNS),
+    )
+
+class CalculationHistory:
+    """計算歷史紀錄：背景批次寫入 + 每執行緒一條讀取連線"""
+
+    def __init__(self, path: str, batch_size: int = WRITE_BATCH_SIZE, max_pending: int = MAX_PENDING_RECORDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.written = 0
+
+        with connect(path) as connection:
+            connection.executescript(SCHEMA)
+        connection.close()
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name='nantou-history-writer', daemon=True)
+        self._writer.start()
+
+    def record(self, trip_data, session_id: Optional[str] = None, recorded_at: Optional[datetime] = None) -> bool:
+        """排入一筆計算紀錄 (不等待寫入)；佇列已滿時丟棄並回傳 False"""
+        try:
+            self._queue.put_nowait(trip_record(trip_data, recorded_at or datetime.now(), session_id))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def record_many(self, records: Iterable[tuple]) -> None:
+        """直接批次寫入已轉換的紀錄 (匯入或回填歷史資料時使用，會等待寫入完成)"""
+        connection = self.connection(writable=True)
+        with connection:
+            connection.executemany(INSERT_SQL, records)
+
+    def _write_loop(self) -> None:
+        connection = connect(self.path)
+        stopping = False
+        while not stopping:
+            # 等待第一筆，再取出佇列中已累積的紀錄 (最多一批)；負載越高每批越大
+            items = [self._queue.get()]
+            while len(items) < self.batch_size and items[-1] is not _STOP:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = items[-1] is _STOP
+            batch = items[:-1] if stopping else items
+
+            if batch:
+                try:
+                    with connection:
+                        connection.executemany(INSERT_SQL, batch)
+                    self.written += len(batch)
+                except sqlite3.Error:
+                    # 歷史紀錄是輔助功能，寫入失敗不影響計算；失敗的筆數計入 dropped
+                    self.dropped += len(batch)
+            for _ in items:
+                self._queue.task_done()
+        connection.close()
+
+    def flush(self) -> None:
+        """等待目前佇列中的紀錄全部寫入"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """寫完剩餘紀錄後停止寫入執行緒"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+    def connection(self, writable: bool = False) -> sqlite3.Connection:
+        """目前執行緒的連線 (第一次使用時建立並保留重複使用)"""
+        attribute = 'writer' if writable else 'reader'
+        connection = getattr(self._local, attribute, None)
+        if connection is None:
+            connection = connect(self.path, readonly=not writable)
+            setattr(self._local, attribute, connection)
+        return connection
+
+    def query(self, sql: str, parameters: Sequence = ()) -> List[tuple]:
+        """以目前執行緒的唯讀連線查詢"""
+        cursor = self.connection().execute(sql, parameters)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def summary_by(self, column: str, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> List[Dict[str, object]]:
+        """依類別欄位彙總期間內的計算次數、旅客數與碳排放"""
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"無法依 {column} 分組，可用欄位: {', '.join(GROUP_COLUMNS)}")
+        where, parameters = _time_range(since, until)
+        rows = self.query(
+            f"SELECT {column}, COUNT(*), SUM(traveler_count), SUM(total_emissions) "
+            f"FROM calculations {where} GROUP BY {column} ORDER BY SUM(total_emissions) DESC",
+            parameters
+        )
+        return [
+            {column: key, 'calculations': count, 'travelers': travelers, 'total_emissions': emissions}
+            for key, count, travelers, emissions in rows
+        ]
+
+    def daily_totals(self, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None) -> List[Dict[str, object]]:
+        """每日的計算次數與碳排放"""
+        where, parameters = _time_range(since, until)
+        rows = self.query(
+            f"SELECT substr(recorded_at, 1, 10) AS day, COUNT(*), SUM(traveler_count), SUM(total_emissions) "
+            f"FROM calculations {where} GROUP BY day ORDER BY day",
+            parameters
+        )
+        return [
+            {'date': day, 'calculations': count, 'travelers': travelers, 'total_emissions': emissions}
+            for day, count, travelers, emissions in rows
+        ]
+
+    def recent(self, limit: int = 20, session_id: Optional[str] = None) -> List[Dict[str, object]]:
+        """最近的計算紀錄 (可限定 session)"""
+        where, parameters = ('WHERE session_id = ?', [session_id]) if session_id else ('', [])
+        cursor = self.connection().execute(
+            f"SELECT {', '.join(RECORD_COLUMNS)} FROM calculations {where} ORDER BY recorded_at DESC LIMIT ?",
+            [*parameters, limit]
+        )
+        try:
+            return [dict(zip(RECORD_COLUMNS, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def count(self) -> int:
+        return self.query("SELECT COUNT(*) FROM calculations")[0][0]
+
+def _time_range(since: Optional[datetime], until: Optional[datetime]) -> Tuple[str, List[str]]:
+    conditions, parameters = [], []
+    if since is not None:
+        conditions.append('recorded_at >= ?')
+        parameters.append(format_timestamp(since))
+    if until is not None:
+        conditions.append('recorded_at < ?')
+        parameters.append(format_timestamp(until))
+    return ('WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters
+
+_history: Optional[CalculationHistory] = None
+_history_lock = threading.Lock()
+
+def get_calculation_history() -> Optional[CalculationHistory]:
+    """取得全程序共用的歷史紀錄 (未設定 NANTOU_HISTORY_DB 時回傳 None)"""
+    global _history
+    path = os.environ.get(HISTORY_DB_ENV_VAR)
+    if not path:
+        return None
+    with _history_lock:
+        if _history is None or _history.path != path:
+            _history = CalculationHistory(path)
+            atexit.register(_history.close)
+        return _history
@@ -0,0 +1,116 @@
+"""
+圖表建立模組
+直接以 plotly.graph_objects 建立精簡的圖表物件，並依輸入數值快取，避免每次重新執行都重建與傳送完整範本
+"""
+
+from functools import lru_cache
+from typing import Sequence, Tuple
+
+import plotly.graph_objects as go
+
+# 碳足跡結構分析圖表的類別與顏色
+BREAKDOWN_LABELS = ('城際交通', '路線內交通', '飲食', '咖啡')
+BREAKDOWN_COLORS = ('#ff7f0e', '#2ca02c', '#d62728', '#9467bd')
+
+# 交通方式比較圖表的顏色 (使用者選擇 / 替代方案)
+CURRENT_CHOICE_COLOR = '#dc3545'
+ALTERNATIVE_COLOR = '#28a745'
+
+CHART_HEIGHT = 400
+
+# 空白範本：外觀交由 Streamlit 主題處理，不隨圖表傳送 plotly 預設範本
+_EMPTY_TEMPLATE = go.layout.Template()
+
+def _slim_layout(title: str, **kwargs) -> go.Layout:
+    """建立不含預設範本的精簡版面設定"""
+    return go.Layout(
+        title=dict(text=title),
+        height=CHART_HEIGHT,
+        template=_EMPTY_TEMPLATE,
+        **kwargs
+    )
+
+@lru_cache(maxsize=512)
+def _emission_breakdown_figure(values: Tuple[float, ...]) -> go.Figure:
+    """建立碳足跡結構分析圓餅圖 (依數值快取)"""
+    return go.Figure(
+        data=[go.Pie(
+            labels=BREAKDOWN_LABELS,
+            values=values,
+            marker=dict(colors=BREAKDOWN_COLORS),
+            textposition='inside',
+            textinfo='percent+label'
+        )],
+        layout=_slim_layout('碳足跡結構分析')
+    )
+
+def build_emission_breakdown_figure(intercity: float, route: float, dining: float, coffee: float) -> go.Figure:
+    """取得碳足跡結構分析圓餅圖"""
+    return _emission_breakdown_figure((float(intercity), float(route), float(dining), float(coffee)))
+
+@lru_cache(maxsize=512)
+def _transport_comparison_figure(transport_modes: Tuple[str, ...], emissions: Tuple[float, ...]) -> go.Figure:
+    """建立交通方式比較長條圖 (依數值快取)"""
+    colors = [CURRENT_CHOICE_COLOR] + [ALTERNATIVE_COLOR] * (len(transport_modes) - 1)
+    return go.Figure(
+        data=[go.Bar(
+            x=transport_modes,
+            y=emissions,
+            marker=dict(color=colors)
+        )],
+        layout=_slim_layout(
+            '不同交通方式碳排放比較',
+            showlegend=False,
+            xaxis=dict(title=dict(text='交通方式')),
+            yaxis=dict(title=dict(text='CO2排放量 (kg)'))
+        )
+    )
+
+def build_transport_comparison_figure(transport_modes: Sequence[str], emissions: Sequence[float]) -> go.Figure:
+    """取得交通方式比較長條圖 (第一筆為使用者的選擇)"""
+    return _transport_comparison_figure(tuple(transport_modes), tuple(float(e) for e in emissions))
+
+# 營運儀表板圖表的顏色
+DASHBOARD_BAR_COLOR = '#2ca02c'
+DASHBOARD_LINE_COLOR = '#1f77b4'
+
+@lru_cache(maxsize=64)
+def _aggregate_bar_figure(title: str, labels: Tuple[str, ...], values: Tuple[float, ...], axis_title: str) -> go.Figure:
+    """建立彙總長條圖 (依數值快取)"""
+    return go.Figure(
+        data=[go.Bar(x=labels, y=values, marker=dict(color=DASHBOARD_BAR_COLOR))],
+        layout=_slim_layout(
+            title,
+            showlegend=False,
+            yaxis=dict(title=dict(text=axis_title))
+        )
+    )
+
+def build_aggregate_bar_figure(title: str, labels: Sequence[str], values: Sequence[float],
+                               axis_title: str = 'CO2排放量 (kg)') -> go.Figure:
+    """取得營運儀表板的分類彙總長條圖"""
+    return _aggregate_bar_figure(title, tuple(labels), tuple(float(v) for v in values), axis_title)
+
+@lru_cache(maxsize=64)
+def _daily_totals_figure(days: Tuple[str, ...], emissions: Tuple[float, ...], trips: Tuple[int, ...]) -> go.Figure:
+    """建立每日碳排放折線圖 (依數值快取)"""
+    return go.Figure(
+        data=[go.Scatter(
+            x=days,
+            y=emissions,
+            mode='lines+markers',
+            line=dict(color=DASHBOARD_LINE_COLOR),
+            customdata=trips,
+            hovertemplate='%{x}<br>%{y:,.1f} kg CO2e<br>%{customdata:,} 次計算<extra></extra>'
+        )],
+        layout=_slim_layout(
+            '每日碳排放總量',
+            showlegend=False,
+            xaxis=dict(title=dict(text='日期'), type='category'),
+            yaxis=dict(title=dict(text='CO2排放量 (kg)'))
+        )
+    )
+
+def build_daily_totals_figure(days: Sequence[str], emissions: Sequence[float], trips: Sequence[int]) -> go.Figure:
+    """取得營運儀表板的每日碳排放折線圖"""
+    return _daily_totals_figure(tuple(days), tuple(float(e) for e in emissions), tuple(int(t) for t in trips))
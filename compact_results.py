@@ -0,0 +1,369 @@
+"""
+精簡的旅程計算結果表示
+    CompactTripResult：以 __slots__ 儲存的唯讀單筆結果，類別欄位以整數代碼保存，數值欄位集中存放在一個 array('d')，
+                       計算時間以微秒整數保存
+    TripResultColumns：多筆結果的欄式容器 (struct-of-arrays)，每個欄位為一個型別固定的 NumPy 陣列
+
+兩者都能與 NantouTripCalculation 互相轉換；CompactTripResult 提供與資料模型相同名稱的唯讀屬性，
+可直接傳給 format_nantou_trip_result 與推薦引擎。
+"""
+
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from functions import (
+    CITY_DISTANCES,
+    COFFEE_OPTIONS,
+    DINING_OPTIONS,
+    NANTOU_ROUTES,
+    TRANSPORT_OPTIONS,
+    NantouTripCalculation
+)
+
+# 類別欄位的代碼順序 (與 calculate_batch_arrays 的整數代碼相同)
+ROUTE_CATEGORIES = tuple(NANTOU_ROUTES)
+CITY_CATEGORIES = tuple(CITY_DISTANCES)
+TRANSPORT_CATEGORIES = tuple(TRANSPORT_OPTIONS)
+DINING_CATEGORIES = tuple(DINING_OPTIONS)
+COFFEE_CATEGORIES = tuple(COFFEE_OPTIONS)
+
+_ROUTE_CODES = {key: i for i, key in enumerate(ROUTE_CATEGORIES)}
+_CITY_CODES = {key: i for i, key in enumerate(CITY_CATEGORIES)}
+_TRANSPORT_CODES = {key: i for i, key in enumerate(TRANSPORT_CATEGORIES)}
+_DINING_CODES = {key: i for i, key in enumerate(DINING_CATEGORIES)}
+_COFFEE_CODES = {key: i for i, key in enumerate(COFFEE_CATEGORIES)}
+
+# 數值計算欄位 (順序同 calculate_batch_arrays 的輸出)
+RESULT_FIELDS = (
+    'intercity_distance', 'route_distance', 'walking_distance', 'total_distance',
+    'intercity_emissions', 'route_emissions', 'dining_emissions', 'coffee_emissions',
+    'total_emissions', 'per_person_emissions', 'walking_carbon_saved', 'tree_equivalent'
+)
+
+# 未列出的出發城市 (CompactTripResult.city_code)
+UNLISTED_CITY_CODE = -1
+# 沒有計算時間 (與 NumPy 的 NaT 相同)
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+def timestamp_us(value: Optional[datetime]) -> int:
+    """計算時間 (本地時間，不含時區) 轉為微秒整數；None 轉為 NO_TIMESTAMP"""
+    if value is None:
+        return NO_TIMESTAMP
+    return (value - _EPOCH) // _MICROSECOND
+
+def datetime_from_us(value: int) -> Optional[datetime]:
+    if value == NO_TIMESTAMP:
+        return None
+    return _EPOCH + timedelta(microseconds=value)
+
+class CompactTripResult:
+    """唯讀的精簡單筆旅程計算結果"""
+
+    __slots__ = (
+        'route_code', 'city_code', 'transport_code', 'dining_code', 'coffee_code', 'traveler_count',
+        '_values', 'calculated_at_us', 'unlisted_city', '_extras'
+    )
+
+    def __init__(self, route_code: int, city_code: int, transport_code: int, dining_code: int,
+                 coffee_code: int, traveler_count: int, values: Sequence[float],
+                 calculated_at_us: int = NO_TIMESTAMP, unlisted_city: Optional[str] = None,
+                 extras: Optional[Tuple[Optional[tuple], Optional[tuple]]] = None):
+        set_slot = object.__setattr__
+        set_slot(self, 'route_code', route_code)
+        set_slot(self, 'city_code', city_code)
+        set_slot(self, 'transport_code', transport_code)
+        set_slot(self, 'dining_code', dining_code)
+        set_slot(self, 'coffee_code', coffee_code)
+        set_slot(self, 'traveler_count', traveler_count)
+        # 12 個數值欄位共用一個 array，避免每個欄位各自是一個 float 物件
+        set_slot(self, '_values', array('d', values))
+        set_slot(self, 'calculated_at_us', calculated_at_us)
+        set_slot(self, 'unlisted_city', unlisted_city)
+        # (交通替代方案, 環保建議)；兩者皆未設定時為 None，不額外佔用空間
+        set_slot(self, '_extras', extras)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CompactTripResult 為唯讀: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"CompactTripResult 為唯讀: {name}")
+
+    @classmethod
+    def from_trip(cls, trip_data: NantouTripCalculation) -> 'CompactTripResult':
+        """由 NantouTripCalculation 建立 (出發城市不在清單中時另存名稱)"""
+        city_code = _CITY_CODES.get(trip_data.departure_city, UNLISTED_CITY_CODE)
+        alternatives = trip_data.transport_alternatives
+        recommendations = trip_data.eco_recommendations
+        extras = None
+        if alternatives is not None or recommendations is not None:
+            extras = (
+                None if alternatives is None else tuple(alternatives),
+                None if recommendations is None else tuple(recommendations),
+            )
+        return cls(
+            _ROUTE_CODES[trip_data.route_option],
+            city_code,
+            _TRANSPORT_CODES[trip_data.transport_mode],
+            _DINING_CODES[trip_data.dining_choice],
+            _COFFEE_CODES[trip_data.coffee_choice],
+            trip_data.traveler_count,
+            [getattr(trip_data, name) for name in RESULT_FIELDS],
+            timestamp_us(trip_data.calculated_at),
+            trip_data.departure_city if city_code == UNLISTED_CITY_CODE else None,
+            extras
+        )
+
+    def to_trip(self) -> NantouTripCalculation:
+        """轉回可修改的 NantouTripCalculation"""
+        return NantouTripCalculation(
+            route_option=self.route_option,
+            traveler_count=self.traveler_count,
+            transport_mode=self.transport_mode,
+            departure_city=self.departure_city,
+            dining_choice=self.dining_choice,
+            coffee_choice=self.coffee_choice,
+            **dict(zip(RESULT_FIELDS, self._values)),
+            transport_alternatives=self.transport_alternatives,
+            eco_recommendations=self.eco_recommendations,
+            calculated_at=self.calculated_at
+        )
+
+    # 與 NantouTripCalculation 相同名稱的唯讀屬性
+    @property
+    def route_option(self) -> str:
+        return ROUTE_CATEGORIES[self.route_code]
+
+    @property
+    def departure_city(self) -> str:
+        if self.city_code == UNLISTED_CITY_CODE:
+            return self.unlisted_city
+        return CITY_CATEGORIES[self.city_code]
+
+    @property
+    def transport_mode(self) -> str:
+        return TRANSPORT_CATEGORIES[self.transport_code]
+
+    @property
+    def dining_choice(self) -> str:
+        return DINING_CATEGORIES[self.dining_code]
+
+    @property
+    def coffee_choice(self) -> str:
+        return COFFEE_CATEGORIES[self.coffee_code]
+
+    @property
+    def calculated_at(self) -> Optional[datetime]:
+        return datetime_from_us(self.calculated_at_us)
+
+    @property
+    def transport_alternatives(self) -> Optional[List[Dict]]:
+        if self._extras is None or self._extras[0] is None:
+            return None
+        return list(self._extras[0])
+
+    @property
+    def eco_recommendations(self) -> Optional[List[str]]:
+        if self._extras is None or self._extras[1] is None:
+            return None
+        return list(self._extras[1])
+
+    def _state(self) -> tuple:
+        return (
+            self.route_code, self.city_code, self.transport_code, self.dining_code, self.coffee_code,
+            self.traveler_count, tuple(self._values), self.calculated_at_us, self.unlisted_city, self._extras
+        )
+
+    @classmethod
+    def _from_state(cls, state: tuple) -> 'CompactTripResult':
+        return cls(*state)
+
+    def __reduce__(self):
+        return (CompactTripResult._from_state, (self._state(),))
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactTripResult):
+            return NotImplemented
+        return self._state() == other._state()
+
+    def __hash__(self):
+        # 附加的替代方案可能含 dict，不納入雜湊
+        return hash(self._state()[:-1])
+
+    def __repr__(self):
+        return (
+            f"CompactTripResult(route_option={self.route_option!r}, traveler_count={self.traveler_count}, "
+            f"transport_mode={self.transport_mode!r}, departure_city={self.departure_city!r}, "
+            f"total_emissions={self.total_emissions!r})"
+        )
+
+def _value_property(index: int, name: str) -> property:
+    return property(lambda self: self._values[index], doc=f"{name} (唯讀)")
+
+# 數值欄位以與 NantouTripCalculation 相同名稱的唯讀屬性提供
+for _index, _name in enumerate(RESULT_FIELDS):
+    setattr(CompactTripResult, _name, _value_property(_index, _name))
+del _index, _name
+
+@dataclass
+class TripResultColumns:
+    """多筆旅程計算結果的欄式容器
+
+    出發城市以字典編碼：city_code 為 city_categories 的索引，前段與 CITY_DISTANCES 順序相同，
+    未列出的城市依出現順序附加在後。交通替代方案與環保建議屬於可由推薦引擎重新產生的衍生資料，不在此保存。
+    """
+    route_code: np.ndarray       # int8
+    city_code: np.ndarray        # int16
+    transport_code: np.ndarray   # int8
+    dining_code: np.ndarray      # int8
+    coffee_code: np.ndarray      # int8
+    traveler_count: np.ndarray   # int32
+    values: Dict[str, np.ndarray]  # RESULT_FIELDS -> float64
+    calculated_at: np.ndarray    # datetime64[us] (NaT 代表沒有計算時間)
+    city_categories: List[str] = field(default_factory=lambda: list(CITY_CATEGORIES))
+
+    def __len__(self) -> int:
+        return len(self.traveler_count)
+
+    @property
+    def nbytes(self) -> int:
+        """所有欄位陣列佔用的位元組數"""
+        arrays = [self.route_code, self.city_code, self.transport_code, self.dining_code,
+                  self.coffee_code, self.traveler_count, self.calculated_at, *self.values.values()]
+        return sum(array.nbytes for array in arrays)
+
+    @classmethod
+    def from_trips(cls, trips: Iterable) -> 'TripResultColumns':
+        """由 NantouTripCalculation 或 CompactTripResult 序列建立"""
+        trips = list(trips)
+        size = len(trips)
+        city_categories = list(CITY_CATEGORIES)
+        city_codes = dict(_CITY_CODES)
+
+        def city_code(name: str) -> int:
+            code = city_codes.get(name)
+            if code is None:
+                code = city_codes[name] = len(city_categories)
+                city_categories.append(name)
+            return code
+
+        return cls(
+            route_code=np.fromiter((_ROUTE_CODES[t.route_option] for t in trips), dtype=np.int8, count=size),
+            city_code=np.fromiter((city_code(t.departure_city) for t in trips), dtype=np.int16, count=size),
+            transport_code=np.fromiter((_TRANSPORT_CODES[t.transport_mode] for t in trips), dtype=np.int8, count=size),
+            dining_code=np.fromiter((_DINING_CODES[t.dining_choice] for t in trips), dtype=np.int8, count=size),
+            coffee_code=np.fromiter((_COFFEE_CODES[t.coffee_choice] for t in trips), dtype=np.int8, count=size),
+            traveler_count=np.fromiter((t.traveler_count for t in trips), dtype=np.int32, count=size),
+            values={
+                name: np.fromiter((getattr(t, name) for t in trips), dtype=np.float64, count=size)
+                for name in RESULT_FIELDS
+            },
+            calculated_at=np.fromiter(
+                (timestamp_us(t.calculated_at) for t in trips), dtype=np.int64, count=size
+            ).view('datetime64[us]'),
+            city_categories=city_categories,
+        )
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'TripResultColumns':
+        """由 calculate_batch 的結果 DataFrame 建立 (向量化，不逐列轉換)"""
+        cities = pd.Categorical(frame['departure_city'].to_numpy())
+        unlisted = [name for name in cities.categories if name not in _CITY_CODES]
+        city_categories = list(CITY_CATEGORIES) + unlisted
+        city_code = pd.Categorical(frame['departure_city'].to_numpy(), categories=city_categories).codes
+
+        calculated_at = frame['calculated_at'] if 'calculated_at' in frame else pd.Series(pd.NaT, index=frame.index)
+        return cls(
+            route_code=_encode(frame['route_option'], ROUTE_CATEGORIES, np.int8),
+            city_code=city_code.astype(np.int16),
+            transport_code=_encode(frame['transport_mode'], TRANSPORT_CATEGORIES, np.int8),
+            dining_code=_encode(frame['dining_choice'], DINING_CATEGORIES, np.int8),
+            coffee_code=_encode(frame['coffee_choice'], COFFEE_CATEGORIES, np.int8),
+            traveler_count=frame['traveler_count'].to_numpy(dtype=np.int32),
+            values={name: frame[name].to_numpy(dtype=np.float64, copy=True) for name in RESULT_FIELDS},
+            calculated_at=pd.to_datetime(calculated_at).to_numpy(dtype='datetime64[us]'),
+            city_categories=city_categories,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """轉為與 calculate_batch 相同欄位的 DataFrame (類別欄位為 pandas Categorical)"""
+        return pd.DataFrame({
+            'route_option': pd.Categorical.from_codes(self.route_code, ROUTE_CATEGORIES),
+            'traveler_count': self.traveler_count.astype(np.int64),
+            'transport_mode': pd.Categorical.from_codes(self.transport_code, TRANSPORT_CATEGORIES),
+            'departure_city': pd.Categorical.from_codes(self.city_code, self.city_categories),
+            'dining_choice': pd.Categorical.from_codes(self.dining_code, DINING_CATEGORIES),
+            'coffee_choice': pd.Categorical.from_codes(self.coffee_code, COFFEE_CATEGORIES),
+            **self.values,
+            'calculated_at': self.calculated_at,
+        })
+
+    def compact(self, index: int) -> CompactTripResult:
+        """取出單筆精簡結果"""
+        city_code = int(self.city_code[index])
+        unlisted_city = None
+        if city_code >= len(CITY_CATEGORIES):
+            unlisted_city = self.city_categories[city_code]
+            city_code = UNLISTED_CITY_CODE
+        return CompactTripResult(
+            int(self.route_code[index]),
+            city_code,
+            int(self.transport_code[index]),
+            int(self.dining_code[index]),
+            int(self.coffee_code[index]),
+            int(self.traveler_count[index]),
+            [float(self.values[name][index]) for name in RESULT_FIELDS],
+            int(self.calculated_at[index].view(np.int64)),
+            unlisted_city
+        )
+
+    def trip(self, index: int) -> NantouTripCalculation:
+        """取出單筆結果並轉為 NantouTripCalculation"""
+        return self.compact(index).to_trip()
+
+    def __iter__(self) -> Iterator[CompactTripResult]:
+        for index in range(len(self)):
+            yield self.compact(index)
+
+    @classmethod
+    def concat(cls, parts: Sequence['TripResultColumns']) -> 'TripResultColumns':
+        """合併多個容器 (各自的未列出城市重新對應到合併後的城市字典)"""
+        if not parts:
+            raise ValueError("至少需要一個要合併的容器")
+        city_categories = list(CITY_CATEGORIES)
+        city_codes = dict(_CITY_CODES)
+        remapped = []
+        for part in parts:
+            mapping = np.empty(len(part.city_categories), dtype=np.int16)
+            for code, name in enumerate(part.city_categories):
+                if name not in city_codes:
+                    city_codes[name] = len(city_categories)
+                    city_categories.append(name)
+                mapping[code] = city_codes[name]
+            remapped.append(mapping[part.city_code])
+
+        return cls(
+            route_code=np.concatenate([part.route_code for part in parts]),
+            city_code=np.concatenate(remapped),
+            transport_code=np.concatenate([part.transport_code for part in parts]),
+            dining_code=np.concatenate([part.dining_code for part in parts]),
+            coffee_code=np.concatenate([part.coffee_code for part in parts]),
+            traveler_count=np.concatenate([part.traveler_count for part in parts]),
+            values={name: np.concatenate([part.values[name] for part in parts]) for name in RESULT_FIELDS},
+            calculated_at=np.concatenate([part.calculated_at for part in parts]),
+            city_categories=city_categories,
+        )
+
+def _encode(values: pd.Series, categories: Tuple[str, ...], dtype) -> np.ndarray:
+    codes = pd.Categorical(values.to_numpy(), categories=categories).codes
+    if (codes < 0).any():
+        unknown = sorted({str(v) for v in values.to_numpy()[codes < 0]})
+        raise KeyError(f"無效的 {values.name}: {', '.join(unknown[:5])}")
+    return codes.astype(dtype)
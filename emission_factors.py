@@ -0,0 +1,371 @@
+"""
+碳排放係數登錄檔
+係數由版本化的 JSON 資料檔載入，載入時檢查格式與一致性，並編譯成依固定整數代碼索引的唯讀 NumPy 陣列。
+每個係數可有多個生效期間 [from, to)，以區間索引依旅程日期取得當時生效的版本；
+所有係數的期間邊界把時間切成若干區段，每個區段預先編譯一份密集陣列，批次計算可依日期向量化查表。
+每次載入產生一份不可變的快照；熱重新載入時以單一參照替換整份快照，
+正在進行的計算持有舊快照的參照，不會看到新舊係數混用的結果。
+
+設定方式：
+    環境變數 NANTOU_EMISSION_FACTORS 指定係數檔路徑 (預設為 data/emission_factors.json)
+"""
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+FACTORS_FILE_ENV_VAR = 'NANTOU_EMISSION_FACTORS'
+DEFAULT_FACTORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'emission_factors.json')
+
+FACTORS_FORMAT = 'nantou-emission-factors'
+# 第 1 版每個係數只有單一數值；第 2 版可列出多個生效期間
+FACTORS_SCHEMA_VERSIONS = (1, 2)
+
+# 係數類別
+FACTOR_CATEGORIES = ('transportation', 'dining', 'coffee')
+
+# 檢查係數檔是否更新的最短間隔 (秒)
+RELOAD_CHECK_SECONDS = 2.0
+
+class EmissionFactorError(ValueError):
+    """係數檔格式不符或內容不一致"""
+
+@dataclass(frozen=True)
+class FactorPeriod:
+    """係數的一個生效期間 [start, end)；start / end 為 None 表示不限"""
+    value: float
+    start: Optional[date]
+    end: Optional[date]
+    version: str  # 係數出處的版本 (未指定時為係數檔版本)
+
+    def covers(self, day: date) -> bool:
+        return (self.start is None or self.start <= day) and (self.end is None or day < self.end)
+
+def factors_path() -> str:
+    return os.environ.get(FACTORS_FILE_ENV_VAR) or DEFAULT_FACTORS_PATH
+
+def _reject_duplicate_keys(pairs: List[tuple]) -> dict:
+    # json 預設會讓重複的鍵靜默覆蓋前一個值，係數檔中重複的鍵一律視為錯誤
+    keys = [key for key, _ in pairs]
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise EmissionFactorError(f"係數檔有重複的鍵: {', '.join(duplicates)}")
+    return dict(pairs)
+
+def read_factors_file(path: str) -> dict:
+    """讀取係數檔 (不檢查內容)"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f, object_pairs_hook=_reject_duplicate_keys)
+    except (OSError, json.JSONDecodeError) as e:
+        raise EmissionFactorError(f"無法讀取係數檔 {path}: {e}") from e
+
+def _parse_date(value, name: str, problems: List[str]) -> Optional[date]:
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        problems.append(f"{name} 不是 YYYY-MM-DD 日期: {value}")
+        return None
+
+def parse_periods(name: str, entry, default_version: str, problems: List[str]) -> List[FactorPeriod]:
+    """解析一個係數的生效期間 ({"value": x} 視為不限期間)，問題加入 problems"""
+    if not isinstance(entry, dict):
+        problems.append(f"{name} 的格式不正確")
+        return []
+    raw_periods = entry['periods'] if 'periods' in entry else [{'value': entry.get('value')}]
+    if not isinstance(raw_periods, list) or not raw_periods:
+        problems.append(f"{name} 沒有任何生效期間")
+        return []
+
+    periods = []
+    for position, raw in enumerate(raw_periods):
+        label = f"{name}[{position}]" if len(raw_periods) > 1 else name
+        value = raw.get('value') if isinstance(raw, dict) else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            problems.append(f"{label} 的係數不是數值")
+            continue
+        if not math.isfinite(value) or value < 0:
+            problems.append(f"{label} 的係數必須是非負的有限數值: {value}")
+            continue
+        start = _parse_date(raw.get('from'), f"{label}.from", problems)
+        end = _parse_date(raw.get('to'), f"{label}.to", problems)
+        if start is not None and end is not None and start >= end:
+            problems.append(f"{label} 的生效期間不正確: {start} ~ {end}")
+            continue
+        periods.append(FactorPeriod(float(value), start, end, str(raw.get('version') or default_version)))
+
+    # 期間依開始日排序後不可重疊
+    periods.sort(key=lambda period: period.start or date.min)
+    for previous, current in zip(periods, periods[1:]):
+        if previous.end is None or current.start is None or previous.end > current.start:
+            problems.append(f"{name} 的生效期間重疊: {previous.start} ~ {previous.end} 與 {current.start} ~ {current.end}")
+    return periods
+
+def validate_factors(data: dict, category_keys: Mapping[str, Sequence[str]]) -> Dict[str, Dict[str, List[FactorPeriod]]]:
+    """檢查係數檔內容並解析生效期間，所有問題一次列出
+
+    category_keys 為各類別必須提供係數的選項代碼 (例如 TRANSPORT_OPTIONS 的鍵)。
+    """
+    problems = []
+    if data.get('format') != FACTORS_FORMAT or data.get('schema_version') not in FACTORS_SCHEMA_VERSIONS:
+        raise EmissionFactorError(f"不支援的係數檔格式: {data.get('format')} v{data.get('schema_version')}")
+    if not isinstance(data.get('version'), str) or not data['version'].strip():
+        problems.append("缺少係數版本 (version)")
+
+    factors = data.get('factors')
+    if not isinstance(factors, dict):
+        raise EmissionFactorError("缺少係數表 (factors)")
+    for category in sorted(set(factors) - set(FACTOR_CATEGORIES)):
+        problems.append(f"未知的係數類別: {category}")
+
+    parsed = {}
+    for category in FACTOR_CATEGORIES:
+        entries = factors.get(category)
+        if not isinstance(entries, dict):
+            problems.append(f"缺少係數類別: {category}")
+            continue
+        for key in category_keys.get(category, ()):
+            if key not in entries:
+                problems.append(f"{category}.{key} 是可選擇的選項，但沒有係數")
+        if data.get('schema_version') == 1:
+            for key, entry in entries.items():
+                if isinstance(entry, dict) and 'periods' in entry:
+                    problems.append(f"{category}.{key}: 第 1 版係數檔不支援生效期間")
+        parsed[category] = {
+            key: parse_periods(f"{category}.{key}", entry, str(data.get('version')), problems)
+            for key, entry in entries.items()
+        }
+
+    if problems:
+        raise EmissionFactorError("係數檔內容不一致：\n  " + "\n  ".join(problems))
+    return parsed
+
+def category_codes(keys: Sequence[str], entries: Mapping[str, object]) -> Dict[str, int]:
+    """類別代碼 → 整數代碼：選項代碼依選項順序在前 (與批次計算、儲存區的代碼相同)，其餘依係數檔順序附加"""
+    ordered = list(keys) + [key for key in entries if key not in keys]
+    return {key: code for code, key in enumerate(ordered)}
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+@dataclass(frozen=True, eq=False)
+class ResolvedFactors:
+    """某個日期區段 [start, end) 內生效的係數表 (區段內所有係數都不變)"""
+    start: Optional[date]
+    end: Optional[date]
+    factors: Mapping[str, Mapping[str, float]]    # 類別 → 代碼 → 係數 (只含此區段有生效期間的係數)
+    arrays: Mapping[str, np.ndarray]              # 類別 → 依整數代碼索引的係數陣列 (沒有生效期間為 NaN)
+    versions: Mapping[str, Mapping[str, str]]     # 類別 → 代碼 → 係數出處的版本
+    missing: Tuple[str, ...]                      # 此區段沒有生效係數的選項 (類別.代碼)
+
+    @property
+    def version_label(self) -> str:
+        """此區段使用的係數出處版本 (依字母排序，以逗號分隔)"""
+        return ', '.join(sorted({version for items in self.versions.values() for version in items.values()}))
+
+@dataclass(frozen=True, eq=False)
+class EmissionFactorSnapshot:
+    """某個版本的係數檔 (所有欄位皆為唯讀，可跨執行緒與 session 共用)"""
+    version: str
+    source: str
+    path: str
+    loaded_at: datetime
+    fingerprint: str                                          # 係數檔內容的雜湊值
+    periods: Mapping[str, Mapping[str, Tuple[FactorPeriod, ...]]]  # 類別 → 代碼 → 依開始日排序的生效期間
+    period_starts: Mapping[str, Mapping[str, Tuple[date, ...]]]    # 區間索引的鍵 (各期間開始日)
+    codes: Mapping[str, Mapping[str, int]]                    # 類別 → 代碼 → 整數代碼
+    epochs: Tuple[ResolvedFactors, ...]                       # 依日期排序、互不重疊且涵蓋所有日期的區段
+    epoch_days: Tuple[date, ...]                              # 各區段開始日 (第一個為 date.min)
+    epoch_starts: np.ndarray                                  # 同上 (datetime64[D])，供向量化查表
+    epoch_arrays: Mapping[str, np.ndarray]                    # 類別 → (區段, 整數代碼) 係數矩陣
+    canonical: str                                            # 已檢查的係數檔內容 (正規化 JSON，序列化用)
+    category_keys: Mapping[str, tuple]
+
+    def factor_at(self, category: str, key: str, day: date) -> Optional[FactorPeriod]:
+        """區間索引：取得某個係數在 day 生效的期間 (沒有則回傳 None)"""
+        periods = self.periods[category][key]
+        position = bisect_right(self.period_starts[category][key], day) - 1
+        if position >= 0 and periods[position].covers(day):
+            return periods[position]
+        return None
+
+    def epoch_index(self, day: date) -> int:
+        return bisect_right(self.epoch_days, day) - 1
+
+    def epoch_indices(self, days: np.ndarray) -> np.ndarray:
+        """向量化取得多個日期 (datetime64) 所在的區段索引"""
+        return np.searchsorted(self.epoch_starts, np.asarray(days).astype('datetime64[D]'), side='right') - 1
+
+    def resolve(self, day: date, require_complete: bool = True) -> ResolvedFactors:
+        """取得 day 生效的係數表；require_complete 時有選項沒有生效係數會拋出 EmissionFactorError"""
+        resolved = self.epochs[self.epoch_index(day)]
+        if require_complete and resolved.missing:
+            raise EmissionFactorError(f"係數檔 {self.version} 在 {day} 沒有生效的係數: {', '.join(resolved.missing)}")
+        return resolved
+
+    def code(self, category: str, key: str) -> int:
+        return self.codes[category][key]
+
+    def __reduce__(self):
+        # MappingProxyType 無法 pickle，改以原始內容重新編譯 (多程序批次計算會傳送計算器)
+        return (_restore_snapshot, (self.canonical, self.path, dict(self.category_keys), self.loaded_at))
+
+def _compile_epochs(periods: Dict[str, Dict[str, List[FactorPeriod]]], codes: Dict[str, Dict[str, int]],
+                    category_keys: Mapping[str, Sequence[str]]) -> List[ResolvedFactors]:
+    boundaries = sorted({
+        day
+        for items in periods.values()
+        for factor_periods in items.values()
+        for period in factor_periods
+        for day in (period.start, period.end)
+        if day is not None
+    })
+    starts = [None] + boundaries
+    ends = boundaries + [None]
+
+    epochs = []
+    for start, end in zip(starts, ends):
+        day = start or date.min
+        factors, arrays, versions, missing = {}, {}, {}, []
+        for category in FACTOR_CATEGORIES:
+            values = np.full(len(codes[category]), np.nan)
+            category_factors, category_versions = {}, {}
+            for key, code in codes[category].items():
+                period = next((p for p in periods[category][key] if p.covers(day)), None)
+                if period is None:
+                    if key in category_keys.get(category, ()):
+                        missing.append(f"{category}.{key}")
+                    continue
+                values[code] = period.value
+                category_factors[key] = period.value
+                category_versions[key] = period.version
+            factors[category] = MappingProxyType(category_factors)
+            versions[category] = MappingProxyType(category_versions)
+            arrays[category] = _read_only(values)
+        epochs.append(ResolvedFactors(
+            start=start,
+            end=end,
+            factors=MappingProxyType(factors),
+            arrays=MappingProxyType(arrays),
+            versions=MappingProxyType(versions),
+            missing=tuple(missing),
+        ))
+    return epochs
+
+def compile_snapshot(data: dict, path: str, category_keys: Mapping[str, Sequence[str]],
+                     loaded_at: Optional[datetime] = None) -> EmissionFactorSnapshot:
+    """檢查係數檔內容並編譯成快照"""
+    periods = validate_factors(data, category_keys)
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    codes = {category: category_codes(category_keys.get(category, ()), periods[category]) for category in FACTOR_CATEGORIES}
+
+    epochs = _compile_epochs(periods, codes, category_keys)
+    epoch_days = tuple(epoch.start or date.min for epoch in epochs)
+    epoch_arrays = {
+        category: _read_only(np.stack([epoch.arrays[category] for epoch in epochs]))
+        for category in FACTOR_CATEGORIES
+    }
+
+    return EmissionFactorSnapshot(
+        version=data['version'],
+        source=data.get('source', ''),
+        path=path,
+        loaded_at=loaded_at or datetime.now(),
+        fingerprint=hashlib.sha256(canonical.encode('utf-8')).hexdigest(),
+        periods=MappingProxyType({
+            category: MappingProxyType({key: tuple(periods[category][key]) for key in codes[category]})
+            for category in FACTOR_CATEGORIES
+        }),
+        period_starts=MappingProxyType({
+            category: MappingProxyType({
+                key: tuple(period.start or date.min for period in periods[category][key]) for key in codes[category]
+            })
+            for category in FACTOR_CATEGORIES
+        }),
+        codes=MappingProxyType({category: MappingProxyType(codes[category]) for category in FACTOR_CATEGORIES}),
+        epochs=tuple(epochs),
+        epoch_days=epoch_days,
+        epoch_starts=_read_only(np.array(epoch_days, dtype='datetime64[D]')),
+        epoch_arrays=MappingProxyType(epoch_arrays),
+        canonical=canonical,
+        category_keys=MappingProxyType({category: tuple(keys) for category, keys in category_keys.items()}),
+    )
+
+def _restore_snapshot(serialized: str, path: str, category_keys: dict, loaded_at: datetime) -> EmissionFactorSnapshot:
+    return compile_snapshot(json.loads(serialized), path, category_keys, loaded_at)
+
+def load_snapshot(path: str, category_keys: Mapping[str, Sequence[str]]) -> EmissionFactorSnapshot:
+    """讀取、檢查並編譯係數檔"""
+    return compile_snapshot(read_factors_file(path), path, category_keys)
+
+class EmissionFactorRegistry:
+    """目前使用中的係數快照；係數檔更新時自動重新載入並原子替換"""
+
+    def __init__(self, path: str, category_keys: Mapping[str, Sequence[str]],
+                 check_interval: Optional[float] = RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.category_keys = {category: tuple(keys) for category, keys in category_keys.items()}
+        self.check_interval = check_interval
+        # 最近一次重新載入失敗的原因 (失敗時繼續使用原本的快照)
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._mtime = self._file_mtime()
+        self._snapshot = self._load()
+        self._next_check = time.monotonic() + (check_interval or 0)
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self) -> EmissionFactorSnapshot:
+        snapshot = load_snapshot(self.path, self.category_keys)
+        # 使用中的係數檔必須涵蓋今天，否則新的計算無法進行
+        snapshot.resolve(date.today())
+        return snapshot
+
+    def current(self) -> EmissionFactorSnapshot:
+        """目前的快照 (呼叫端應在一次計算中只取一次並沿用)"""
+        if self.check_interval is not None and time.monotonic() >= self._next_check:
+            self._reload_if_changed()
+        return self._snapshot
+
+    def _reload_if_changed(self) -> None:
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            mtime = self._file_mtime()
+            if mtime is None or mtime == self._mtime:
+                return
+            self._mtime = mtime
+            try:
+                self._swap(self._load())
+            except EmissionFactorError as e:
+                self.last_error = str(e)
+
+    def reload(self) -> EmissionFactorSnapshot:
+        """立即重新載入係數檔；內容有誤時拋出 EmissionFactorError 並保留原本的快照"""
+        with self._lock:
+            self._mtime = self._file_mtime()
+            return self._swap(self._load())
+
+    def _swap(self, snapshot: EmissionFactorSnapshot) -> EmissionFactorSnapshot:
+        # 單一參照替換：讀取端只會取得完整的舊快照或新快照
+        self._snapshot = snapshot
+        self.last_error = None
+        return snapshot
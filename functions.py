@@ -4,31 +4,19 @@
 """
 
 from dataclasses import dataclass
-from typing import Dict, List, Optional
-from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+from datetime import date, datetime
+from functools import lru_cache
+import hashlib
 import json
+import threading
 
-# 台灣環境部官方碳排放係數
-TAIWAN_EMISSION_FACTORS = {
-    'transportation': {
-        'car_petrol': 0.115,      # kg CO2e/km (自用小客車汽油)
-        'motorcycle': 0.0951,     # kg CO2e/km (機車)
-        'high_speed_rail': 0.032, # kg CO2e/km (高鐵)
-        'train': 0.06,           # kg CO2e/km (台鐵)
-        'bus': 0.04,             # kg CO2e/km (公車/客運)
-    },
-    'dining': {
-        'local_meat': 3.0,        # kg CO2e/餐 (在地客家料理含肉類)
-        'local_vegetarian': 1.0,  # kg CO2e/餐 (在地蔬食餐)
-        'light_meal': 1.5,        # kg CO2e/餐 (輕食簡餐)
-        'self_prepared': 0.5,     # kg CO2e/餐 (自備餐點)
-    },
-    'coffee': {
-        'black_coffee': 0.1,      # kg CO2e/杯 (黑咖啡)
-        'latte_cappuccino': 1.0,  # kg CO2e/杯 (拿鐵/卡布奇諾)
-        'no_coffee': 0.0,         # kg CO2e/杯 (不喝咖啡)
-    }
-}
+import numpy as np
+import pandas as pd
+
+from emission_factors import EmissionFactorRegistry, EmissionFactorSnapshot, FactorPeriod, factors_path
+from tracing import traced
 
 # 預設南投國姓旅遊路線資料
 NANTOU_ROUTES = {
@@ -113,26 +101,25 @@ CITY_DISTANCES = {
     '台東': 320
 }
 
+# 未列於 CITY_DISTANCES 的出發城市預設距離 (公里)
+DEFAULT_CITY_DISTANCE = 200
+
 # 交通工具選項
 TRANSPORT_OPTIONS = {
     'car_petrol': {
         'name': '自用小客車 (汽油)',
-        'emission_factor': 0.115,
         'description': '最常見的交通方式，適合家庭出遊'
     },
     'motorcycle': {
         'name': '機車',
-        'emission_factor': 0.0951,
         'description': '機動性高，適合短程旅遊'
     },
     'bus': {
         'name': '大眾運輸 (客運/火車)',
-        'emission_factor': 0.04,
         'description': '最環保的選擇，減少個人碳足跡'
     },
     'high_speed_rail': {
         'name': '高鐵',
-        'emission_factor': 0.032,
         'description': '快速便捷，適合長程旅行'
     }
 }
@@ -141,22 +128,18 @@ TRANSPORT_OPTIONS = {
 DINING_OPTIONS = {
     'local_meat': {
         'name': '在地客家料理 (含肉類)',
-        'emission_factor': 3.0,
         'description': '品嚐道地客家風味，體驗在地文化'
     },
     'local_vegetarian': {
         'name': '在地蔬食餐',
-        'emission_factor': 1.0,
         'description': '健康環保，支持永續飲食'
     },
     'light_meal': {
         'name': '輕食簡餐 (咖啡館餐點)',
-        'emission_factor': 1.5,
         'description': '簡單輕鬆，適合悠閒時光'
     },
     'self_prepared': {
         'name': '自備餐點',
-        'emission_factor': 0.5,
         'description': '最環保的選擇，減少包裝廢棄物'
     }
 }
@@ -165,21 +148,36 @@ DINING_OPTIONS = {
 COFFEE_OPTIONS = {
     'black_coffee': {
         'name': '品嚐黑咖啡 (手沖/義式)',
-        'emission_factor': 0.1,
         'description': '品味國姓咖啡豆的純粹風味'
     },
     'latte_cappuccino': {
         'name': '選擇拿鐵/卡布奇諾 (含牛奶)',
-        'emission_factor': 1.0,
         'description': '香濃奶香，經典咖啡體驗'
     },
     'no_coffee': {
         'name': '不喝咖啡',
-        'emission_factor': 0.0,
         'description': '選擇其他在地飲品或茶類'
     }
 }
 
+# 各係數類別中可供選擇的選項代碼 (係數檔必須提供，順序即整數代碼)
+FACTOR_CATEGORY_KEYS = {
+    'transportation': tuple(TRANSPORT_OPTIONS),
+    'dining': tuple(DINING_OPTIONS),
+    'coffee': tuple(COFFEE_OPTIONS),
+}
+
+# 全程序共用的碳排放係數登錄檔 (係數檔更新時自動重新載入)
+EMISSION_FACTOR_REGISTRY = EmissionFactorRegistry(factors_path(), FACTOR_CATEGORY_KEYS)
+
+def get_emission_factors() -> EmissionFactorSnapshot:
+    """取得目前的碳排放係數快照"""
+    return EMISSION_FACTOR_REGISTRY.current()
+
+# 台灣環境部官方碳排放係數：類別 → 代碼 → 依開始日排序的生效期間 (FactorPeriod)
+# 為程序啟動時載入的版本；係數檔更新後以 get_emission_factors() 取得最新版本
+TAIWAN_EMISSION_FACTORS: Mapping[str, Mapping[str, Tuple[FactorPeriod, ...]]] = get_emission_factors().periods
+
 @dataclass
 class NantouTripCalculation:
     """南投旅程計算資料模型"""
@@ -221,7 +219,7 @@ class NantouTripCalculation:
     # 計算時間
     calculated_at: datetime = None
 
-@dataclass
+@dataclass(frozen=True)
 class TransportAlternative:
     """交通替代方案模型"""
     transport_mode: str      # 替代交通方式
@@ -244,16 +242,35 @@ class RouteInfo:
 class NantouCarbonCalculator:
     """南投永續之旅碳足跡計算引擎"""
     
-    def __init__(self):
-        self.emission_factors = TAIWAN_EMISSION_FACTORS
+    def __init__(self, factor_snapshot: Optional[EmissionFactorSnapshot] = None,
+                 effective_date: Optional[date] = None, require_complete_factors: bool = True):
+        # 計算器在整個生命週期使用同一份係數快照中 effective_date (預設今天) 生效的係數，
+        # 要套用更新後的係數請建立新的計算器；
+        # require_complete_factors=False 時允許部分選項沒有生效係數 (呼叫端需自行確認用到的係數都存在)
+        self.factor_snapshot = factor_snapshot or get_emission_factors()
+        self.effective_date = effective_date or date.today()
+        self.require_complete_factors = require_complete_factors
+        self.resolved_factors = self.factor_snapshot.resolve(self.effective_date, require_complete_factors)
+        self.emission_factors = self.resolved_factors.factors
         self.route_distances = NANTOU_ROUTES
         self.city_distances = CITY_DISTANCES
     
+    def __getstate__(self):
+        # 唯讀係數表 (MappingProxyType) 無法 pickle，由快照重新取得 (多程序批次計算會傳送計算器)
+        state = self.__dict__.copy()
+        del state['resolved_factors'], state['emission_factors']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.resolved_factors = self.factor_snapshot.resolve(self.effective_date, self.require_complete_factors)
+        self.emission_factors = self.resolved_factors.factors
+    
     def calculate_intercity_emissions(self, departure_city: str, transport_mode: str, passengers: int) -> float:
         """計算城際交通碳排放 (出發城市到南投)"""
         
         # 獲取城際距離
-        distance = self.city_distances.get(departure_city, 200)  # 預設200公里
+        distance = self.city_distances.get(departure_city, DEFAULT_CITY_DISTANCE)  # 預設200公里
         
         # 獲取排放係數
         emission_factor = self.emission_factors['transportation'][transport_mode]
@@ -289,6 +306,7 @@ class NantouCarbonCalculator:
         car_emission_factor = self.emission_factors['transportation']['car_petrol']
         return car_emission_factor * walking_distance * traveler_count
     
+    @traced()
     def calculate_total_emissions(self, trip_data: NantouTripCalculation) -> NantouTripCalculation:
         """計算總碳排放 = 城際 + 行程內 + 飲食 + 咖啡"""
         
@@ -319,7 +337,7 @@ class NantouCarbonCalculator:
         )
         
         # 計算距離
-        intercity_distance = self.city_distances.get(trip_data.departure_city, 200) * 2  # 往返
+        intercity_distance = self.city_distances.get(trip_data.departure_city, DEFAULT_CITY_DISTANCE) * 2  # 往返
         route_distance = self.route_distances[trip_data.route_option]['internal_distance']
         walking_distance = self.route_distances[trip_data.route_option]['walking_distance']
         
@@ -359,6 +377,274 @@ class NantouCarbonCalculator:
         daily_absorption_per_tree = 0.06
         return co2_amount / daily_absorption_per_tree
 
+    @traced()
+    def calculate_batch_arrays(self, route_codes: np.ndarray, city_codes: np.ndarray,
+                               transport_codes: np.ndarray, dining_codes: np.ndarray,
+                               coffee_codes: np.ndarray, traveler_count: np.ndarray) -> Dict[str, np.ndarray]:
+        """以整數代碼陣列向量化計算所有碳排放欄位（運算順序與單筆計算相同）"""
+
+        # 係數直接使用生效區段中依整數代碼編譯好的陣列；距離查找表的城市代碼 -1 代表未列出的城市
+        transport_factors = self.resolved_factors.arrays['transportation']
+        dining_factors = self.resolved_factors.arrays['dining']
+        coffee_factors = self.resolved_factors.arrays['coffee']
+        city_km = np.array(list(self.city_distances.values()) + [DEFAULT_CITY_DISTANCE], dtype=np.float64)
+        route_km = np.array([r['internal_distance'] for r in self.route_distances.values()], dtype=np.float64)
+        walking_km = np.array([r['walking_distance'] for r in self.route_distances.values()], dtype=np.float64)
+
+        passengers = np.asarray(traveler_count, dtype=np.int64)
+        transport_factor = transport_factors[transport_codes]
+        city_distance = city_km[city_codes]
+
+        intercity_emissions = transport_factor * city_distance * 2 * passengers
+        route_emissions = transport_factor * route_km[route_codes] * passengers
+        dining_emissions = dining_factors[dining_codes] * passengers
+        coffee_emissions = coffee_factors[coffee_codes] * passengers
+
+        intercity_distance = city_distance * 2
+        route_distance = route_km[route_codes]
+        walking_distance = walking_km[route_codes]
+
+        total_emissions = intercity_emissions + route_emissions + dining_emissions + coffee_emissions
+
+        return {
+            'intercity_distance': intercity_distance,
+            'route_distance': route_distance,
+            'walking_distance': walking_distance,
+            'total_distance': intercity_distance + route_distance,
+            'intercity_emissions': intercity_emissions,
+            'route_emissions': route_emissions,
+            'dining_emissions': dining_emissions,
+            'coffee_emissions': coffee_emissions,
+            'total_emissions': total_emissions,
+            'per_person_emissions': total_emissions / passengers,
+            'walking_carbon_saved': self.calculate_walking_carbon_saved(walking_distance, passengers),
+            'tree_equivalent': self.calculate_tree_equivalent(total_emissions),
+        }
+
+    @traced()
+    def calculate_batch(self, trips: Optional[pd.DataFrame] = None, *,
+                        route_option: Optional[Sequence] = None,
+                        departure_city: Optional[Sequence] = None,
+                        transport_mode: Optional[Sequence] = None,
+                        traveler_count: Optional[Sequence] = None,
+                        dining_choice: Optional[Sequence] = None,
+                        coffee_choice: Optional[Sequence] = None) -> pd.DataFrame:
+        """批次計算多筆旅程碳排放，結果與 calculate_total_emissions 逐筆計算相同
+
+        可傳入含 NantouTripCalculation 輸入欄位的 DataFrame，或以關鍵字傳入
+        字串代碼 / 整數代碼的 NumPy 陣列；用餐與咖啡未提供時使用資料模型預設值。
+        """
+        columns = {
+            'route_option': route_option,
+            'departure_city': departure_city,
+            'transport_mode': transport_mode,
+            'traveler_count': traveler_count,
+            'dining_choice': dining_choice,
+            'coffee_choice': coffee_choice,
+        }
+        if trips is not None:
+            for name in columns:
+                if columns[name] is None and name in trips.columns:
+                    columns[name] = trips[name].to_numpy()
+
+        for name in ('route_option', 'departure_city', 'transport_mode', 'traveler_count'):
+            if columns[name] is None:
+                raise ValueError(f"缺少批次計算欄位: {name}")
+
+        passengers = np.asarray(columns['traveler_count'], dtype=np.int64)
+        size = len(passengers)
+        if columns['dining_choice'] is None:
+            columns['dining_choice'] = np.full(size, 'local_meat', dtype=object)
+        if columns['coffee_choice'] is None:
+            columns['coffee_choice'] = np.full(size, 'black_coffee', dtype=object)
+
+        route_codes = encode_category_codes(columns['route_option'], list(self.route_distances), 'route_option')
+        transport_codes = encode_category_codes(columns['transport_mode'], list(TRANSPORT_OPTIONS), 'transport_mode')
+        dining_codes = encode_category_codes(columns['dining_choice'], list(DINING_OPTIONS), 'dining_choice')
+        coffee_codes = encode_category_codes(columns['coffee_choice'], list(COFFEE_OPTIONS), 'coffee_choice')
+        # 未列出的出發城市沿用單筆計算的預設距離
+        city_codes = encode_category_codes(columns['departure_city'], list(self.city_distances), 'departure_city', strict=False)
+
+        computed = self.calculate_batch_arrays(
+            route_codes, city_codes, transport_codes, dining_codes, coffee_codes, passengers
+        )
+
+        result = pd.DataFrame({
+            'route_option': decode_category_codes(route_codes, list(self.route_distances)),
+            'traveler_count': passengers,
+            'transport_mode': decode_category_codes(transport_codes, list(TRANSPORT_OPTIONS)),
+            'departure_city': _as_label_array(columns['departure_city'], city_codes, list(self.city_distances)),
+            'dining_choice': decode_category_codes(dining_codes, list(DINING_OPTIONS)),
+            'coffee_choice': decode_category_codes(coffee_codes, list(COFFEE_OPTIONS)),
+            **computed,
+        })
+
+        # 整批共用同一個計算時間
+        result['calculated_at'] = datetime.now()
+
+        return result
+
+# 情境立方體的每位旅客碳排放分量 (最後一個維度)
+CUBE_COMPONENTS = ('intercity_emissions', 'route_emissions', 'dining_emissions', 'coffee_emissions', 'walking_carbon_saved')
+
+# 情境立方體的距離欄位 (只與路線、出發城市有關)
+CUBE_DISTANCES = ('intercity_distance', 'route_distance', 'walking_distance', 'total_distance')
+
+@dataclass(frozen=True, eq=False)
+class ScenarioCube:
+    """每位旅客碳排放情境立方體 (路線 × 城市 × 交通 × 用餐 × 咖啡)
+
+    城市維度最後一格為未列出城市的預設距離；所有陣列皆為唯讀，可跨 session 共用。
+    """
+    signature: Tuple
+    route_index: Mapping[str, int]
+    city_index: Mapping[str, int]
+    transport_index: Mapping[str, int]
+    dining_index: Mapping[str, int]
+    coffee_index: Mapping[str, int]
+    per_traveler: np.ndarray  # shape: (路線, 城市+1, 交通, 用餐, 咖啡, len(CUBE_COMPONENTS))
+    distances: np.ndarray     # shape: (路線, 城市+1, len(CUBE_DISTANCES))
+
+    def __post_init__(self):
+        # 單筆查表使用 Python 串列，避免 NumPy 純量轉換成本
+        object.__setattr__(self, '_component_rows', self.per_traveler.reshape(-1, len(CUBE_COMPONENTS)).tolist())
+        object.__setattr__(self, '_distance_rows', self.distances.reshape(-1, len(CUBE_DISTANCES)).tolist())
+
+    @property
+    def fingerprint(self) -> str:
+        """資料表簽章的雜湊值，供記錄與比對使用"""
+        return hashlib.sha1(repr(self.signature).encode('utf-8')).hexdigest()
+
+    def codes_for(self, route_option: str, departure_city: str, transport_mode: str,
+                  dining_choice: str, coffee_choice: str) -> Tuple[int, int, int, int, int]:
+        """將旅程選項轉換為立方體索引 (未列出的城市對應預設距離)"""
+        return (
+            self.route_index[route_option],
+            self.city_index.get(departure_city, len(self.city_index)),
+            self.transport_index[transport_mode],
+            self.dining_index[dining_choice],
+            self.coffee_index[coffee_choice],
+        )
+
+    def lookup(self, route_option: str, departure_city: str, transport_mode: str,
+               dining_choice: str, coffee_choice: str, traveler_count: int) -> Dict[str, float]:
+        """查表取得旅程碳排放 = 每位旅客分量 × 旅客人數"""
+        r, c, t, d, k = self.codes_for(route_option, departure_city, transport_mode, dining_choice, coffee_choice)
+        _, cities, transports, dinings, coffees = self.per_traveler.shape[:5]
+        route_city = r * cities + c
+
+        intercity, route, dining, coffee, walking_saved = self._component_rows[
+            ((route_city * transports + t) * dinings + d) * coffees + k
+        ]
+        intercity_distance, route_distance, walking_distance, total_distance = self._distance_rows[route_city]
+
+        intercity *= traveler_count
+        route *= traveler_count
+        dining *= traveler_count
+        coffee *= traveler_count
+        total = intercity + route + dining + coffee
+
+        return {
+            'intercity_distance': intercity_distance,
+            'route_distance': route_distance,
+            'walking_distance': walking_distance,
+            'total_distance': total_distance,
+            'intercity_emissions': intercity,
+            'route_emissions': route,
+            'dining_emissions': dining,
+            'coffee_emissions': coffee,
+            'total_emissions': total,
+            'per_person_emissions': total / traveler_count,
+            'walking_carbon_saved': walking_saved * traveler_count,
+            'tree_equivalent': total / 0.06,
+        }
+
+    def apply(self, trip_data: NantouTripCalculation) -> NantouTripCalculation:
+        """以查表結果填入旅程計算欄位（與 calculate_total_emissions 結果相同）"""
+        values = self.lookup(
+            trip_data.route_option,
+            trip_data.departure_city,
+            trip_data.transport_mode,
+            trip_data.dining_choice,
+            trip_data.coffee_choice,
+            trip_data.traveler_count
+        )
+        for name, value in values.items():
+            setattr(trip_data, name, value)
+        trip_data.calculated_at = datetime.now()
+        return trip_data
+
+@traced()
+def build_scenario_cube(calculator: Optional[NantouCarbonCalculator] = None) -> ScenarioCube:
+    """以批次計算一次建立完整的每位旅客情境立方體"""
+    calculator = calculator or NantouCarbonCalculator()
+
+    shape = (
+        len(calculator.route_distances),
+        len(calculator.city_distances) + 1,
+        len(TRANSPORT_OPTIONS),
+        len(DINING_OPTIONS),
+        len(COFFEE_OPTIONS),
+    )
+    # 城市維度的最後一格 (-1) 代表未列出城市
+    r, c, t, d, k = (codes.ravel() for codes in np.indices(shape))
+    c = np.where(c == shape[1] - 1, -1, c)
+
+    columns = calculator.calculate_batch_arrays(r, c, t, d, k, np.ones(r.size, dtype=np.int64))
+
+    per_traveler = np.stack([columns[name] for name in CUBE_COMPONENTS], axis=-1).reshape(shape + (len(CUBE_COMPONENTS),))
+    distances = np.stack([columns[name] for name in CUBE_DISTANCES], axis=-1).reshape(shape + (len(CUBE_DISTANCES),))
+    distances = np.ascontiguousarray(distances[:, :, 0, 0, 0, :])
+
+    per_traveler.flags.writeable = False
+    distances.flags.writeable = False
+
+    def index_of(keys):
+        return MappingProxyType({key: i for i, key in enumerate(keys)})
+
+    return ScenarioCube(
+        signature=emission_tables_signature(calculator),
+        route_index=index_of(calculator.route_distances),
+        city_index=index_of(calculator.city_distances),
+        transport_index=index_of(TRANSPORT_OPTIONS),
+        dining_index=index_of(DINING_OPTIONS),
+        coffee_index=index_of(COFFEE_OPTIONS),
+        per_traveler=per_traveler,
+        distances=distances,
+    )
+
+def emission_tables_signature(calculator: Optional[NantouCarbonCalculator] = None) -> Tuple:
+    """擷取係數與距離表的內容簽章，資料表變動時立方體需重建"""
+    calculator = calculator or NantouCarbonCalculator()
+    return (
+        # 係數檔內容與今天所在的生效區段 (跨過生效日時立方體需重建)
+        calculator.factor_snapshot.fingerprint,
+        calculator.resolved_factors.start,
+        tuple((k, v['internal_distance'], v['walking_distance']) for k, v in calculator.route_distances.items()),
+        tuple(calculator.city_distances.items()),
+        tuple(TRANSPORT_OPTIONS),
+        tuple(DINING_OPTIONS),
+        tuple(COFFEE_OPTIONS),
+        DEFAULT_CITY_DISTANCE,
+    )
+
+_scenario_cube: Optional[ScenarioCube] = None
+_scenario_cube_lock = threading.Lock()
+
+def get_scenario_cube() -> ScenarioCube:
+    """取得全程序共用的情境立方體，係數表變動時自動重建"""
+    global _scenario_cube
+
+    signature = emission_tables_signature()
+    cube = _scenario_cube
+    if cube is not None and cube.signature == signature:
+        return cube
+
+    with _scenario_cube_lock:
+        if _scenario_cube is None or _scenario_cube.signature != signature:
+            _scenario_cube = build_scenario_cube()
+        return _scenario_cube
+
 class DistanceCalculator:
     """距離計算器"""
     
@@ -368,54 +654,114 @@ class DistanceCalculator:
     
     def calculate_intercity_distance(self, departure_city: str) -> float:
         """計算出發城市到南投的距離"""
-        return self.city_distances.get(departure_city, 200)  # 預設200公里
+        return self.city_distances.get(departure_city, DEFAULT_CITY_DISTANCE)  # 預設200公里
     
     def get_route_internal_distance(self, route_option: str) -> float:
         """獲取預設路線的內部移動距離"""
         route_data = NANTOU_ROUTES.get(route_option, NANTOU_ROUTES['route_a'])
         return route_data['internal_distance']
 
+# 每人平均碳排放超過此值 (kg CO2e) 時給予高碳建議
+HIGH_CARBON_PER_PERSON_KG = 30
+
+def evaluate_recommendation_rules(dining_choice: str, coffee_choice: str, transport_mode: str,
+                                  high_carbon: bool) -> Dict[str, Tuple[str, ...]]:
+    """依用餐、咖啡、交通選擇與是否高碳，逐條判斷個人化環保建議"""
+    recommendations = {
+        'dining': [],
+        'coffee': [],
+        'transport': [],
+        'general': []
+    }
+    
+    # 根據飲食選擇給建議
+    if dining_choice == 'local_meat':
+        recommendations['dining'].append(
+            "您知道嗎？下次旅程若選擇在地蔬食，光是一餐就能減少約 2 公斤的碳排放，相當於少開車 17 公里喔！"
+        )
+    elif dining_choice == 'local_vegetarian':
+        recommendations['dining'].append(
+            "太棒了！您選擇了蔬食餐點，為地球減少了大量碳排放。繼續保持這個環保習慣！"
+        )
+    elif dining_choice == 'self_prepared':
+        recommendations['dining'].append(
+            "自備餐點是最環保的選擇！您不僅減少了碳排放，還避免了包裝廢棄物的產生。"
+        )
+    
+    # 根據咖啡選擇給建議
+    if coffee_choice == 'latte_cappuccino':
+        recommendations['coffee'].append(
+            "國姓的黑咖啡風味絕佳！下次嘗試看看，不僅能品嚐到咖啡豆最純粹的風味，碳足跡也比拿鐵低了許多！"
+        )
+    elif coffee_choice == 'black_coffee':
+        recommendations['coffee'].append(
+            "您選擇了黑咖啡，既能品味國姓咖啡豆的純粹風味，又是最環保的咖啡選擇！"
+        )
+    
+    # 根據交通方式給建議
+    if transport_mode == 'bus':
+        recommendations['transport'].append(
+            "您選擇了最環保的旅行方式之一！感謝您為這趟旅程大幅降低了碳足跡。"
+        )
+    elif transport_mode == 'car_petrol':
+        recommendations['transport'].append(
+            "下次旅行時，考慮與朋友共乘或選擇大眾運輸，可以大幅減少碳排放。"
+        )
+    
+    # 一般建議
+    if high_carbon:
+        recommendations['general'].append(
+            "您的碳足跡較高，建議考慮碳抵消方案來中和環境影響。"
+        )
+    else:
+        recommendations['general'].append(
+            "恭喜！您選擇了相對低碳的旅遊方式，為環境保護做出了貢獻。"
+        )
+    
+    return {category: tuple(recs) for category, recs in recommendations.items()}
+
+def _copy_recommendations(compiled: Mapping[str, Tuple[str, ...]]) -> Dict[str, List[str]]:
+    """複製共用建議表的內容，呼叫端可自由修改回傳的串列"""
+    return {
+        'dining': list(compiled['dining']),
+        'coffee': list(compiled['coffee']),
+        'transport': list(compiled['transport']),
+        'general': list(compiled['general']),
+    }
+
 class EcoRecommendationEngine:
     """環保建議生成器"""
     
     def __init__(self):
         self.recommendation_templates = self.load_recommendation_templates()
     
+    @traced()
+    def calculate_transport_totals(self, trip_data: NantouTripCalculation) -> Dict[str, float]:
+        """一次計算各交通方式的旅程總碳排放（保留原本的用餐與咖啡選擇）"""
+        cube = get_scenario_cube()
+        return dict(_transport_totals(
+            cube,
+            trip_data.route_option,
+            trip_data.departure_city,
+            trip_data.dining_choice,
+            trip_data.coffee_choice,
+            trip_data.traveler_count
+        ))
+
+    @traced()
     def generate_transport_alternatives(self, current_transport: str, total_emissions: float, trip_data: NantouTripCalculation) -> List[TransportAlternative]:
         """生成綠色交通替代建議"""
-        alternatives = []
-        
-        # 計算不同交通方式的排放量
-        calculator = NantouCarbonCalculator()
-        
-        for transport_mode, transport_info in TRANSPORT_OPTIONS.items():
-            if transport_mode != current_transport:
-                # 創建替代方案的計算資料
-                alt_trip = NantouTripCalculation(
-                    route_option=trip_data.route_option,
-                    traveler_count=trip_data.traveler_count,
-                    transport_mode=transport_mode,
-                    departure_city=trip_data.departure_city
-                )
-                
-                # 計算替代方案的排放量
-                alt_trip = calculator.calculate_total_emissions(alt_trip)
-                
-                # 計算減少量
-                emissions_reduction = total_emissions - alt_trip.total_emissions
-                percentage_reduction = (emissions_reduction / total_emissions) * 100 if total_emissions > 0 else 0
-                
-                if emissions_reduction > 0:
-                    recommendation_text = f"若改搭{transport_info['name']}，您這次的旅程能減少 {emissions_reduction:.1f} 公斤的碳排放！"
-                    
-                    alternatives.append(TransportAlternative(
-                        transport_mode=transport_info['name'],
-                        emissions_reduction=emissions_reduction,
-                        percentage_reduction=percentage_reduction,
-                        recommendation_text=recommendation_text
-                    ))
-        
-        return alternatives
+        alternatives = _transport_alternatives(
+            get_scenario_cube(),
+            trip_data.route_option,
+            trip_data.departure_city,
+            trip_data.dining_choice,
+            trip_data.coffee_choice,
+            trip_data.traveler_count,
+            current_transport,
+            total_emissions
+        )
+        return list(alternatives)
     
     def generate_sustainable_dining_tips(self) -> List[str]:
         """生成永續飲食建議"""
@@ -434,60 +780,36 @@ class EcoRecommendationEngine:
         ]
     
     def generate_personalized_recommendations(self, trip_data: NantouTripCalculation) -> Dict[str, List[str]]:
-        """生成個人化的環保建議"""
-        recommendations = {
-            'dining': [],
-            'coffee': [],
-            'transport': [],
-            'general': []
-        }
-        
-        # 根據飲食選擇給建議
-        if trip_data.dining_choice == 'local_meat':
-            recommendations['dining'].append(
-                "您知道嗎？下次旅程若選擇在地蔬食，光是一餐就能減少約 2 公斤的碳排放，相當於少開車 17 公里喔！"
-            )
-        elif trip_data.dining_choice == 'local_vegetarian':
-            recommendations['dining'].append(
-                "太棒了！您選擇了蔬食餐點，為地球減少了大量碳排放。繼續保持這個環保習慣！"
-            )
-        elif trip_data.dining_choice == 'self_prepared':
-            recommendations['dining'].append(
-                "自備餐點是最環保的選擇！您不僅減少了碳排放，還避免了包裝廢棄物的產生。"
-            )
-        
-        # 根據咖啡選擇給建議
-        if trip_data.coffee_choice == 'latte_cappuccino':
-            recommendations['coffee'].append(
-                "國姓的黑咖啡風味絕佳！下次嘗試看看，不僅能品嚐到咖啡豆最純粹的風味，碳足跡也比拿鐵低了許多！"
-            )
-        elif trip_data.coffee_choice == 'black_coffee':
-            recommendations['coffee'].append(
-                "您選擇了黑咖啡，既能品味國姓咖啡豆的純粹風味，又是最環保的咖啡選擇！"
-            )
-        
-        # 根據交通方式給建議
-        if trip_data.transport_mode == 'bus':
-            recommendations['transport'].append(
-                "您選擇了最環保的旅行方式之一！感謝您為這趟旅程大幅降低了碳足跡。"
-            )
-        elif trip_data.transport_mode == 'car_petrol':
-            recommendations['transport'].append(
-                "下次旅行時，考慮與朋友共乘或選擇大眾運輸，可以大幅減少碳排放。"
-            )
+        """生成個人化的環保建議（查詢預先編譯的建議表）"""
+        key = (
+            trip_data.dining_choice,
+            trip_data.coffee_choice,
+            trip_data.transport_mode,
+            trip_data.per_person_emissions > HIGH_CARBON_PER_PERSON_KG
+        )
+        compiled = _RECOMMENDATION_LOOKUP.get(key)
+        if compiled is None:
+            # 不在選項表中的代碼仍依規則逐條判斷
+            compiled = evaluate_recommendation_rules(*key)
         
-        # 一般建議
-        if trip_data.per_person_emissions > 30:
-            recommendations['general'].append(
-                "您的碳足跡較高，建議考慮碳抵消方案來中和環境影響。"
-            )
-        else:
-            recommendations['general'].append(
-                "恭喜！您選擇了相對低碳的旅遊方式，為環境保護做出了貢獻。"
-            )
+        return _copy_recommendations(compiled)
+    
+    @traced()
+    def assign_recommendation_ids(self, dining_choice: Sequence, coffee_choice: Sequence,
+                                  transport_mode: Sequence, per_person_emissions: Sequence) -> np.ndarray:
+        """向量化計算整欄結果的建議編號 (對應 RECOMMENDATION_TABLE 的索引)"""
+        dining_codes = encode_category_codes(dining_choice, list(DINING_OPTIONS), 'dining_choice')
+        coffee_codes = encode_category_codes(coffee_choice, list(COFFEE_OPTIONS), 'coffee_choice')
+        transport_codes = encode_category_codes(transport_mode, list(TRANSPORT_OPTIONS), 'transport_mode')
+        high_carbon = (np.asarray(per_person_emissions, dtype=np.float64) > HIGH_CARBON_PER_PERSON_KG).astype(np.int64)
         
-        return recommendations
+        return ((dining_codes * len(COFFEE_OPTIONS) + coffee_codes) * len(TRANSPORT_OPTIONS) + transport_codes) * 2 + high_carbon
     
+    def recommendations_for_id(self, rec_id: int) -> Dict[str, List[str]]:
+        """由建議編號取得建議內容"""
+        return _copy_recommendations(RECOMMENDATION_TABLE[rec_id])
+    
+    @traced()
     def generate_eco_recommendations(self, trip_data: NantouTripCalculation) -> List[str]:
         """生成綜合環保建議（保持向後相容）"""
         personalized = self.generate_personalized_recommendations(trip_data)
@@ -506,6 +828,94 @@ class EcoRecommendationEngine:
             'high_carbon': "建議考慮更環保的交通方式或碳抵消方案。"
         }
 
+def compile_recommendation_table() -> Tuple[Mapping[str, Tuple[str, ...]], ...]:
+    """將建議規則編譯為查找表，索引為 recommendation_id 計算出的建議編號"""
+    table = []
+    for dining_choice in DINING_OPTIONS:
+        for coffee_choice in COFFEE_OPTIONS:
+            for transport_mode in TRANSPORT_OPTIONS:
+                for high_carbon in (False, True):
+                    table.append(MappingProxyType(
+                        evaluate_recommendation_rules(dining_choice, coffee_choice, transport_mode, high_carbon)
+                    ))
+    return tuple(table)
+
+# 建議查找表的選項索引
+_DINING_INDEX = {key: i for i, key in enumerate(DINING_OPTIONS)}
+_COFFEE_INDEX = {key: i for i, key in enumerate(COFFEE_OPTIONS)}
+_TRANSPORT_INDEX = {key: i for i, key in enumerate(TRANSPORT_OPTIONS)}
+
+def recommendation_id(dining_choice: str, coffee_choice: str, transport_mode: str, per_person_emissions: float) -> int:
+    """計算單筆旅程的建議編號 (代碼不在選項表中時引發 KeyError)"""
+    high_carbon = 1 if per_person_emissions > HIGH_CARBON_PER_PERSON_KG else 0
+    return ((_DINING_INDEX[dining_choice] * len(COFFEE_OPTIONS) + _COFFEE_INDEX[coffee_choice])
+            * len(TRANSPORT_OPTIONS) + _TRANSPORT_INDEX[transport_mode]) * 2 + high_carbon
+
+# 匯入時編譯的建議查找表 (各 session 共用)
+RECOMMENDATION_TABLE = compile_recommendation_table()
+
+# 單筆查詢用：(用餐, 咖啡, 交通, 是否高碳) -> 建議
+_RECOMMENDATION_LOOKUP = {
+    (dining_choice, coffee_choice, transport_mode, high_carbon): RECOMMENDATION_TABLE[
+        recommendation_id(dining_choice, coffee_choice, transport_mode, HIGH_CARBON_PER_PERSON_KG + 1 if high_carbon else 0)
+    ]
+    for dining_choice in DINING_OPTIONS
+    for coffee_choice in COFFEE_OPTIONS
+    for transport_mode in TRANSPORT_OPTIONS
+    for high_carbon in (False, True)
+}
+
+_recommendation_engine = EcoRecommendationEngine()
+
+def get_recommendation_engine() -> EcoRecommendationEngine:
+    """取得全程序共用的環保建議生成器"""
+    return _recommendation_engine
+
+@lru_cache(maxsize=1024)
+def _transport_totals(cube: ScenarioCube, route_option: str, departure_city: str,
+                      dining_choice: str, coffee_choice: str, traveler_count: int) -> Tuple[Tuple[str, float], ...]:
+    """由情境立方體一次取出所有交通方式的總碳排放 (依旅程快取)"""
+    r = cube.route_index[route_option]
+    c = cube.city_index.get(departure_city, len(cube.city_index))
+    d = cube.dining_index[dining_choice]
+    k = cube.coffee_index[coffee_choice]
+
+    # 只有城際與路線內交通隨交通方式改變，用餐與咖啡分量維持不變
+    components = cube.per_traveler[r, c, :, d, k, :] * traveler_count
+    totals = components[:, 0] + components[:, 1] + components[:, 2] + components[:, 3]
+
+    return tuple(zip(cube.transport_index, totals.tolist()))
+
+@lru_cache(maxsize=1024)
+def _transport_alternatives(cube: ScenarioCube, route_option: str, departure_city: str,
+                            dining_choice: str, coffee_choice: str, traveler_count: int,
+                            current_transport: str, total_emissions: float) -> Tuple[TransportAlternative, ...]:
+    """計算並快取單一旅程的交通替代方案"""
+    alternatives = []
+
+    totals = _transport_totals(cube, route_option, departure_city, dining_choice, coffee_choice, traveler_count)
+
+    for transport_mode, alt_total in totals:
+        if transport_mode == current_transport:
+            continue
+
+        # 計算減少量
+        emissions_reduction = total_emissions - alt_total
+        percentage_reduction = (emissions_reduction / total_emissions) * 100 if total_emissions > 0 else 0
+
+        if emissions_reduction > 0:
+            transport_info = TRANSPORT_OPTIONS[transport_mode]
+            recommendation_text = f"若改搭{transport_info['name']}，您這次的旅程能減少 {emissions_reduction:.1f} 公斤的碳排放！"
+
+            alternatives.append(TransportAlternative(
+                transport_mode=transport_info['name'],
+                emissions_reduction=emissions_reduction,
+                percentage_reduction=percentage_reduction,
+                recommendation_text=recommendation_text
+            ))
+
+    return tuple(alternatives)
+
 # 輔助函數
 def get_route_info(route_id: str) -> RouteInfo:
     """獲取路線資訊"""
@@ -521,6 +931,37 @@ def get_route_info(route_id: str) -> RouteInfo:
         highlights=route_data['highlights']
     )
 
+def encode_category_codes(values: Union[Sequence, np.ndarray], categories: List[str],
+                          field_name: str = 'value', strict: bool = True) -> np.ndarray:
+    """將字串代碼或整數代碼轉換為類別索引陣列（依 categories 的順序）"""
+    array = np.asarray(values)
+
+    if array.dtype.kind in 'iu':
+        codes = array.astype(np.int64)
+        invalid = (codes < 0) | (codes >= len(categories))
+    else:
+        codes = pd.Categorical(array, categories=categories).codes.astype(np.int64)
+        invalid = codes < 0
+
+    if invalid.any():
+        if strict:
+            unknown = sorted({str(v) for v in array[invalid]})
+            raise KeyError(f"無效的 {field_name}: {', '.join(unknown[:5])}")
+        codes = np.where(invalid, -1, codes)
+
+    return codes
+
+def decode_category_codes(codes: np.ndarray, categories: List[str]) -> np.ndarray:
+    """將類別索引陣列轉回字串代碼"""
+    return np.asarray(categories, dtype=object)[codes]
+
+def _as_label_array(values: Union[Sequence, np.ndarray], codes: np.ndarray, categories: List[str]) -> np.ndarray:
+    """保留字串輸入（含未列出的城市），整數代碼則轉回對應標籤"""
+    array = np.asarray(values)
+    if array.dtype.kind in 'iu':
+        return decode_category_codes(codes, categories + [None])
+    return array.astype(object)
+
 def get_transport_options() -> Dict:
     """獲取交通工具選項"""
     return TRANSPORT_OPTIONS
@@ -548,6 +989,7 @@ def validate_trip_input(trip_data: dict) -> List[str]:
     
     return errors
 
+@traced()
 def format_nantou_trip_result(trip_data: NantouTripCalculation) -> Dict:
     """格式化南投旅程計算結果供顯示使用"""
     
@@ -583,6 +1025,7 @@ class NantouTripValidator:
     """南投旅程輸入驗證器"""
     
     @staticmethod
+    @traced()
     def validate_trip_input(trip_data: dict) -> List[str]:
         """驗證旅程輸入資料"""
         errors = []
@@ -614,6 +1057,30 @@ class NantouTripValidator:
         """驗證交通方式"""
         return transport_mode in TRANSPORT_OPTIONS
 
+    @staticmethod
+    @traced()
+    def validate_trip_options(trip_data: dict) -> List[str]:
+        """驗證已填寫的選項代碼是否存在 (批次匯入時使用)"""
+        errors = []
+
+        route_option = trip_data.get('route_option')
+        if route_option and route_option not in NANTOU_ROUTES:
+            errors.append(f"無效的旅遊路線: {route_option}")
+
+        transport_mode = trip_data.get('transport_mode')
+        if transport_mode and transport_mode not in TRANSPORT_OPTIONS:
+            errors.append(f"無效的交通方式: {transport_mode}")
+
+        dining_choice = trip_data.get('dining_choice')
+        if dining_choice and dining_choice not in DINING_OPTIONS:
+            errors.append(f"無效的用餐選擇: {dining_choice}")
+
+        coffee_choice = trip_data.get('coffee_choice')
+        if coffee_choice and coffee_choice not in COFFEE_OPTIONS:
+            errors.append(f"無效的咖啡選擇: {coffee_choice}")
+
+        return errors
+
 # 資料載入函數
 def load_preset_routes() -> Dict:
     """載入預設路線資料"""
@@ -635,6 +1102,6 @@ def load_coffee_options() -> Dict:
     """載入咖啡選擇選項"""
     return COFFEE_OPTIONS
 
-def load_taiwan_emission_factors() -> Dict:
-    """載入台灣環境部碳排放係數"""
-    return TAIWAN_EMISSION_FACTORS
\ No newline at end of file
+def load_taiwan_emission_factors(effective_date: Optional[date] = None) -> Mapping[str, Mapping[str, float]]:
+    """載入台灣環境部碳排放係數 (目前使用中的係數檔在 effective_date 生效的係數，預設今天)"""
+    return get_emission_factors().resolve(effective_date or date.today()).factors
\ No newline at end of file
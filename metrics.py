@@ -0,0 +1,317 @@
+"""
+程序內指標模組
+計數器與直方圖以分片方式累計：每個執行緒固定使用其中一個分片，各分片有自己的鎖，
+Streamlit 伺服器的多個 session 執行緒同時記錄時幾乎不會互相等待；只有抓取 (scrape) 時才合併所有分片。
+指標以 Prometheus 文字格式由本機 HTTP 端點提供。
+
+用法：
+    環境變數 NANTOU_METRICS_PORT 指定端點連接埠 (預設 9464，設為 0 停用)
+    curl http://127.0.0.1:9464/metrics
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+import math
+import os
+import threading
+import time
+import warnings
+
+METRICS_PORT_ENV_VAR = 'NANTOU_METRICS_PORT'
+DEFAULT_METRICS_PORT = 9464
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# 分片數 (大於 Streamlit 同時執行的 session 執行緒數即可)
+NUM_SHARDS = 16
+
+# 重新執行延遲的直方圖區間 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 單次計算延遲的直方圖區間 (秒)
+CALCULATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# 多久內有重新執行的 session 視為活躍 (秒)
+ACTIVE_SESSION_WINDOW = 300.0
+
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LabelValues = Tuple[str, ...]
+# (樣本名稱後綴, 額外標籤, 值)
+Sample = Tuple[str, Dict[str, str], float]
+
+_thread_shard = threading.local()
+_shard_counter = count()
+
+def shard_index() -> int:
+    """目前執行緒使用的分片 (第一次使用時依序分配)"""
+    try:
+        return _thread_shard.index
+    except AttributeError:
+        _thread_shard.index = next(_shard_counter) % NUM_SHARDS
+        return _thread_shard.index
+
+class _Shard:
+    __slots__ = ('lock', 'values')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: Dict[LabelValues, object] = {}
+
+class Metric:
+    """指標基底類別：名稱、說明與標籤名稱"""
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def label_values(self, labels: Dict[str, object]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[LabelValues, List[Sample]]]:
+        raise NotImplementedError
+
+class ShardedMetric(Metric):
+    """以分片累計的指標"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards = [_Shard() for _ in range(NUM_SHARDS)]
+
+    def _merged(self, merge: Callable[[object, object], object], copy: Callable[[object], object]) -> Dict[LabelValues, object]:
+        merged: Dict[LabelValues, object] = {}
+        for shard in self._shards:
+            with shard.lock:
+                for key, value in shard.values.items():
+                    merged[key] = merge(merged[key], value) if key in merged else copy(value)
+        return merged
+
+class Counter(ShardedMetric):
+    """只增不減的計數器"""
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self.label_values(labels)
+        shard = self._shards[shard_index()]
+        with shard.lock:
+            shard.values[key] = shard.values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[Tuple[LabelValues, List[Sample]]]:
+        for key, value in sorted(self._merged(lambda a, b: a + b, lambda v: v).items()):
+            yield key, [('', {}, value)]
+
+class Histogram(ShardedMetric):
+    """累計分布的直方圖 (各區間計數、總和與次數)"""
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_values(labels)
+        index = bisect_left(self.buckets, value)
+        shard = self._shards[shard_index()]
+        with shard.lock:
+            state = shard.values.get(key)
+            if state is None:
+                # [各區間計數 (最後一格為 +Inf), 總和]
+                state = shard.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """記錄區塊的執行秒數"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[Tuple[LabelValues, List[Sample]]]:
+        def merge(a, b):
+            return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+        def copy(state):
+            return [list(state[0]), state[1]]
+
+        for key, (bucket_counts, total) in sorted(self._merged(merge, copy).items()):
+            samples = []
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', {'le': format_value(bound)}, cumulative))
+            samples.append(('_sum', {}, total))
+            samples.append(('_count', {}, cumulative))
+            yield key, samples
+
+class CallbackGauge(Metric):
+    """抓取時才呼叫函數取值的量表 (例如快取大小、活躍 session 數)"""
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float],
+                 metric_type: str = 'gauge'):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.metric_type = metric_type
+
+    def samples(self) -> Iterator[Tuple[LabelValues, List[Sample]]]:
+        yield (), [('', {}, float(self.callback()))]
+
+class SessionTracker:
+    """記錄各 session 最近一次重新執行的時間，計算活躍 session 數"""
+
+    def __init__(self, window: float = ACTIVE_SESSION_WINDOW):
+        self.window = window
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str) -> None:
+        # 單一 dict 指派在 GIL 下是原子操作，不需要鎖
+        self._last_seen[session_id] = time.monotonic()
+
+    def active_count(self) -> int:
+        """清除逾時的 session 並回傳活躍數"""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            expired = [key for key, seen in list(self._last_seen.items()) if seen < cutoff]
+            for key in expired:
+                self._last_seen.pop(key, None)
+            return len(self._last_seen)
+
+class MetricsRegistry:
+    """指標登錄表 (同名指標只保留最後一次登錄)"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """輸出 Prometheus 文字格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for label_values, samples in metric.samples():
+                base_labels = dict(zip(metric.labelnames, label_values))
+                for suffix, extra_labels, value in samples:
+                    labels = {**base_labels, **extra_labels}
+                    lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + '}'
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+REGISTRY = MetricsRegistry()
+
+# 應用程式指標
+CALCULATION_SECONDS = REGISTRY.register(Histogram(
+    'nantou_calculation_seconds', '單次碳足跡計算延遲 (秒，含快取查詢)', buckets=CALCULATION_BUCKETS
+))
+CALCULATIONS_TOTAL = REGISTRY.register(Counter(
+    'nantou_calculations_total', '依路線與交通工具的碳足跡計算次數', labelnames=('route', 'transport')
+))
+RERUN_SECONDS = REGISTRY.register(Histogram(
+    'nantou_rerun_seconds', '依頁面的重新執行延遲 (秒；scope=full 為整頁，fragment 為單一頁面區塊)',
+    labelnames=('view', 'scope')
+))
+SESSIONS_STARTED_TOTAL = REGISTRY.register(Counter(
+    'nantou_sessions_started_total', '已開始的瀏覽器 session 數'
+))
+ACTIVE_SESSIONS = SessionTracker()
+REGISTRY.register(CallbackGauge(
+    'nantou_active_sessions', f'最近 {ACTIVE_SESSION_WINDOW:.0f} 秒內有重新執行的 session 數',
+    ACTIVE_SESSIONS.active_count
+))
+
+def register_cache_metrics(cache, registry: MetricsRegistry = REGISTRY) -> None:
+    """登錄計算快取的統計 (抓取時才讀取 cache.stats()，不影響計算路徑)"""
+    counters = (
+        ('hits', '快取直接命中次數'),
+        ('misses', '快取未命中 (實際計算) 次數'),
+        ('coalesced', '合併到進行中計算的請求數'),
+        ('evictions', '快取 LRU 淘汰次數'),
+    )
+    for field_name, documentation in counters:
+        registry.register(CallbackGauge(
+            f'nantou_cache_{field_name}_total', documentation,
+            lambda field_name=field_name: getattr(cache.stats(), field_name), metric_type='counter'
+        ))
+    registry.register(CallbackGauge('nantou_cache_size', '快取目前項目數', lambda: cache.stats().size))
+    registry.register(CallbackGauge('nantou_cache_hit_ratio', '快取命中率 (合併請求視為命中)',
+                                    lambda: cache.stats().hit_rate))
+
+def metrics_port() -> int:
+    """metrics 端點連接埠 (0 代表停用)"""
+    value = os.environ.get(METRICS_PORT_ENV_VAR)
+    if value is None or not value.strip():
+        return DEFAULT_METRICS_PORT
+    try:
+        port = int(value)
+    except ValueError:
+        port = -1
+    if not 0 <= port <= 65535:
+        # 設定錯誤只停用端點，不讓每次重新執行都失敗
+        warnings.warn(f"{METRICS_PORT_ENV_VAR}={value!r} 不是有效的連接埠，已停用 metrics 端點")
+        return 0
+    return port
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', EXPOSITION_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取請求很頻繁，不寫入存取紀錄
+
+def start_metrics_server(port: int, host: str = DEFAULT_METRICS_HOST,
+                         registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """在背景執行緒啟動 metrics 端點 (連接埠被佔用時拋出 OSError)"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='nantou-metrics', daemon=True).start()
+    return server
@@ -0,0 +1,204 @@
+"""
+多核心平行批次計算模組
+輸入代碼與計算結果都放在共享記憶體的 NumPy 緩衝區，工作程序依固定區段就地寫入結果，不需序列化任何資料列；
+輸出順序與輸入相同，與單一程序的 calculate_batch_arrays 結果逐位元一致
+
+用法：
+    python parallel_batch.py --trips 20000000 --workers 32
+    python parallel_batch.py --trips 2000000 --workers 4 --compare
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from functions import (
+    CITY_DISTANCES,
+    COFFEE_OPTIONS,
+    DINING_OPTIONS,
+    NANTOU_ROUTES,
+    TRANSPORT_OPTIONS,
+    NantouCarbonCalculator
+)
+
+# 輸入欄位 (整數代碼，順序同 calculate_batch_arrays 的參數)
+INPUT_COLUMNS = ('route_codes', 'city_codes', 'transport_codes', 'dining_codes', 'coffee_codes', 'traveler_count')
+INPUT_DTYPE = np.int32
+
+# 輸出欄位 (calculate_batch_arrays 的計算結果)
+OUTPUT_COLUMNS = (
+    'intercity_distance', 'route_distance', 'walking_distance', 'total_distance',
+    'intercity_emissions', 'route_emissions', 'dining_emissions', 'coffee_emissions',
+    'total_emissions', 'per_person_emissions', 'walking_carbon_saved', 'tree_equivalent'
+)
+OUTPUT_DTYPE = np.float64
+
+# 每個工作區段的列數 (限制各工作程序的暫存記憶體)
+DEFAULT_CHUNK_SIZE = 1 << 18
+
+class SharedBatch:
+    """存放在共享記憶體中的一批旅程代碼與計算結果"""
+
+    def __init__(self, size: int, input_name: Optional[str] = None, output_name: Optional[str] = None):
+        self.size = size
+        self._owner = input_name is None
+        input_bytes = max(len(INPUT_COLUMNS) * size * np.dtype(INPUT_DTYPE).itemsize, 1)
+        output_bytes = max(len(OUTPUT_COLUMNS) * size * np.dtype(OUTPUT_DTYPE).itemsize, 1)
+
+        if self._owner:
+            self._input_shm = shared_memory.SharedMemory(create=True, size=input_bytes)
+            self._output_shm = shared_memory.SharedMemory(create=True, size=output_bytes)
+        else:
+            self._input_shm = shared_memory.SharedMemory(name=input_name)
+            self._output_shm = shared_memory.SharedMemory(name=output_name)
+
+        input_matrix = np.ndarray((len(INPUT_COLUMNS), size), dtype=INPUT_DTYPE, buffer=self._input_shm.buf)
+        output_matrix = np.ndarray((len(OUTPUT_COLUMNS), size), dtype=OUTPUT_DTYPE, buffer=self._output_shm.buf)
+        self.inputs: Dict[str, np.ndarray] = dict(zip(INPUT_COLUMNS, input_matrix))
+        self.outputs: Dict[str, np.ndarray] = dict(zip(OUTPUT_COLUMNS, output_matrix))
+
+    @property
+    def names(self) -> Tuple[str, str]:
+        """共享記憶體名稱 (供工作程序連接)"""
+        return self._input_shm.name, self._output_shm.name
+
+    def close(self) -> None:
+        """釋放對共享記憶體的引用；建立者同時刪除共享記憶體"""
+        self.inputs = {}
+        self.outputs = {}
+        self._input_shm.close()
+        self._output_shm.close()
+        if self._owner:
+            self._input_shm.unlink()
+            self._output_shm.unlink()
+
+    def __enter__(self) -> 'SharedBatch':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def compute_range(batch: SharedBatch, start: int, stop: int, calculator: NantouCarbonCalculator) -> None:
+    """計算 [start, stop) 區段並就地寫入輸出緩衝區"""
+    computed = calculator.calculate_batch_arrays(*(batch.inputs[name][start:stop] for name in INPUT_COLUMNS))
+    for name in OUTPUT_COLUMNS:
+        batch.outputs[name][start:stop] = computed[name]
+
+# 工作程序的狀態 (由 _init_worker 設定)
+_worker_batch: Optional[SharedBatch] = None
+_worker_calculator: Optional[NantouCarbonCalculator] = None
+
+def _init_worker(input_name: str, output_name: str, size: int, calculator: NantouCarbonCalculator) -> None:
+    """工作程序啟動時連接共享記憶體，並沿用主程序的係數表"""
+    global _worker_batch, _worker_calculator
+    _worker_batch = SharedBatch(size, input_name, output_name)
+    _worker_calculator = calculator
+
+def _compute_worker_range(bounds: Tuple[int, int]) -> int:
+    start, stop = bounds
+    compute_range(_worker_batch, start, stop, _worker_calculator)
+    return stop - start
+
+def chunk_bounds(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """將 [0, size) 切成固定大小的區段"""
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+def run_parallel(batch: SharedBatch, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 calculator: Optional[NantouCarbonCalculator] = None) -> None:
+    """以程序池計算整批旅程；每個區段寫入固定位置，結果順序與排程無關"""
+    calculator = calculator or NantouCarbonCalculator()
+    workers = workers or os.cpu_count() or 1
+    bounds = chunk_bounds(batch.size, chunk_size)
+
+    if workers == 1 or len(bounds) <= 1:
+        for start, stop in bounds:
+            compute_range(batch, start, stop, calculator)
+        return
+
+    input_name, output_name = batch.names
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(bounds)),
+        initializer=_init_worker,
+        initargs=(input_name, output_name, batch.size, calculator)
+    ) as executor:
+        # 區段數遠多於工作程序數，讓較快的程序多分擔
+        for _ in executor.map(_compute_worker_range, bounds):
+            pass
+
+def calculate_batch_parallel(route_codes: np.ndarray, city_codes: np.ndarray, transport_codes: np.ndarray,
+                             dining_codes: np.ndarray, coffee_codes: np.ndarray, traveler_count: np.ndarray,
+                             workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             calculator: Optional[NantouCarbonCalculator] = None) -> Dict[str, np.ndarray]:
+    """平行版的 calculate_batch_arrays：輸入整數代碼陣列，回傳各欄位結果陣列"""
+    columns = (route_codes, city_codes, transport_codes, dining_codes, coffee_codes, traveler_count)
+    size = len(traveler_count)
+    calculator = calculator or NantouCarbonCalculator()
+
+    with SharedBatch(size) as batch:
+        for name, values in zip(INPUT_COLUMNS, columns):
+            batch.inputs[name][:] = values
+        # 城市代碼 -1 代表未列出的城市，換成查找表最後一格以便寫入 int32 緩衝區後仍正確
+        city = batch.inputs['city_codes']
+        city[city < 0] = len(calculator.city_distances)
+
+        run_parallel(batch, workers, chunk_size, calculator)
+        return {name: batch.outputs[name].copy() for name in OUTPUT_COLUMNS}
+
+def fill_random_trips(batch: SharedBatch, seed: int = 0, max_travelers: int = 50) -> None:
+    """以固定亂數種子產生模擬旅程代碼 (季節規劃情境模擬用)"""
+    rng = np.random.default_rng(seed)
+    limits = {
+        'route_codes': len(NANTOU_ROUTES),
+        'city_codes': len(CITY_DISTANCES),
+        'transport_codes': len(TRANSPORT_OPTIONS),
+        'dining_codes': len(DINING_OPTIONS),
+        'coffee_codes': len(COFFEE_OPTIONS),
+    }
+    for name, limit in limits.items():
+        batch.inputs[name][:] = rng.integers(0, limit, size=batch.size, dtype=INPUT_DTYPE)
+    batch.inputs['traveler_count'][:] = rng.integers(1, max_travelers + 1, size=batch.size, dtype=INPUT_DTYPE)
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡平行情境模擬")
+    parser.add_argument("--trips", type=int, default=10_000_000, help="模擬旅程數")
+    parser.add_argument("--workers", type=int, default=None, help="工作程序數 (預設為 CPU 核心數)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每個工作區段的列數")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    parser.add_argument("--compare", action="store_true", help="另以單一程序計算並比對結果與速度")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    if args.trips <= 0 or args.chunk_size <= 0:
+        raise SystemExit("--trips 與 --chunk-size 必須大於 0")
+    workers = args.workers or os.cpu_count() or 1
+
+    with SharedBatch(args.trips) as batch:
+        fill_random_trips(batch, args.seed)
+
+        started = time.perf_counter()
+        run_parallel(batch, workers, args.chunk_size)
+        elapsed = time.perf_counter() - started
+        print(f"{args.trips:,} 筆旅程，{workers} 個工作程序：{elapsed:.2f} 秒 ({args.trips / elapsed:,.0f} 筆/秒)")
+        print(f"總碳排放 {batch.outputs['total_emissions'].sum():,.1f} kg CO2e")
+
+        if args.compare:
+            started = time.perf_counter()
+            expected = NantouCarbonCalculator().calculate_batch_arrays(*(batch.inputs[name] for name in INPUT_COLUMNS))
+            single_elapsed = time.perf_counter() - started
+            identical = all(np.array_equal(expected[name], batch.outputs[name]) for name in OUTPUT_COLUMNS)
+            print(f"單一程序：{single_elapsed:.2f} 秒，加速 {single_elapsed / elapsed:.2f} 倍，結果{'一致' if identical else '不一致'}")
+            if not identical:
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
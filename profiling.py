@@ -0,0 +1,174 @@
+"""
+隨需 CPU 效能剖析模組
+對單次重新執行或單次批次工作同時進行兩種剖析，不需在正式程序外掛任何外部工具：
+    cProfile：逐函數的呼叫次數與耗時，輸出 .prof 檔 (可用 pstats / snakeviz 開啟)
+    取樣：背景執行緒定期擷取目標執行緒的呼叫堆疊，輸出 collapsed-stack 格式的 .collapsed 檔
+         (可用 flamegraph.pl 或 speedscope 轉為火焰圖)
+
+啟用方式：
+    網址加上 ?profile=1 剖析該次重新執行；batch_cli.py --profile 剖析整個批次工作
+    環境變數 NANTOU_PROFILE_DIR 指定輸出目錄 (預設為 profiles)
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+PROFILE_DIR_ENV_VAR = 'NANTOU_PROFILE_DIR'
+DEFAULT_PROFILE_DIR = 'profiles'
+
+# 取樣間隔 (秒)；剖析期間同時調低直譯器的執行緒切換間隔，讓取樣執行緒能準時取得 GIL
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+# 同一時間只允許一次剖析：執行緒切換間隔是全程序共用的設定，
+# Python 3.12 起同時啟用兩個 cProfile 也會拋出 ValueError
+_capture_lock = threading.Lock()
+
+# 面板與命令列摘要顯示的函數數量
+DEFAULT_TOP_FUNCTIONS = 25
+
+@dataclass
+class ProfileResult:
+    """一次剖析的輸出檔與摘要"""
+    name: str
+    prof_path: str
+    collapsed_path: str
+    duration_ms: float
+    samples: int
+    top_functions: List[Dict[str, object]] = field(default_factory=list)
+
+class StackSampler:
+    """以背景執行緒定期擷取指定執行緒的呼叫堆疊，累計成 collapsed-stack 計數"""
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='nantou-stack-sampler', daemon=True)
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str) -> None:
+        """寫出 collapsed-stack 檔 (每行為「根;...;葉 次數」)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+def frame_label(frame) -> str:
+    """堆疊中的函數名稱 (模組:限定名稱)"""
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def collapse_stack(frame) -> str:
+    """由最外層到目前函數，以分號串接堆疊"""
+    labels = []
+    while frame is not None:
+        # 分號與空白是 collapsed-stack 格式的分隔符號
+        labels.append(frame_label(frame).replace(';', ':').replace(' ', '_'))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+def profile_dir() -> str:
+    return os.environ.get(PROFILE_DIR_ENV_VAR) or DEFAULT_PROFILE_DIR
+
+def top_functions(profiler: cProfile.Profile, limit: int = DEFAULT_TOP_FUNCTIONS) -> List[Dict[str, object]]:
+    """依累計耗時排序的函數摘要"""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, lineno, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': function,
+            'location': f"{os.path.basename(filename)}:{lineno}",
+            'calls': calls,
+            'own_ms': own * 1000,
+            'cumulative_ms': cumulative * 1000,
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+def format_stats(prof_path: str, limit: int = DEFAULT_TOP_FUNCTIONS) -> str:
+    """pstats 的文字報表 (依累計耗時排序)"""
+    stream = io.StringIO()
+    pstats.Stats(prof_path, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+class ProfileCapture:
+    """capture_profile 的結果容器 (區塊結束後才有 result)"""
+
+    def __init__(self):
+        self.result: Optional[ProfileResult] = None
+
+@contextmanager
+def capture_profile(name: str, enabled: bool = True, output_dir: Optional[str] = None,
+                    interval: float = DEFAULT_SAMPLE_INTERVAL) -> Iterator[Optional[ProfileCapture]]:
+    """剖析區塊內目前執行緒的所有工作；未啟用或已有其他剖析進行中時不做任何事 (回傳 None)"""
+    if not enabled or not _capture_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        with _capture(name, output_dir, interval) as capture:
+            yield capture
+    finally:
+        _capture_lock.release()
+
+@contextmanager
+def _capture(name: str, output_dir: Optional[str], interval: float) -> Iterator[ProfileCapture]:
+    """實際進行剖析 (呼叫端需持有 _capture_lock)"""
+    capture = ProfileCapture()
+    output_dir = output_dir or profile_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    safe_name = re.sub(r'[^\w.-]+', '_', name)
+    stem = os.path.join(output_dir, f"{safe_name}-{datetime.now():%Y%m%d-%H%M%S-%f}")
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), interval)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, interval))
+    sampler.start()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield capture
+    finally:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - started) * 1000
+        sampler.stop()
+        sys.setswitchinterval(switch_interval)
+
+        profiler.dump_stats(stem + '.prof')
+        sampler.write_collapsed(stem + '.collapsed')
+        capture.result = ProfileResult(
+            name=name,
+            prof_path=stem + '.prof',
+            collapsed_path=stem + '.collapsed',
+            duration_ms=duration_ms,
+            samples=sampler.samples,
+            top_functions=top_functions(profiler),
+        )
@@ -0,0 +1,381 @@
+"""
+每人碳排放的串流分位數摘要 (KLL sketch)
+依路線與交通方式各維護一份固定大小的摘要，計算結果到達時即時更新；摘要可序列化為 JSON，
+不同程序各自建立的摘要可直接合併，查詢「低於多少比例的旅客」只需一次二分搜尋。
+排名誤差約為總筆數的 1.7 / k (預設 k=256 時約 ±0.7%)，與資料量無關。
+
+用法：
+    python quantile_sketch.py build --history history.db -o sketches.json
+    python quantile_sketch.py build --store trips_store -o sketches-worker1.json
+    python quantile_sketch.py merge sketches-worker1.json sketches-worker2.json -o sketches.json
+    python quantile_sketch.py rank sketches.json --route route_a --value 25.3
+"""
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+
+import numpy as np
+
+from calculation_history import CalculationHistory, get_calculation_history
+from trip_store import TripStore
+
+SKETCH_FORMAT = 'nantou-kll-sketch'
+SKETCH_VERSION = 1
+
+# 摘要大小參數：最上層的容量，越大越精確 (記憶體約 3k 個數值)
+DEFAULT_K = 256
+# 下層容量依此比例遞減
+CAPACITY_RATIO = 2 / 3
+# 最低層的最小容量
+MIN_CAPACITY = 8
+
+# 維護摘要的維度 (每個維度的每個值一份摘要)
+SKETCH_DIMENSIONS = ('route_option', 'transport_mode')
+# 摘要的數值欄位
+SKETCH_METRIC = 'per_person_emissions'
+
+# 樣本數少於此值時不顯示比較結果 (比例沒有參考價值)
+MIN_COMPARISON_COUNT = 20
+
+# 未設定歷史紀錄時，啟動時載入的摘要檔
+SKETCH_FILE_ENV_VAR = 'NANTOU_SKETCH_FILE'
+
+class KLLSketch:
+    """可合併的串流分位數摘要 (Karnin-Lang-Liberty)
+
+    第 h 層的每個數值代表 2**h 筆原始資料；某層滿了就排序後隨機保留奇數或偶數位置的一半，
+    升到上一層。總筆數再多，保留的數值也只有 O(k) 個。
+    """
+
+    __slots__ = ('k', 'count', 'min', 'max', '_levels', '_size', '_max_size', '_random', '_cdf')
+
+    def __init__(self, k: int = DEFAULT_K, seed: Optional[int] = None):
+        self.k = k
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._levels: List[List[float]] = []
+        self._size = 0
+        self._max_size = 0
+        self._random = random.Random(seed)
+        # 查詢用的 (排序後數值, 累計權重)，更新後失效
+        self._cdf: Optional[Tuple[List[float], List[int]]] = None
+        self._grow()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(MIN_CAPACITY, int(math.ceil(self.k * CAPACITY_RATIO ** depth)))
+
+    def _grow(self) -> None:
+        self._levels.append([])
+        self._max_size = sum(self._capacity(level) for level in range(len(self._levels)))
+
+    def update(self, value: float) -> None:
+        """加入一筆數值 (攤銷 O(1))"""
+        value = float(value)
+        self._levels[0].append(value)
+        self.count += 1
+        self._size += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self._cdf = None
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update_many(self, values: Iterable[float]) -> None:
+        """加入多筆數值"""
+        for value in values:
+            self.update(value)
+
+    def _compress(self) -> None:
+        for level in range(len(self._levels)):
+            items = self._levels[level]
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self._levels):
+                self._grow()
+            items.sort()
+            # 奇數筆時最大的一筆留在本層
+            leftover = items.pop() if len(items) % 2 else None
+            self._levels[level + 1].extend(items[self._random.getrandbits(1)::2])
+            self._levels[level] = [] if leftover is None else [leftover]
+            self._size = sum(len(items) for items in self._levels)
+            # 只壓縮到剛好低於上限，保留較多低層 (較精確) 的數值
+            if self._size < self._max_size:
+                break
+
+    def merge(self, other: 'KLLSketch') -> None:
+        """合併另一份摘要 (結果的誤差上限與直接加入所有資料相同)"""
+        if other.k != self.k:
+            raise ValueError(f"無法合併 k 不同的摘要: {self.k} / {other.k}")
+        while len(self._levels) < len(other._levels):
+            self._grow()
+        for level, items in enumerate(other._levels):
+            self._levels[level].extend(items)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._size = sum(len(items) for items in self._levels)
+        self._cdf = None
+        while self._size >= self._max_size:
+            self._compress()
+
+    def _weighted_cdf(self) -> Tuple[List[float], List[int]]:
+        if self._cdf is None:
+            pairs = sorted((value, 1 << level) for level, items in enumerate(self._levels) for value in items)
+            self._cdf = ([value for value, _ in pairs], list(accumulate(weight for _, weight in pairs)))
+        return self._cdf
+
+    def rank(self, value: float, inclusive: bool = True) -> int:
+        """估計小於 (inclusive 時為小於等於) value 的筆數"""
+        if not self.count:
+            return 0
+        values, cumulative = self._weighted_cdf()
+        position = bisect_right(values, value) if inclusive else bisect_left(values, value)
+        return cumulative[position - 1] if position else 0
+
+    def fraction_below(self, value: float, inclusive: bool = True) -> float:
+        """估計小於 (inclusive 時為小於等於) value 的比例"""
+        if not self.count:
+            return 0.0
+        return self.rank(value, inclusive) / self.count
+
+    def quantile(self, fraction: float) -> float:
+        """估計第 fraction 分位數 (0 ~ 1)"""
+        if not self.count:
+            raise ValueError("摘要沒有任何資料")
+        values, cumulative = self._weighted_cdf()
+        position = bisect_left(cumulative, fraction * cumulative[-1])
+        return values[min(position, len(values) - 1)]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def to_dict(self) -> dict:
+        return {
+            'k': self.k,
+            'count': self.count,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'levels': [list(items) for items in self._levels],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'KLLSketch':
+        sketch = cls(k=data['k'])
+        while len(sketch._levels) < len(data['levels']):
+            sketch._grow()
+        sketch._levels = [[float(value) for value in items] for items in data['levels']]
+        sketch.count = data['count']
+        if sketch.count:
+            sketch.min, sketch.max = data['min'], data['max']
+        sketch._size = sum(len(items) for items in sketch._levels)
+        return sketch
+
+class EmissionSketches:
+    """依路線與交通方式分開維護的每人碳排放摘要 (執行緒安全)"""
+
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = k
+        self._lock = threading.Lock()
+        self._sketches: Dict[Tuple[str, str], KLLSketch] = {}
+
+    def _sketch(self, dimension: str, key: str) -> KLLSketch:
+        sketch = self._sketches.get((dimension, key))
+        if sketch is None:
+            sketch = self._sketches[(dimension, key)] = KLLSketch(self.k)
+        return sketch
+
+    def add(self, trip_data) -> None:
+        """加入一筆計算結果"""
+        value = float(getattr(trip_data, SKETCH_METRIC))
+        with self._lock:
+            for dimension in SKETCH_DIMENSIONS:
+                self._sketch(dimension, getattr(trip_data, dimension)).update(value)
+
+    def add_values(self, dimension: str, keys: np.ndarray, values: np.ndarray) -> None:
+        """批次加入某個維度的數值 (keys 與 values 等長)"""
+        keys = np.asarray(keys)
+        values = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            for key in np.unique(keys).tolist():
+                self._sketch(dimension, key).update_many(values[keys == key].tolist())
+
+    def merge(self, other: 'EmissionSketches') -> None:
+        """合併另一組摘要 (例如其他工作程序建立的摘要)"""
+        with self._lock:
+            for (dimension, key), sketch in other._sketches.items():
+                self._sketch(dimension, key).merge(sketch)
+
+    def fraction_higher(self, dimension: str, key: str, value: float) -> Optional[float]:
+        """同一路線 (或交通方式) 中每人碳排放高於 value 的旅客比例；樣本不足時回傳 None"""
+        with self._lock:
+            sketch = self._sketches.get((dimension, key))
+            if sketch is None or sketch.count < MIN_COMPARISON_COUNT:
+                return None
+            return 1.0 - sketch.fraction_below(value, inclusive=True)
+
+    def counts(self) -> Dict[Tuple[str, str], int]:
+        with self._lock:
+            return {name: sketch.count for name, sketch in self._sketches.items()}
+
+    def rebuild_from_history(self, history: CalculationHistory, chunk_rows: int = 100_000) -> int:
+        """捨棄目前的摘要，改由歷史紀錄重新建立，回傳讀取的列數"""
+        rebuilt = EmissionSketches(self.k)
+        cursor = history.connection().execute(
+            f"SELECT {', '.join(SKETCH_DIMENSIONS)}, {SKETCH_METRIC} FROM calculations"
+        )
+        rows = 0
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_rows)
+                if not chunk:
+                    break
+                columns = list(zip(*chunk))
+                for position, dimension in enumerate(SKETCH_DIMENSIONS):
+                    rebuilt.add_values(dimension, np.array(columns[position], dtype=object), columns[-1])
+                rows += len(chunk)
+        finally:
+            cursor.close()
+
+        with self._lock:
+            self._sketches = rebuilt._sketches
+        return rows
+
+    def add_store(self, store: TripStore, chunk_rows: int = 1 << 20) -> int:
+        """由欄式儲存區分段加入，回傳加入的列數"""
+        code_columns = {'route_option': 'route_code', 'transport_mode': 'transport_code'}
+        rows = 0
+        for chunk in store.scan((*code_columns.values(), SKETCH_METRIC), chunk_rows):
+            for dimension in SKETCH_DIMENSIONS:
+                names = np.array(store.categories[dimension], dtype=object)
+                self.add_values(dimension, names[chunk[code_columns[dimension]]], chunk[SKETCH_METRIC])
+            rows += len(chunk[SKETCH_METRIC])
+        return rows
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'format': SKETCH_FORMAT,
+                'version': SKETCH_VERSION,
+                'metric': SKETCH_METRIC,
+                'k': self.k,
+                'sketches': {
+                    dimension: {key: sketch.to_dict() for (d, key), sketch in sorted(self._sketches.items()) if d == dimension}
+                    for dimension in SKETCH_DIMENSIONS
+                },
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'EmissionSketches':
+        if data.get('format') != SKETCH_FORMAT or data.get('version') != SKETCH_VERSION:
+            raise ValueError(f"不支援的摘要格式: {data.get('format')} v{data.get('version')}")
+        sketches = cls(k=data['k'])
+        for dimension, items in data['sketches'].items():
+            for key, sketch in items.items():
+                sketches._sketches[(dimension, key)] = KLLSketch.from_dict(sketch)
+        return sketches
+
+    def save(self, path: str) -> None:
+        """寫入 JSON 檔 (先寫暫存檔再原子替換)"""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'EmissionSketches':
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+_emission_sketches: Optional[EmissionSketches] = None
+_emission_sketches_lock = threading.Lock()
+
+def get_emission_sketches() -> EmissionSketches:
+    """取得全程序共用的摘要：啟用歷史紀錄時由歷史紀錄重建，否則載入 NANTOU_SKETCH_FILE (若有設定)"""
+    global _emission_sketches
+    with _emission_sketches_lock:
+        if _emission_sketches is None:
+            sketches = EmissionSketches()
+            history = get_calculation_history()
+            sketch_file = os.environ.get(SKETCH_FILE_ENV_VAR)
+            if history is not None:
+                # 先寫完佇列中的紀錄，避免重建後又以即時更新重複計入
+                history.flush()
+                sketches.rebuild_from_history(history)
+            elif sketch_file and os.path.exists(sketch_file):
+                sketches = EmissionSketches.load(sketch_file)
+            _emission_sketches = sketches
+        return _emission_sketches
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投旅程每人碳排放分位數摘要")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_command = commands.add_parser("build", help="由歷史紀錄或儲存區建立摘要")
+    source = build_command.add_mutually_exclusive_group(required=True)
+    source.add_argument("--history", help="SQLite 歷史紀錄資料庫")
+    source.add_argument("--store", help="欄式儲存區目錄")
+    build_command.add_argument("-k", type=int, default=DEFAULT_K, help="摘要大小參數")
+    build_command.add_argument("-o", "--output", required=True)
+
+    merge_command = commands.add_parser("merge", help="合併多個摘要檔")
+    merge_command.add_argument("inputs", nargs="+")
+    merge_command.add_argument("-o", "--output", required=True)
+
+    rank_command = commands.add_parser("rank", help="查詢某個每人碳排放值的排名")
+    rank_command.add_argument("sketch_file")
+    rank_command.add_argument("--value", type=float, required=True, help="每人碳排放 (kg CO2e)")
+    rank_command.add_argument("--route", help="路線代碼")
+    rank_command.add_argument("--transport", help="交通方式代碼")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'build':
+        sketches = EmissionSketches(args.k)
+        if args.history:
+            history = CalculationHistory(args.history)
+            rows = sketches.rebuild_from_history(history)
+            history.close()
+        else:
+            rows = sketches.add_store(TripStore(args.store))
+        sketches.save(args.output)
+        print(f"已由 {rows:,} 筆紀錄建立 {len(sketches.counts())} 份摘要：{args.output}", file=sys.stderr)
+        return 0
+
+    if args.command == 'merge':
+        merged = EmissionSketches.load(args.inputs[0])
+        for path in args.inputs[1:]:
+            merged.merge(EmissionSketches.load(path))
+        merged.save(args.output)
+        print(f"已合併 {len(args.inputs)} 個摘要檔：{args.output}", file=sys.stderr)
+        return 0
+
+    sketches = EmissionSketches.load(args.sketch_file)
+    for dimension, key in (('route_option', args.route), ('transport_mode', args.transport)):
+        if key is None:
+            continue
+        higher = sketches.fraction_higher(dimension, key, args.value)
+        count = sketches.counts().get((dimension, key), 0)
+        if higher is None:
+            print(f"{dimension}={key}：樣本不足 ({count} 筆)")
+        else:
+            print(f"{dimension}={key}：低於 {higher:.1%} 的旅客 ({count:,} 筆)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
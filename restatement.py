@@ -0,0 +1,231 @@
+"""
+係數重述模組
+係數檔更新 (例如修正某段期間的係數) 後，只重新計算欄式儲存區中實際受影響的旅程：
+依每列的計算日期，比較原本使用的係數檔與新係數檔在該日生效的係數，只有用到的係數不同的列才重算並改寫，
+其他列 (包含旅程資料與計算時間) 完全不動。每一列原本使用的係數檔記錄在儲存區的 factor_set 欄位。
+
+計算歷史紀錄 (NANTOU_HISTORY_DB) 記錄的是當時顯示給旅客的結果，不在重述範圍內。
+
+用法：
+    python restatement.py trips_store --dry-run
+    python restatement.py trips_store --factors data/emission_factors.json --since 2025-01-01
+    python restatement.py legacy_store --previous-factors old_factors.json
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import argparse
+import sys
+
+import numpy as np
+
+from compact_results import RESULT_FIELDS
+from emission_factors import EmissionFactorError, EmissionFactorSnapshot, load_snapshot
+from functions import (
+    CITY_DISTANCES,
+    FACTOR_CATEGORY_KEYS,
+    NantouCarbonCalculator,
+    get_emission_factors
+)
+from trip_store import (
+    DEFAULT_SCAN_ROWS,
+    FACTOR_SET_COLUMN,
+    TripStore
+)
+
+# 判斷係數是否改變時需要讀取的欄位
+INPUT_COLUMNS = ('route_code', 'city_code', 'transport_code', 'dining_code', 'coffee_code',
+                 'traveler_count', 'calculated_at', FACTOR_SET_COLUMN)
+
+@dataclass
+class RestatementSummary:
+    """重述結果摘要"""
+    factor_version: str
+    scanned: int = 0
+    changed: int = 0
+    skipped_without_date: int = 0
+    emissions_before: float = 0.0
+    emissions_after: float = 0.0
+    changed_by_factor_set: Dict[int, int] = field(default_factory=dict)
+
+# used_factors 各欄的類別與代碼欄位 (最後一欄固定為開車基準 car_petrol)
+USED_FACTOR_CATEGORIES = ('transportation', 'dining', 'coffee', 'transportation')
+USED_FACTOR_CODE_COLUMNS = ('transport_code', 'dining_code', 'coffee_code', None)
+
+def used_factors(snapshot: EmissionFactorSnapshot, epochs: np.ndarray,
+                 columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """各列計算時用到的係數 (交通、飲食、咖啡、開車基準)，形狀為 (列數, 4)"""
+    car_code = snapshot.code('transportation', 'car_petrol')
+    return np.stack([
+        snapshot.epoch_arrays['transportation'][epochs, columns['transport_code']],
+        snapshot.epoch_arrays['dining'][epochs, columns['dining_code']],
+        snapshot.epoch_arrays['coffee'][epochs, columns['coffee_code']],
+        snapshot.epoch_arrays['transportation'][epochs, car_code],
+    ], axis=1)
+
+def changed_rows(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """用到的係數有任何一個不同的列 (原本沒有生效係數的也視為改變)"""
+    same = (old == new) | (np.isnan(old) & np.isnan(new))
+    return ~same.all(axis=1)
+
+def restate_store(store: TripStore, factors: EmissionFactorSnapshot,
+                  previous_factors: Optional[EmissionFactorSnapshot] = None,
+                  since: Optional[date] = None, until: Optional[date] = None,
+                  dry_run: bool = False, chunk_rows: int = DEFAULT_SCAN_ROWS) -> RestatementSummary:
+    """以新係數檔重算儲存區中計算日期在 [since, until) 且用到的係數改變的列
+
+    先掃描整個儲存區找出要重算的列，並確認新係數檔涵蓋這些列用到的所有係數，
+    有缺漏時在改寫任何資料前拋出 EmissionFactorError (列出缺少係數的選項與期間)。
+    之後逐區塊改寫；中途中斷時再執行一次即可 (已重述的列使用新係數檔，不會再被選到)。
+    previous_factors 為未記錄係數版本 (較早建立的儲存區) 的列原本使用的係數檔，
+    有這類列而未提供時同樣拋出 EmissionFactorError。
+    """
+    summary = RestatementSummary(factor_version=factors.version)
+    changed, uncovered = _plan_restatement(store, factors, previous_factors, since, until, chunk_rows, summary)
+    if uncovered:
+        raise EmissionFactorError(
+            f"係數檔 {factors.version} 缺少受影響旅程用到的係數：\n" + '\n'.join(
+                f"  {name} ({_epoch_label(factors, epoch)})：{count:,} 筆" for (name, epoch), count in sorted(uncovered.items())
+            )
+        )
+
+    # 城市代碼從儲存區字典轉為距離查找表的索引 (-1 代表未列出的城市)
+    city_index = {name: code for code, name in enumerate(CITY_DISTANCES)}
+    city_lookup = np.array([city_index.get(name, -1) for name in store.categories['departure_city']], dtype=np.int64)
+    calculators: Dict[int, NantouCarbonCalculator] = {}
+
+    for start in range(0, len(store), chunk_rows):
+        stop = min(start + chunk_rows, len(store))
+        rows = changed[np.searchsorted(changed, start):np.searchsorted(changed, stop)] - start
+        if not len(rows):
+            continue
+        columns = store.columns(INPUT_COLUMNS, start, stop)
+        new_epochs = factors.epoch_indices(columns['calculated_at'][rows])
+        values = {name: np.empty(len(rows), dtype=np.float64) for name in RESULT_FIELDS}
+        # 同一區段的係數相同，每個區段使用一個計算器向量化重算
+        for epoch in np.unique(new_epochs).tolist():
+            if epoch not in calculators:
+                # 用到的係數已確認存在，區段中其他選項沒有係數不影響重算
+                calculators[epoch] = NantouCarbonCalculator(factors, effective_date=factors.epoch_days[epoch],
+                                                            require_complete_factors=False)
+            in_epoch = new_epochs == epoch
+            epoch_rows = rows[in_epoch]
+            results = calculators[epoch].calculate_batch_arrays(
+                columns['route_code'][epoch_rows].astype(np.int64),
+                city_lookup[columns['city_code'][epoch_rows]],
+                columns['transport_code'][epoch_rows].astype(np.int64),
+                columns['dining_code'][epoch_rows].astype(np.int64),
+                columns['coffee_code'][epoch_rows].astype(np.int64),
+                columns['traveler_count'][epoch_rows],
+            )
+            for name in RESULT_FIELDS:
+                values[name][in_epoch] = results[name]
+
+        summary.changed += len(rows)
+        summary.emissions_before += float(store.column('total_emissions', start, stop)[rows].sum())
+        summary.emissions_after += float(values['total_emissions'].sum())
+        if not dry_run:
+            store.restate(rows + start, values, factors)
+    return summary
+
+def _plan_restatement(store: TripStore, factors: EmissionFactorSnapshot,
+                      previous_factors: Optional[EmissionFactorSnapshot],
+                      since: Optional[date], until: Optional[date], chunk_rows: int,
+                      summary: RestatementSummary) -> Tuple[np.ndarray, Dict[Tuple[str, int], int]]:
+    """找出要重算的列 (依序排列的列號)，以及新係數檔缺少的係數 ((類別.代碼, 區段) → 列數)"""
+    snapshots: Dict[int, Optional[EmissionFactorSnapshot]] = {}
+    changed_chunks: List[np.ndarray] = []
+    uncovered: Dict[Tuple[str, int], int] = {}
+
+    total = len(store)
+    for start in range(0, total, chunk_rows):
+        stop = min(start + chunk_rows, total)
+        columns = store.columns(INPUT_COLUMNS, start, stop)
+        days = columns['calculated_at'].astype('datetime64[D]')
+        eligible = ~np.isnat(days)
+        summary.skipped_without_date += int((~eligible).sum())
+        if since is not None:
+            eligible &= days >= np.datetime64(since, 'D')
+        if until is not None:
+            eligible &= days < np.datetime64(until, 'D')
+        summary.scanned += stop - start
+
+        for factor_set in np.unique(columns[FACTOR_SET_COLUMN][eligible]).tolist():
+            if factor_set not in snapshots:
+                snapshots[factor_set] = store.factor_snapshot(factor_set)
+            previous = snapshots[factor_set] or previous_factors
+            if previous is None:
+                raise EmissionFactorError("儲存區有未記錄係數版本的列，請以 --previous-factors 指定原本使用的係數檔")
+            if previous.fingerprint == factors.fingerprint:
+                continue
+            rows = np.flatnonzero(eligible & (columns[FACTOR_SET_COLUMN] == factor_set))
+            selected = {name: columns[name][rows] for name in ('transport_code', 'dining_code', 'coffee_code')}
+            new_epochs = factors.epoch_indices(days[rows])
+            old = used_factors(previous, previous.epoch_indices(days[rows]), selected)
+            new = used_factors(factors, new_epochs, selected)
+            is_changed = changed_rows(old, new)
+            rows, new, new_epochs = rows[is_changed], new[is_changed], new_epochs[is_changed]
+            changed_chunks.append(rows + start)
+            summary.changed_by_factor_set[factor_set] = summary.changed_by_factor_set.get(factor_set, 0) + len(rows)
+
+            # 新係數檔在這些列的日期沒有生效的係數
+            for position, (category, code_column) in enumerate(zip(USED_FACTOR_CATEGORIES, USED_FACTOR_CODE_COLUMNS)):
+                missing = np.flatnonzero(np.isnan(new[:, position]))
+                if not len(missing):
+                    continue
+                keys = _code_keys(factors, category)
+                codes = selected[code_column][is_changed][missing].tolist() if code_column else [None] * len(missing)
+                for code, epoch in zip(codes, new_epochs[missing].tolist()):
+                    name = f"{category}.{keys[code] if code is not None else 'car_petrol'}"
+                    uncovered[(name, epoch)] = uncovered.get((name, epoch), 0) + 1
+
+    changed = np.sort(np.concatenate(changed_chunks)) if changed_chunks else np.empty(0, dtype=np.int64)
+    return changed, uncovered
+
+def _code_keys(snapshot: EmissionFactorSnapshot, category: str) -> List[str]:
+    keys = [''] * len(snapshot.codes[category])
+    for key, code in snapshot.codes[category].items():
+        keys[code] = key
+    return keys
+
+def _epoch_label(snapshot: EmissionFactorSnapshot, epoch: int) -> str:
+    """區段的日期範圍 [開始, 結束)"""
+    start = snapshot.epoch_days[epoch]
+    end = snapshot.epoch_days[epoch + 1] if epoch + 1 < len(snapshot.epoch_days) else None
+    return f"{'' if start == date.min else start} ~ {'' if end is None else end}"
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="以更新後的係數檔重算儲存區中受影響的旅程")
+    parser.add_argument("path", help="儲存區目錄")
+    parser.add_argument("--factors", default=None, help="新的係數檔 (預設為目前使用中的係數檔)")
+    parser.add_argument("--previous-factors", default=None, help="未記錄係數版本的列原本使用的係數檔")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="只重述此日期 (含) 之後計算的旅程")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="只重述此日期 (不含) 之前計算的旅程")
+    parser.add_argument("--dry-run", action="store_true", help="只計算受影響的列數，不改寫儲存區")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_SCAN_ROWS, help="每次掃描的列數")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+    try:
+        factors = load_snapshot(args.factors, FACTOR_CATEGORY_KEYS) if args.factors else get_emission_factors()
+        previous = load_snapshot(args.previous_factors, FACTOR_CATEGORY_KEYS) if args.previous_factors else None
+        summary = restate_store(TripStore(args.path), factors, previous, args.since, args.until,
+                                args.dry_run, args.chunk_rows)
+    except EmissionFactorError as e:
+        print(f"無法重述: {e}", file=sys.stderr)
+        return 1
+
+    action = '將重述' if args.dry_run else '已重述'
+    print(f"係數版本 {summary.factor_version}：掃描 {summary.scanned:,} 筆，{action} {summary.changed:,} 筆")
+    if summary.skipped_without_date:
+        print(f"  沒有計算時間而略過 {summary.skipped_without_date:,} 筆")
+    if summary.changed:
+        print(f"  受影響旅程的總碳排放 {summary.emissions_before:,.2f} → {summary.emissions_after:,.2f} kg CO2e")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
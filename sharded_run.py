@@ -0,0 +1,434 @@
+"""
+分片 map-reduce 批次計算模組
+每個工作程序 (可在不同機器上) 處理自己負責的分割檔，輸出部分結果與部分彙總；合併步驟以固定順序與精確加總組合所有分片，
+因此不論分片數為何，合併結果都完全相同
+
+用法：
+    python sharded_run.py map bookings/*.csv --shard-index 0 --shard-count 4 --calculated-at 2025-12-31T00:00:00 -o out/
+    python sharded_run.py merge out/shard-*-of-00004 -o merged/
+    python sharded_run.py simulate bookings.csv --partitions 8 --shard-counts 1 2 4 --workdir /tmp/sharded
+"""
+
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_cli import ResultWriter, detect_format, process_chunk, read_chunks, DEFAULT_CHUNK_SIZE
+from functions import NantouCarbonCalculator
+
+# 彙總維度 (最細的彙總單位為三者的組合)
+AGGREGATE_KEYS = ('route_option', 'departure_city', 'transport_mode')
+
+# 需要加總的碳排放欄位
+AGGREGATE_METRICS = (
+    'total_emissions', 'intercity_emissions', 'route_emissions',
+    'dining_emissions', 'coffee_emissions', 'walking_carbon_saved'
+)
+
+# 所有有限的 float64 都是 2**-1074 的整數倍，以此為單位的整數加總完全精確且與順序無關
+EXACT_SCALE = 1 << 1074
+
+RESULTS_FILE = 'results.csv'
+ERRORS_FILE = 'errors.jsonl'
+AGGREGATES_FILE = 'aggregates.json'
+MANIFEST_FILE = 'manifest.json'
+
+# 尾數拆成高低兩半加總，確保 int64 累加不會溢位
+_MANTISSA_SPLIT_BITS = 26
+
+def exact_group_sums(group_ids: np.ndarray, values: np.ndarray) -> Dict[int, int]:
+    """向量化計算各群組數值的精確總和 (以 2**-1074 為單位的整數)
+
+    每個浮點數拆成 53 位元整數尾數與指數，同一群組同一指數的尾數以 int64 加總，
+    最後只需對 (群組, 指數) 組合做少量的大整數運算。
+    """
+    mantissas, exponents = np.frexp(np.asarray(values, dtype=np.float64))
+    mantissas = np.ldexp(mantissas, 53).astype(np.int64)
+    exponents = exponents.astype(np.int64) - 53
+
+    exponent_min = int(exponents.min())
+    keys = np.asarray(group_ids, dtype=np.int64) * (int(exponents.max()) - exponent_min + 1) + (exponents - exponent_min)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+    high = np.add.reduceat(mantissas[order] >> _MANTISSA_SPLIT_BITS, starts).tolist()
+    low = np.add.reduceat(mantissas[order] & ((1 << _MANTISSA_SPLIT_BITS) - 1), starts).tolist()
+
+    sums: Dict[int, int] = {}
+    for position, high_sum, low_sum in zip(starts.tolist(), high, low):
+        group_id = int(group_ids[order[position]])
+        shift = int(exponents[order[position]]) + 1074
+        total = (high_sum << _MANTISSA_SPLIT_BITS) + low_sum
+        # 次正規數的尾數末端必為 0，右移仍然精確
+        units = total << shift if shift >= 0 else total >> -shift
+        sums[group_id] = sums.get(group_id, 0) + units
+    return sums
+
+def units_to_float(units: int) -> float:
+    """精確整數轉回浮點數 (整數除法為正確捨入)"""
+    return units / EXACT_SCALE
+
+class PartialAggregates:
+    """以 (路線, 出發城市, 交通方式) 為單位的精確部分彙總，可任意順序合併"""
+
+    def __init__(self):
+        self.cells: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+
+    def _cell(self, key: Tuple[str, str, str]) -> Dict[str, int]:
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = {'trips': 0, 'travelers': 0, **{metric: 0 for metric in AGGREGATE_METRICS}}
+        return cell
+
+    def add_results(self, results: pd.DataFrame) -> None:
+        """加入一個區塊的計算結果"""
+        if results.empty:
+            return
+        keys = list(AGGREGATE_KEYS)
+
+        grouped = results.groupby(keys, sort=False)
+        group_ids = grouped.ngroup().to_numpy()
+        counts = grouped.agg(trips=('traveler_count', 'size'), travelers=('traveler_count', 'sum'))
+        cells = [self._cell(key) for key in counts.index]
+
+        for cell, trips, travelers in zip(cells, counts['trips'].tolist(), counts['travelers'].tolist()):
+            cell['trips'] += trips
+            cell['travelers'] += travelers
+
+        for metric in AGGREGATE_METRICS:
+            for group_id, units in exact_group_sums(group_ids, results[metric].to_numpy()).items():
+                cells[group_id][metric] += units
+
+    def merge(self, other: 'PartialAggregates') -> None:
+        """合併另一份部分彙總"""
+        for key, other_cell in other.cells.items():
+            cell = self._cell(key)
+            for name, value in other_cell.items():
+                cell[name] += value
+
+    def to_json(self) -> dict:
+        """序列化 (精確整數以十六進位字串保存)"""
+        return {
+            'scale': 'exact units of 2**-1074',
+            'cells': [
+                {
+                    **dict(zip(AGGREGATE_KEYS, key)),
+                    'trips': cell['trips'],
+                    'travelers': cell['travelers'],
+                    **{metric: hex(cell[metric]) for metric in AGGREGATE_METRICS},
+                }
+                for key, cell in sorted(self.cells.items())
+            ]
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'PartialAggregates':
+        partial = cls()
+        for item in data['cells']:
+            cell = partial._cell(tuple(item[name] for name in AGGREGATE_KEYS))
+            cell['trips'] += item['trips']
+            cell['travelers'] += item['travelers']
+            for metric in AGGREGATE_METRICS:
+                cell[metric] += int(item[metric], 16)
+        return partial
+
+    def summarize(self) -> dict:
+        """依路線、出發城市、交通方式與總計輸出彙總結果"""
+        def totals(cells) -> dict:
+            trips = sum(cell['trips'] for cell in cells)
+            travelers = sum(cell['travelers'] for cell in cells)
+            summary = {'trips': trips, 'travelers': travelers}
+            for metric in AGGREGATE_METRICS:
+                summary[metric] = units_to_float(sum(cell[metric] for cell in cells))
+            summary['per_person_emissions'] = (
+                sum(cell['total_emissions'] for cell in cells) / (travelers * EXACT_SCALE) if travelers else 0.0
+            )
+            return summary
+
+        result = {'overall': totals(list(self.cells.values()))}
+        for position, name in enumerate(AGGREGATE_KEYS):
+            groups: Dict[str, list] = {}
+            for key, cell in self.cells.items():
+                groups.setdefault(key[position], []).append(cell)
+            result[f'by_{name}'] = {value: totals(cells) for value, cells in sorted(groups.items())}
+        return result
+
+def source_order(paths: List[str]) -> List[str]:
+    """分割檔的固定順序 (依檔名排序，檔名必須唯一)"""
+    names = sorted(os.path.basename(path) for path in paths)
+    if len(set(names)) != len(names):
+        raise SystemExit("分割檔名稱必須唯一")
+    return names
+
+def inputs_fingerprint(names: List[str]) -> str:
+    return hashlib.sha256(json.dumps(names, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def shard_directory_name(shard_index: int, shard_count: int) -> str:
+    return f"shard-{shard_index:05d}-of-{shard_count:05d}"
+
+def _write_json(path: str, data: dict) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def run_map(paths: List[str], shard_index: int, shard_count: int, output_dir: str, calculated_at: datetime,
+            input_format: str = 'auto', chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """處理分配給此分片的分割檔 (依排序後的索引取餘數分配)，寫出部分結果、錯誤與彙總"""
+    if not 0 <= shard_index < shard_count:
+        raise SystemExit("--shard-index 必須介於 0 與 --shard-count 之間")
+
+    names = source_order(paths)
+    by_name = {os.path.basename(path): path for path in paths}
+    assigned = [name for position, name in enumerate(names) if position % shard_count == shard_index]
+
+    shard_dir = os.path.join(output_dir, shard_directory_name(shard_index, shard_count))
+    os.makedirs(shard_dir, exist_ok=True)
+
+    calculator = NantouCarbonCalculator()
+    aggregates = PartialAggregates()
+    counts = {'rows': 0, 'calculated': 0, 'errors': 0}
+    started = time.perf_counter()
+
+    with open(os.path.join(shard_dir, RESULTS_FILE), 'w', encoding='utf-8', newline='') as results_stream, \
+            open(os.path.join(shard_dir, ERRORS_FILE), 'w', encoding='utf-8') as errors_stream:
+        writer = ResultWriter(results_stream, 'csv')
+
+        for name in assigned:
+            file_format = detect_format(name, input_format)
+            with open(by_name[name], encoding='utf-8-sig', newline='') as stream:
+                for row_numbers, frame, parse_errors in read_chunks(stream, file_format, chunk_size):
+                    results, errors = process_chunk(row_numbers, frame, calculator)
+                    if not results.empty:
+                        # 所有分片使用同一個計算時間，合併結果才會與分片數無關
+                        results['calculated_at'] = calculated_at
+                        results.insert(0, 'source_file', name)
+                        aggregates.add_results(results)
+                        writer.write(results)
+
+                    for error in sorted(parse_errors + errors, key=lambda error: error['row_number']):
+                        errors_stream.write(json.dumps({'source_file': name, **error}, ensure_ascii=False) + '\n')
+                        counts['errors'] += 1
+
+                    counts['rows'] += len(row_numbers) + len(parse_errors)
+                    counts['calculated'] += len(results)
+
+    _write_json(os.path.join(shard_dir, AGGREGATES_FILE), aggregates.to_json())
+
+    manifest = {
+        'shard_index': shard_index,
+        'shard_count': shard_count,
+        'inputs': names,
+        'inputs_fingerprint': inputs_fingerprint(names),
+        'assigned': assigned,
+        'calculated_at': calculated_at.isoformat(),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        **counts,
+    }
+    # 清單最後寫入，代表此分片已完整輸出
+    _write_json(os.path.join(shard_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+def load_shard_manifests(shard_dirs: List[str]) -> List[Tuple[str, dict]]:
+    """讀取並檢查分片清單：分片數一致、輸入相同、每個分片恰好一份"""
+    manifests = []
+    for shard_dir in shard_dirs:
+        path = os.path.join(shard_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            raise SystemExit(f"分片尚未完成或不存在: {shard_dir}")
+        with open(path, encoding='utf-8') as f:
+            manifests.append((shard_dir, json.load(f)))
+
+    if not manifests:
+        raise SystemExit("沒有可合併的分片")
+
+    shard_count = manifests[0][1]['shard_count']
+    fingerprint = manifests[0][1]['inputs_fingerprint']
+    for shard_dir, manifest in manifests:
+        if manifest['shard_count'] != shard_count or manifest['inputs_fingerprint'] != fingerprint:
+            raise SystemExit(f"分片設定不一致: {shard_dir}")
+
+    indexes = sorted(manifest['shard_index'] for _, manifest in manifests)
+    if indexes != list(range(shard_count)):
+        raise SystemExit(f"分片不完整或重複：預期 {shard_count} 個，取得 {indexes}")
+
+    return sorted(manifests, key=lambda item: item[1]['shard_index'])
+
+def _keyed_rows(path: str, source_positions: Dict[str, int]) -> Iterator[Tuple[Tuple[int, int], List[str]]]:
+    """讀取分片結果列並附上排序鍵 (分割檔順序, 列號)"""
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            yield (source_positions[row[0]], int(row[1])), row
+
+def _keyed_errors(path: str, source_positions: Dict[str, int]) -> Iterator[Tuple[Tuple[int, int], str]]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            error = json.loads(line)
+            yield (source_positions[error['source_file']], error['row_number']), line
+
+def run_merge(shard_dirs: List[str], output_dir: str) -> dict:
+    """依 (分割檔順序, 列號) 合併所有分片結果，並精確合併彙總"""
+    manifests = load_shard_manifests(shard_dirs)
+    names = manifests[0][1]['inputs']
+    source_positions = {name: position for position, name in enumerate(names)}
+    os.makedirs(output_dir, exist_ok=True)
+
+    header = None
+    for shard_dir, _ in manifests:
+        with open(os.path.join(shard_dir, RESULTS_FILE), encoding='utf-8', newline='') as f:
+            header = header or next(csv.reader(f), None)
+
+    with open(os.path.join(output_dir, RESULTS_FILE), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        merged = heapq.merge(*(
+            _keyed_rows(os.path.join(shard_dir, RESULTS_FILE), source_positions) for shard_dir, _ in manifests
+        ), key=lambda item: item[0])
+        writer.writerows(row for _, row in merged)
+
+    with open(os.path.join(output_dir, ERRORS_FILE), 'w', encoding='utf-8') as f:
+        merged = heapq.merge(*(
+            _keyed_errors(os.path.join(shard_dir, ERRORS_FILE), source_positions) for shard_dir, _ in manifests
+        ), key=lambda item: item[0])
+        f.writelines(line for _, line in merged)
+
+    aggregates = PartialAggregates()
+    for shard_dir, _ in manifests:
+        with open(os.path.join(shard_dir, AGGREGATES_FILE), encoding='utf-8') as f:
+            aggregates.merge(PartialAggregates.from_json(json.load(f)))
+    _write_json(os.path.join(output_dir, AGGREGATES_FILE), aggregates.summarize())
+
+    summary = {
+        'inputs': names,
+        'inputs_fingerprint': manifests[0][1]['inputs_fingerprint'],
+        'calculated_at': sorted({manifest['calculated_at'] for _, manifest in manifests}),
+        'rows': sum(manifest['rows'] for _, manifest in manifests),
+        'calculated': sum(manifest['calculated'] for _, manifest in manifests),
+        'errors': sum(manifest['errors'] for _, manifest in manifests),
+    }
+    _write_json(os.path.join(output_dir, MANIFEST_FILE), summary)
+    return summary
+
+def split_into_partitions(input_path: str, partitions: int, output_dir: str) -> List[str]:
+    """將單一 CSV 依連續區段切成多個分割檔 (模擬封存的分割檔)"""
+    with open(input_path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    os.makedirs(output_dir, exist_ok=True)
+    per_partition = -(-len(rows) // partitions)
+    paths = []
+    for index in range(partitions):
+        path = os.path.join(output_dir, f"part-{index:05d}.csv")
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows[index * per_partition:(index + 1) * per_partition])
+        paths.append(path)
+    return paths
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def run_simulation(input_path: str, partitions: int, shard_counts: List[int], workdir: str,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """在本機以多個程序模擬多個節點，比對不同分片數的合併結果是否完全相同"""
+    paths = split_into_partitions(input_path, partitions, os.path.join(workdir, 'partitions'))
+    calculated_at = datetime.now().replace(microsecond=0).isoformat()
+
+    digests = {}
+    for shard_count in shard_counts:
+        run_dir = os.path.join(workdir, f"run-{shard_count}")
+        started = time.perf_counter()
+        workers = [
+            subprocess.Popen([
+                sys.executable, __file__, 'map', *paths,
+                '--shard-index', str(shard_index), '--shard-count', str(shard_count),
+                '--calculated-at', calculated_at, '--chunk-size', str(chunk_size), '-o', run_dir
+            ])
+            for shard_index in range(shard_count)
+        ]
+        if any(worker.wait() != 0 for worker in workers):
+            print(f"{shard_count} 個分片：有工作程序失敗", file=sys.stderr)
+            return 1
+
+        merged_dir = os.path.join(run_dir, 'merged')
+        run_merge([os.path.join(run_dir, shard_directory_name(i, shard_count)) for i in range(shard_count)], merged_dir)
+        elapsed = time.perf_counter() - started
+
+        digests[shard_count] = tuple(
+            _file_digest(os.path.join(merged_dir, name)) for name in (RESULTS_FILE, ERRORS_FILE, AGGREGATES_FILE)
+        )
+        print(f"{shard_count:>3} 個分片：{elapsed:.2f} 秒，結果 {digests[shard_count][0][:12]}，彙總 {digests[shard_count][2][:12]}")
+
+    identical = len(set(digests.values())) == 1
+    print("所有分片數的合併結果完全相同" if identical else "不同分片數的合併結果不一致")
+    return 0 if identical else 1
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投永續之旅碳足跡分片批次計算")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    map_parser = commands.add_parser("map", help="處理一個分片")
+    map_parser.add_argument("inputs", nargs="+", help="所有分割檔 (每個分片都需傳入完整清單)")
+    map_parser.add_argument("--shard-index", type=int, required=True)
+    map_parser.add_argument("--shard-count", type=int, required=True)
+    map_parser.add_argument("--calculated-at", default=None, help="所有分片共用的計算時間 (ISO 格式)")
+    map_parser.add_argument("--input-format", choices=("auto", "csv", "jsonl"), default="auto")
+    map_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    map_parser.add_argument("-o", "--output-dir", required=True)
+
+    merge_parser = commands.add_parser("merge", help="合併所有分片")
+    merge_parser.add_argument("shard_dirs", nargs="+")
+    merge_parser.add_argument("-o", "--output-dir", required=True)
+
+    simulate_parser = commands.add_parser("simulate", help="在本機以多個程序模擬多節點執行並比對結果")
+    simulate_parser.add_argument("input")
+    simulate_parser.add_argument("--partitions", type=int, default=8)
+    simulate_parser.add_argument("--shard-counts", type=int, nargs="+", default=[1, 2, 4])
+    simulate_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    simulate_parser.add_argument("--workdir", required=True)
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點"""
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'map':
+        calculated_at = datetime.fromisoformat(args.calculated_at) if args.calculated_at else datetime.now()
+        manifest = run_map(args.inputs, args.shard_index, args.shard_count, args.output_dir,
+                           calculated_at, args.input_format, args.chunk_size)
+        print(f"分片 {args.shard_index}/{args.shard_count}：{manifest['rows']} 列，成功 {manifest['calculated']} 列，"
+              f"錯誤 {manifest['errors']} 列", file=sys.stderr)
+        return 0
+
+    if args.command == 'merge':
+        summary = run_merge(args.shard_dirs, args.output_dir)
+        print(f"合併完成：{summary['rows']} 列，成功 {summary['calculated']} 列，錯誤 {summary['errors']} 列", file=sys.stderr)
+        return 0
+
+    return run_simulation(args.input, args.partitions, args.shard_counts, args.workdir, args.chunk_size)
+
+if __name__ == "__main__":
+    sys.exit(main())
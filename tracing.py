@@ -0,0 +1,224 @@
+"""
+輕量效能追蹤模組
+以 contextvars 記錄每次重新執行 (或每次 API / 批次請求) 內的巢狀區段耗時；未啟用追蹤時，
+被裝飾的函數只多一次 ContextVar 查詢，幾乎沒有額外成本。完成的追蹤可附加寫入 JSON Lines 檔案供離線分析。
+
+啟用方式：
+    環境變數 NANTOU_TRACE=1 (全部啟用)，或在網址加上 ?trace=1 (只對該 session 啟用)
+    環境變數 NANTOU_TRACE_FILE 指定輸出檔 (預設為 trace_spans.jsonl)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+import json
+import os
+import threading
+import time
+import uuid
+
+TRACE_ENV_VAR = 'NANTOU_TRACE'
+TRACE_FILE_ENV_VAR = 'NANTOU_TRACE_FILE'
+DEFAULT_TRACE_FILE = 'trace_spans.jsonl'
+
+_TRUTHY = ('1', 'true', 'yes', 'on')
+
+@dataclass
+class Span:
+    """單一區段 (時間以相對於追蹤開始的毫秒表示)"""
+    name: str
+    depth: int
+    parent: Optional[int]
+    start_ms: float
+    duration_ms: float = 0.0
+    error: Optional[str] = None
+
+@dataclass
+class Trace:
+    """一次重新執行內的所有區段"""
+    name: str
+    attrs: Dict[str, object] = field(default_factory=dict)
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec='milliseconds'))
+    spans: List[Span] = field(default_factory=list)
+    duration_ms: float = 0.0
+
+    def __post_init__(self):
+        self._origin = time.perf_counter()
+        self._stack: List[int] = []
+
+    def open_span(self, name: str) -> int:
+        """開始一個區段，回傳其索引"""
+        parent = self._stack[-1] if self._stack else None
+        self.spans.append(Span(
+            name=name,
+            depth=len(self._stack),
+            parent=parent,
+            start_ms=(time.perf_counter() - self._origin) * 1000
+        ))
+        index = len(self.spans) - 1
+        self._stack.append(index)
+        return index
+
+    def close_span(self, index: int, error: Optional[BaseException] = None) -> None:
+        """結束區段 (需依開啟的相反順序關閉)"""
+        span = self.spans[index]
+        span.duration_ms = (time.perf_counter() - self._origin) * 1000 - span.start_ms
+        if error is not None:
+            span.error = type(error).__name__
+        if self._stack and self._stack[-1] == index:
+            self._stack.pop()
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._origin) * 1000
+
+    def to_record(self) -> dict:
+        """轉為可寫入 JSON 的記錄"""
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration_ms, 3),
+            'attrs': self.attrs,
+            'spans': [asdict(span) for span in self.spans],
+        }
+
+# 目前執行緒 / 工作的追蹤 (None 代表未啟用)
+_active_trace: ContextVar[Optional[Trace]] = ContextVar('nantou_active_trace', default=None)
+
+_sink_lock = threading.Lock()
+
+def is_truthy(value: Optional[str]) -> bool:
+    """開關參數是否為啟用 (1/true/yes/on)"""
+    return (value or '').strip().lower() in _TRUTHY
+
+def env_enabled() -> bool:
+    """是否以環境變數全域啟用追蹤"""
+    return is_truthy(os.environ.get(TRACE_ENV_VAR))
+
+def trace_file_path() -> str:
+    return os.environ.get(TRACE_FILE_ENV_VAR) or DEFAULT_TRACE_FILE
+
+def current_trace() -> Optional[Trace]:
+    """目前進行中的追蹤"""
+    return _active_trace.get()
+
+def write_trace(trace: Trace, path: Optional[str] = None) -> None:
+    """將完成的追蹤附加寫入 JSON Lines 檔案"""
+    line = json.dumps(trace.to_record(), ensure_ascii=False, default=str) + '\n'
+    with _sink_lock:
+        with open(path or trace_file_path(), 'a', encoding='utf-8') as f:
+            f.write(line)
+
+@contextmanager
+def span(name: str) -> Iterator[Optional[int]]:
+    """在目前追蹤中記錄一個區段；未啟用時不做任何事"""
+    trace = _active_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    index = trace.open_span(name)
+    try:
+        yield index
+    except BaseException as e:
+        trace.close_span(index, e)
+        raise
+    else:
+        trace.close_span(index)
+
+@contextmanager
+def root_trace(name: str, enabled: bool, sink: bool = True,
+               on_finish: Optional[Callable[[Trace], None]] = None, **attrs) -> Iterator[Optional[Trace]]:
+    """開始一次追蹤；已有進行中的追蹤時改為記錄一個區段，未啟用時不做任何事"""
+    trace = _active_trace.get()
+    if trace is not None:
+        with span(name):
+            yield trace
+        return
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace(name=name, attrs=dict(attrs))
+    token = _active_trace.set(trace)
+    index = trace.open_span(name)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.close_span(index, e)
+        raise
+    else:
+        trace.close_span(index)
+    finally:
+        _active_trace.reset(token)
+        trace.finish()
+        if sink:
+            try:
+                write_trace(trace)
+            except OSError:
+                pass  # 追蹤檔無法寫入時不影響主要功能
+        if on_finish is not None:
+            on_finish(trace)
+
+def traced(name: Optional[str] = None, root_enabled: Optional[Callable[[], bool]] = None,
+           on_finish: Optional[Callable[[Trace], None]] = None):
+    """函數裝飾器：在目前追蹤中記錄呼叫耗時
+
+    提供 root_enabled 時，若呼叫當下沒有進行中的追蹤且 root_enabled() 為真，
+    會以此函數開始一次新的追蹤 (例如 Streamlit fragment 單獨重新執行時)。
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+        get_trace = _active_trace.get
+
+        if root_enabled is None:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                trace = get_trace()
+                if trace is None:
+                    return func(*args, **kwargs)
+                return _call_in_span(trace, span_name, func, args, kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                trace = get_trace()
+                if trace is not None:
+                    return _call_in_span(trace, span_name, func, args, kwargs)
+                if root_enabled():
+                    with root_trace(span_name, enabled=True, on_finish=on_finish):
+                        return func(*args, **kwargs)
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+def _call_in_span(trace: Trace, span_name: str, func, args, kwargs):
+    index = trace.open_span(span_name)
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        trace.close_span(index, e)
+        raise
+    trace.close_span(index)
+    return result
+
+def summarize_spans(trace: Trace) -> List[dict]:
+    """依區段名稱彙總呼叫次數與總耗時 (只計算最外層的同名區段，避免遞迴重複計算)"""
+    totals: Dict[str, dict] = {}
+    for index, item in enumerate(trace.spans):
+        ancestor = item.parent
+        nested = False
+        while ancestor is not None:
+            if trace.spans[ancestor].name == item.name:
+                nested = True
+                break
+            ancestor = trace.spans[ancestor].parent
+        summary = totals.setdefault(item.name, {'name': item.name, 'calls': 0, 'total_ms': 0.0})
+        summary['calls'] += 1
+        if not nested:
+            summary['total_ms'] += item.duration_ms
+    return sorted(totals.values(), key=lambda s: s['total_ms'], reverse=True)
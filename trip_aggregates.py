@@ -0,0 +1,170 @@
+"""
+即時彙總模組
+每筆計算結果到達時以 O(1) 更新依路線、出發城市、交通方式與日期的累計次數與碳排放，
+營運儀表板直接讀取這些累計值，不需重新掃描歷史紀錄。
+碳排放以 2**-1074 為單位的整數精確累加 (與 sharded_run 相同)，因此從歷史紀錄重建的結果與即時累計完全一致，與加入順序無關。
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+import threading
+
+import numpy as np
+import pandas as pd
+
+from calculation_history import CalculationHistory, get_calculation_history
+from sharded_run import AGGREGATE_METRICS, EXACT_SCALE, exact_group_sums, units_to_float
+
+# 彙總維度 (day 為計算紀錄的日期 YYYY-MM-DD)
+AGGREGATE_DIMENSIONS = ('route_option', 'departure_city', 'transport_mode', 'day')
+
+# 從歷史紀錄重建時每次讀取的列數
+REBUILD_CHUNK_ROWS = 100_000
+
+# 累計格的欄位：旅程數、旅客數，以及 AGGREGATE_METRICS 各自的精確整數總和
+_TRIPS, _TRAVELERS = 0, 1
+_CELL_SIZE = 2 + len(AGGREGATE_METRICS)
+
+def exact_units(value: float) -> int:
+    """浮點數轉為以 2**-1074 為單位的精確整數"""
+    numerator, denominator = float(value).as_integer_ratio()
+    # denominator 必為 2 的次方
+    return numerator << (1075 - denominator.bit_length())
+
+def _new_cell() -> List[int]:
+    return [0] * _CELL_SIZE
+
+def _summarize_cell(cell: List[int]) -> Dict[str, float]:
+    trips, travelers = cell[_TRIPS], cell[_TRAVELERS]
+    total_units = cell[2 + AGGREGATE_METRICS.index('total_emissions')]
+    summary = {'trips': trips, 'travelers': travelers}
+    for position, metric in enumerate(AGGREGATE_METRICS, start=2):
+        summary[metric] = units_to_float(cell[position])
+    # 整數除法為正確捨入，平均值同樣與加入順序無關
+    summary['per_traveler_emissions'] = total_units / (travelers * EXACT_SCALE) if travelers else 0.0
+    summary['per_trip_emissions'] = total_units / (trips * EXACT_SCALE) if trips else 0.0
+    return summary
+
+class LiveAggregates:
+    """依維度累計的即時彙總 (執行緒安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._overall = _new_cell()
+        self._cells: Dict[str, Dict[str, List[int]]] = {dimension: {} for dimension in AGGREGATE_DIMENSIONS}
+        self.rebuilt_rows = 0
+        self.live_updates = 0
+
+    def add(self, trip_data, recorded_at: Optional[datetime] = None) -> None:
+        """加入一筆計算結果 (每個維度只更新一格)"""
+        increments = (1, trip_data.traveler_count, *(exact_units(getattr(trip_data, m)) for m in AGGREGATE_METRICS))
+        keys = (
+            trip_data.route_option,
+            trip_data.departure_city,
+            trip_data.transport_mode,
+            (recorded_at or datetime.now()).date().isoformat(),
+        )
+        with self._lock:
+            cells = [self._overall]
+            for dimension, key in zip(AGGREGATE_DIMENSIONS, keys):
+                cell = self._cells[dimension].get(key)
+                if cell is None:
+                    cell = self._cells[dimension][key] = _new_cell()
+                cells.append(cell)
+            for cell in cells:
+                for position, increment in enumerate(increments):
+                    cell[position] += increment
+            self.live_updates += 1
+
+    def add_frame(self, frame: pd.DataFrame) -> None:
+        """向量化加入多筆結果 (需有 AGGREGATE_DIMENSIONS、traveler_count 與 AGGREGATE_METRICS 欄位)"""
+        if frame.empty:
+            return
+        travelers = frame['traveler_count'].to_numpy(dtype=np.int64)
+        metric_values = {metric: frame[metric].to_numpy(dtype=np.float64) for metric in AGGREGATE_METRICS}
+
+        partial = {}
+        for dimension in (None,) + AGGREGATE_DIMENSIONS:
+            if dimension is None:
+                codes, keys = np.zeros(len(frame), dtype=np.int64), [None]
+            else:
+                codes, keys = pd.factorize(frame[dimension])
+            trip_counts = np.bincount(codes, minlength=len(keys)).tolist()
+            traveler_sums = np.bincount(codes, weights=travelers, minlength=len(keys)).astype(np.int64).tolist()
+            cells = [_new_cell() for _ in keys]
+            for cell, trips, traveler_sum in zip(cells, trip_counts, traveler_sums):
+                cell[_TRIPS] = trips
+                cell[_TRAVELERS] = traveler_sum
+            for position, metric in enumerate(AGGREGATE_METRICS, start=2):
+                for group_id, units in exact_group_sums(codes, metric_values[metric]).items():
+                    cells[group_id][position] = units
+            partial[dimension] = dict(zip(keys, cells))
+
+        with self._lock:
+            for dimension, cells in partial.items():
+                for key, increments in cells.items():
+                    if dimension is None:
+                        cell = self._overall
+                    else:
+                        cell = self._cells[dimension].setdefault(key, _new_cell())
+                    for position, increment in enumerate(increments):
+                        cell[position] += increment
+
+    def rebuild_from_history(self, history: CalculationHistory, chunk_rows: int = REBUILD_CHUNK_ROWS) -> int:
+        """捨棄目前的累計值，改由歷史紀錄重新計算，回傳讀取的列數"""
+        rebuilt = LiveAggregates()
+        columns = ['day', 'route_option', 'departure_city', 'transport_mode', 'traveler_count', *AGGREGATE_METRICS]
+        cursor = history.connection().execute(
+            f"SELECT substr(recorded_at, 1, 10), {', '.join(columns[1:])} FROM calculations"
+        )
+        rows = 0
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_rows)
+                if not chunk:
+                    break
+                rebuilt.add_frame(pd.DataFrame(chunk, columns=columns))
+                rows += len(chunk)
+        finally:
+            cursor.close()
+
+        with self._lock:
+            self._overall = rebuilt._overall
+            self._cells = rebuilt._cells
+            self.rebuilt_rows = rows
+            self.live_updates = 0
+        return rows
+
+    def snapshot(self) -> Dict[str, object]:
+        """目前的彙總結果 (總計與各維度，各維度依鍵排序)"""
+        with self._lock:
+            overall = list(self._overall)
+            cells = {dimension: {key: list(cell) for key, cell in items.items()}
+                     for dimension, items in self._cells.items()}
+            rebuilt_rows, live_updates = self.rebuilt_rows, self.live_updates
+
+        snapshot = {
+            'overall': _summarize_cell(overall),
+            'rebuilt_rows': rebuilt_rows,
+            'live_updates': live_updates,
+        }
+        for dimension, items in cells.items():
+            snapshot[f'by_{dimension}'] = {key: _summarize_cell(cell) for key, cell in sorted(items.items())}
+        return snapshot
+
+_live_aggregates: Optional[LiveAggregates] = None
+_live_aggregates_lock = threading.Lock()
+
+def get_live_aggregates() -> LiveAggregates:
+    """取得全程序共用的即時彙總；啟用歷史紀錄時第一次取得會先由歷史紀錄重建"""
+    global _live_aggregates
+    with _live_aggregates_lock:
+        if _live_aggregates is None:
+            aggregates = LiveAggregates()
+            history = get_calculation_history()
+            if history is not None:
+                # 先寫完佇列中的紀錄，避免重建後又以即時更新重複計入
+                history.flush()
+                aggregates.rebuild_from_history(history)
+            _live_aggregates = aggregates
+        return _live_aggregates
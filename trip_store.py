@@ -0,0 +1,405 @@
+"""
+旅程計算結果的欄式儲存
+每個欄位一個固定型別的二進位檔 (<欄位>.bin)，另有 manifest.json 記錄列數、型別與類別字典。
+讀取時以記憶體對映開啟，掃描或切片欄位都不需要把整個儲存區載入記憶體；
+附加時只在各欄位檔尾端寫入新資料，最後以原子替換 manifest 的方式提交，既有資料不會被改寫。
+每一列另記錄計算時使用的係數檔 (factor_set 欄位，manifest 保存各版本係數檔內容)，
+唯一會改寫既有資料的是係數重述 (restate)：先寫入重做日誌，中斷後下次寫入時會重新套用。
+
+用法：
+    python batch_cli.py bookings.csv -o results.csv --store trips_store
+    python trip_store.py trips_store
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from emission_factors import EmissionFactorSnapshot, compile_snapshot
+from functions import FACTOR_CATEGORY_KEYS
+from compact_results import (
+    CITY_CATEGORIES,
+    COFFEE_CATEGORIES,
+    DINING_CATEGORIES,
+    RESULT_FIELDS,
+    ROUTE_CATEGORIES,
+    TRANSPORT_CATEGORIES,
+    TripResultColumns
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，改由呼叫端保證只有一個寫入者
+    fcntl = None
+
+STORE_FORMAT = 'nantou-trip-store'
+STORE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = '.lock'
+RESTATEMENT_JOURNAL = 'restatement.journal.npz'
+
+# 欄位與型別 (固定為小端序，儲存區可在不同機器間複製)
+COLUMN_DTYPES = {
+    'route_code': np.dtype('<i1'),
+    'city_code': np.dtype('<i2'),
+    'transport_code': np.dtype('<i1'),
+    'dining_code': np.dtype('<i1'),
+    'coffee_code': np.dtype('<i1'),
+    'traveler_count': np.dtype('<i4'),
+    **{name: np.dtype('<f8') for name in RESULT_FIELDS},
+    'calculated_at': np.dtype('<M8[us]'),
+}
+
+# 每列計算時使用的係數檔 (manifest 'factor_sets' 的索引)；較早建立的儲存區沒有此欄位
+FACTOR_SET_COLUMN = 'factor_set'
+FACTOR_SET_DTYPE = np.dtype('<i2')
+# 未記錄使用的係數檔
+UNKNOWN_FACTOR_SET = -1
+
+# 掃描時每次對映的列數
+DEFAULT_SCAN_ROWS = 1 << 20
+
+class TripStoreError(ValueError):
+    """儲存區格式不符或已損壞"""
+
+def new_manifest() -> dict:
+    return {
+        'format': STORE_FORMAT,
+        'version': STORE_VERSION,
+        'rows': 0,
+        'columns': {
+            name: {'file': f'{name}.bin', 'dtype': dtype.str}
+            for name, dtype in {**COLUMN_DTYPES, FACTOR_SET_COLUMN: FACTOR_SET_DTYPE}.items()
+        },
+        'factor_sets': [],
+        'categories': {
+            'route_option': list(ROUTE_CATEGORIES),
+            'departure_city': list(CITY_CATEGORIES),
+            'transport_mode': list(TRANSPORT_CATEGORIES),
+            'dining_choice': list(DINING_CATEGORIES),
+            'coffee_choice': list(COFFEE_CATEGORIES),
+        },
+    }
+
+def _fsync_directory(path: str) -> None:
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class TripStore:
+    """附加式、記憶體對映的欄式旅程結果儲存區 (一個寫入者，多個讀取者)"""
+
+    def __init__(self, path: str, create: bool = False):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            if not create:
+                raise FileNotFoundError(f"找不到儲存區: {path}")
+            os.makedirs(path, exist_ok=True)
+            with self._writer_lock():
+                if not os.path.exists(manifest_path):
+                    self._write_manifest(new_manifest())
+        self.reload()
+
+    def reload(self) -> None:
+        """重新讀取 manifest (看到其他程序已提交的附加資料)"""
+        with open(os.path.join(self.path, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != STORE_FORMAT or manifest.get('version') != STORE_VERSION:
+            raise TripStoreError(f"不支援的儲存區格式: {manifest.get('format')} v{manifest.get('version')}")
+        for name, dtype in COLUMN_DTYPES.items():
+            if np.dtype(manifest['columns'][name]['dtype']) != dtype:
+                raise TripStoreError(f"欄位 {name} 的型別不符: {manifest['columns'][name]['dtype']}")
+        if FACTOR_SET_COLUMN in manifest['columns'] and \
+                np.dtype(manifest['columns'][FACTOR_SET_COLUMN]['dtype']) != FACTOR_SET_DTYPE:
+            raise TripStoreError(f"欄位 {FACTOR_SET_COLUMN} 的型別不符")
+        self.manifest = manifest
+
+    def __len__(self) -> int:
+        return self.manifest['rows']
+
+    @property
+    def categories(self) -> Dict[str, List[str]]:
+        return self.manifest['categories']
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, self.manifest['columns'][name]['file'])
+
+    def column(self, name: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """以唯讀記憶體對映取得欄位的 [start, stop) 區段 (不複製資料)"""
+        dtype = _column_dtype(name)
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if stop <= start:
+            return np.empty(0, dtype=dtype)
+        if name not in self.manifest['columns']:
+            # 較早建立的儲存區沒有係數版本欄位
+            return np.full(stop - start, UNKNOWN_FACTOR_SET, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode='r',
+                         offset=start * dtype.itemsize, shape=(stop - start,))
+
+    def columns(self, names: Optional[Sequence[str]] = None, start: int = 0,
+                stop: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """取得多個欄位的同一區段"""
+        return {name: self.column(name, start, stop) for name in (names or COLUMN_DTYPES)}
+
+    def scan(self, names: Optional[Sequence[str]] = None,
+             chunk_rows: int = DEFAULT_SCAN_ROWS) -> Iterator[Dict[str, np.ndarray]]:
+        """依序掃描整個儲存區，每次只對映 chunk_rows 列"""
+        total = len(self)
+        for start in range(0, total, chunk_rows):
+            yield self.columns(names, start, min(start + chunk_rows, total))
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> TripResultColumns:
+        """取得區段的 TripResultColumns (欄位仍為記憶體對映，不複製資料)"""
+        arrays = self.columns(None, start, stop)
+        return TripResultColumns(
+            route_code=arrays['route_code'],
+            city_code=arrays['city_code'],
+            transport_code=arrays['transport_code'],
+            dining_code=arrays['dining_code'],
+            coffee_code=arrays['coffee_code'],
+            traveler_count=arrays['traveler_count'],
+            values={name: arrays[name] for name in RESULT_FIELDS},
+            calculated_at=arrays['calculated_at'],
+            city_categories=list(self.categories['departure_city']),
+        )
+
+    def to_frame(self, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+        """將區段轉為 DataFrame (會複製資料，適合較小的區段)"""
+        return self.read(start, stop).to_frame()
+
+    def factor_snapshot(self, factor_set: int) -> Optional[EmissionFactorSnapshot]:
+        """取得某個係數版本索引對應的係數檔 (UNKNOWN_FACTOR_SET 回傳 None)"""
+        if factor_set == UNKNOWN_FACTOR_SET:
+            return None
+        entry = self.manifest['factor_sets'][factor_set]
+        return compile_snapshot(json.loads(entry['canonical']), entry['path'], FACTOR_CATEGORY_KEYS)
+
+    def factor_set_counts(self, chunk_rows: int = DEFAULT_SCAN_ROWS) -> Dict[int, int]:
+        """各係數版本索引的列數"""
+        counts: Dict[int, int] = {}
+        for chunk in self.scan((FACTOR_SET_COLUMN,), chunk_rows):
+            values, occurrences = np.unique(chunk[FACTOR_SET_COLUMN], return_counts=True)
+            for value, count in zip(values.tolist(), occurrences.tolist()):
+                counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def append(self, batch: TripResultColumns, factors: Optional[EmissionFactorSnapshot] = None) -> int:
+        """附加一批結果並提交，回傳附加後的總列數 (factors 為計算時使用的係數檔)"""
+        with self._writer_lock():
+            # 以最新的 manifest 為準 (可能有其他寫入者剛提交)，並完成中斷的重述
+            self._recover_restatement()
+            self.reload()
+            rows = len(self)
+            manifest = json.loads(json.dumps(self.manifest))
+            self._ensure_factor_set_column(manifest, rows)
+            city_categories = manifest['categories']['departure_city']
+            arrays = {
+                'route_code': batch.route_code,
+                'city_code': _remap_codes(batch.city_code, batch.city_categories, city_categories),
+                'transport_code': batch.transport_code,
+                'dining_code': batch.dining_code,
+                'coffee_code': batch.coffee_code,
+                'traveler_count': batch.traveler_count,
+                **{name: batch.values[name] for name in RESULT_FIELDS},
+                'calculated_at': batch.calculated_at,
+                FACTOR_SET_COLUMN: np.full(len(batch), _factor_set_index(manifest, factors), dtype=FACTOR_SET_DTYPE),
+            }
+
+            for name, values in arrays.items():
+                dtype = _column_dtype(name)
+                with open(self._column_path(name), 'ab') as f:
+                    # 先前未提交的附加 (例如寫到一半中斷) 留下的尾端資料直接截掉
+                    f.truncate(rows * dtype.itemsize)
+                    f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            manifest['rows'] = rows + len(batch)
+            self._write_manifest(manifest)
+            self.manifest = manifest
+            return manifest['rows']
+
+    def append_frame(self, frame: pd.DataFrame, factors: Optional[EmissionFactorSnapshot] = None) -> int:
+        """附加 calculate_batch 的結果 DataFrame"""
+        if frame.empty:
+            return len(self)
+        return self.append(TripResultColumns.from_frame(frame), factors)
+
+    def restate(self, rows: np.ndarray, values: Dict[str, np.ndarray], factors: EmissionFactorSnapshot) -> int:
+        """以新係數重算的結果改寫指定列的數值欄位與係數版本，其他列不變；回傳改寫的列數
+
+        先將要寫入的內容與新的 manifest 寫成重做日誌再套用，套用中斷時下次寫入會重新套用日誌。
+        改寫期間的讀取者可能看到部分列已更新，需要一致結果的讀取請在重述完成後再進行。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._writer_lock():
+            self._recover_restatement()
+            self.reload()
+            if len(rows) and (rows.min() < 0 or rows.max() >= len(self)):
+                raise IndexError(f"重述的列超出儲存區範圍 (共 {len(self)} 列)")
+            manifest = json.loads(json.dumps(self.manifest))
+            self._ensure_factor_set_column(manifest, len(self))
+            factor_set = _factor_set_index(manifest, factors)
+            manifest.setdefault('restatements', []).append({
+                'factor_set': factor_set,
+                'version': factors.version,
+                'rows': int(len(rows)),
+                'restated_at': datetime.now().isoformat(timespec='seconds'),
+            })
+
+            journal = {
+                'rows': rows,
+                **{name: np.asarray(values[name], dtype=COLUMN_DTYPES[name]) for name in RESULT_FIELDS},
+                FACTOR_SET_COLUMN: np.full(len(rows), factor_set, dtype=FACTOR_SET_DTYPE),
+                'manifest': np.array(json.dumps(manifest, ensure_ascii=False)),
+            }
+            journal_path = os.path.join(self.path, RESTATEMENT_JOURNAL)
+            temporary_path = journal_path + '.tmp'
+            with open(temporary_path, 'wb') as f:
+                np.savez(f, **journal)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, journal_path)
+            _fsync_directory(self.path)
+
+            self._recover_restatement()
+            return len(rows)
+
+    def _recover_restatement(self) -> None:
+        """套用尚未完成的重做日誌 (需持有寫入鎖；重複套用結果相同)"""
+        journal_path = os.path.join(self.path, RESTATEMENT_JOURNAL)
+        if not os.path.exists(journal_path):
+            return
+        with np.load(journal_path) as journal:
+            manifest = json.loads(str(journal['manifest']))
+            rows = journal['rows']
+            for name in (*RESULT_FIELDS, FACTOR_SET_COLUMN):
+                column = np.memmap(os.path.join(self.path, manifest['columns'][name]['file']),
+                                   dtype=_column_dtype(name), mode='r+', shape=(manifest['rows'],))
+                column[rows] = journal[name]
+                column.flush()
+                del column
+        self._write_manifest(manifest)
+        self.manifest = manifest
+        os.remove(journal_path)
+        _fsync_directory(self.path)
+
+    def _ensure_factor_set_column(self, manifest: dict, rows: int) -> None:
+        """較早建立的儲存區補上係數版本欄位 (既有的列記為未知)"""
+        if FACTOR_SET_COLUMN in manifest['columns']:
+            return
+        manifest['columns'][FACTOR_SET_COLUMN] = {'file': f'{FACTOR_SET_COLUMN}.bin', 'dtype': FACTOR_SET_DTYPE.str}
+        manifest.setdefault('factor_sets', [])
+        with open(os.path.join(self.path, manifest['columns'][FACTOR_SET_COLUMN]['file']), 'wb') as f:
+            f.write(np.full(rows, UNKNOWN_FACTOR_SET, dtype=FACTOR_SET_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_manifest(self, manifest: dict) -> None:
+        # 先寫暫存檔再原子替換，讀取者只會看到完整的舊版或新版 manifest
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        temporary_path = manifest_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, manifest_path)
+        _fsync_directory(self.path)
+
+    @contextmanager
+    def _writer_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def nbytes(self) -> int:
+        """已提交資料佔用的位元組數"""
+        return sum(len(self) * _column_dtype(name).itemsize for name in self.manifest['columns'])
+
+def _column_dtype(name: str) -> np.dtype:
+    return FACTOR_SET_DTYPE if name == FACTOR_SET_COLUMN else COLUMN_DTYPES[name]
+
+def _factor_set_index(manifest: dict, factors: Optional[EmissionFactorSnapshot]) -> int:
+    """係數檔在 manifest 中的索引 (新的係數檔會加入 manifest)"""
+    if factors is None:
+        return UNKNOWN_FACTOR_SET
+    factor_sets = manifest['factor_sets']
+    for index, entry in enumerate(factor_sets):
+        if entry['fingerprint'] == factors.fingerprint:
+            return index
+    factor_sets.append({
+        'fingerprint': factors.fingerprint,
+        'version': factors.version,
+        'path': factors.path,
+        'canonical': factors.canonical,
+    })
+    return len(factor_sets) - 1
+
+def _remap_codes(codes: np.ndarray, source: List[str], target: List[str]) -> np.ndarray:
+    """將代碼從來源字典轉換到目標字典 (目標字典缺少的項目依序附加)"""
+    if source == target[:len(source)]:
+        return codes
+    index = {name: code for code, name in enumerate(target)}
+    mapping = np.empty(len(source), dtype=COLUMN_DTYPES['city_code'])
+    for code, name in enumerate(source):
+        if name not in index:
+            index[name] = len(target)
+            target.append(name)
+        mapping[code] = index[name]
+    return mapping[codes]
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列參數"""
+    parser = argparse.ArgumentParser(description="南投旅程計算結果儲存區摘要")
+    parser.add_argument("path", help="儲存區目錄")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_SCAN_ROWS, help="每次掃描的列數")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列進入點：以分段掃描計算各交通工具的旅程數與總碳排放"""
+    args = build_parser().parse_args(argv)
+    store = TripStore(args.path)
+    transport_modes = store.categories['transport_mode']
+    trips = np.zeros(len(transport_modes), dtype=np.int64)
+    emissions = np.zeros(len(transport_modes), dtype=np.float64)
+
+    for chunk in store.scan(('transport_code', 'total_emissions'), args.chunk_rows):
+        trips += np.bincount(chunk['transport_code'], minlength=len(transport_modes))
+        emissions += np.bincount(chunk['transport_code'], weights=chunk['total_emissions'],
+                                 minlength=len(transport_modes))
+
+    print(f"{args.path}：{len(store):,} 筆旅程，{store.nbytes / 2**20:,.1f} MB")
+    for mode, count, total in zip(transport_modes, trips, emissions):
+        if count:
+            print(f"  {mode:<18}{count:>12,} 筆{total:>18,.1f} kg CO2e")
+    for factor_set, count in sorted(store.factor_set_counts(args.chunk_rows).items()):
+        if factor_set == UNKNOWN_FACTOR_SET:
+            label = '未記錄'
+        else:
+            entry = store.manifest['factor_sets'][factor_set]
+            label = f"{entry['version']} ({entry['fingerprint'][:12]})"
+        print(f"  係數版本 {label}：{count:,} 筆")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,15 +5,18 @@
 
 import streamlit as st
 import pandas as pd
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
+from functools import wraps
 import base64
+import os
+import time
+import uuid
+from html import escape
 from pathlib import Path
 from functions import (
-    NantouCarbonCalculator, 
-    EcoRecommendationEngine,
-    NantouTripCalculation,
+    get_recommendation_engine,
     NantouTripValidator,
     get_route_info,
     load_preset_routes,
@@ -23,6 +26,39 @@ from functions import (
     load_coffee_options,
     format_nantou_trip_result
 )
+from calculation_cache import get_calculation_cache
+from calculation_history import get_calculation_history
+from charts import (
+    build_aggregate_bar_figure,
+    build_daily_totals_figure,
+    build_emission_breakdown_figure,
+    build_transport_comparison_figure
+)
+from trip_aggregates import get_live_aggregates
+from quantile_sketch import get_emission_sketches
+from assets import build_image_derivatives, publish_static_asset, responsive_image_html
+import metrics
+import profiling
+import tracing
+from tracing import traced
+
+# 首頁橫幅與計算頁使用的圖片
+HERO_IMAGE_PATH = "images/nantou_bridge.png"
+
+# 頁面導航 (每次重新執行只渲染目前選擇的頁面)
+VIEWS = {
+    'calculator': "🧮 碳足跡計算",
+    'routes': "🗺️ 旅遊路線",
+    'results': "📊 計算結果",
+    'dashboard': "📈 營運儀表板",
+    'about': "ℹ️ 關於我們",
+}
+
+# 效能追蹤面板保留的最近追蹤筆數
+TRACE_HISTORY_SIZE = 20
+
+# 目前是否在整頁重新執行中 (fragment 單獨重新執行時為 False)
+_full_rerun = ContextVar('nantou_full_rerun', default=False)
 
 # 設定頁面配置
 st.set_page_config(
@@ -32,7 +68,7 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# 新增：將圖片轉換為 base64 的函數
+# 將圖片轉換為 base64 的函數 (僅在靜態檔案服務無法使用時備用)
 def get_base64_image(image_path):
     """將圖片轉換為 base64 編碼"""
     try:
@@ -43,15 +79,33 @@ def get_base64_image(image_path):
         return None
 
 # 載入自定義 CSS
+@traced()
 def load_css():
     """載入南投自然風格的 CSS 樣式"""
-    
-    # 嘗試載入背景圖片
-    bg_image_base64 = get_base64_image("images/nantou_bridge.png")
-    
-    # 如果成功載入圖片，使用 base64 編碼
-    if bg_image_base64:
-        hero_bg_style = f'background-image: linear-gradient(rgba(0,0,0,0.4), rgba(0,0,0,0.4)), url("data:image/png;base64,{bg_image_base64}");'
+    st.markdown(build_css(), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False)
+@traced()
+def build_css():
+    """產生南投自然風格的 CSS 樣式 (每個程序只建立一次)"""
+    
+    overlay = 'linear-gradient(rgba(0,0,0,0.4), rgba(0,0,0,0.4)), '
+    hero_bg_mobile_style = ''
+    
+    # 背景圖片以內容雜湊網址由靜態檔案服務提供，瀏覽器可直接快取；行動裝置改用較小的縮圖
+    if st.get_option("server.enableStaticServing"):
+        responsive = build_image_derivatives(HERO_IMAGE_PATH)
+        bg_image_url = None if responsive else publish_static_asset(HERO_IMAGE_PATH)
+    else:
+        responsive = None
+        bg_image_base64 = get_base64_image(HERO_IMAGE_PATH)
+        bg_image_url = f"data:image/png;base64,{bg_image_base64}" if bg_image_base64 else None
+
+    if responsive:
+        hero_bg_style = responsive.background_image_css(1600, overlay)
+        hero_bg_mobile_style = responsive.background_image_css(768, overlay)
+    elif bg_image_url:
+        hero_bg_style = f'background-image: {overlay}url("{bg_image_url}");'
     else:
         # 如果載入失敗，使用漸層背景
         hero_bg_style = 'background: linear-gradient(135deg, #2c5530 0%, #1a3a1f 100%);'
@@ -73,7 +127,7 @@ def load_css():
         padding: 20px;
     }}
     
-    /* 背景圖片設定 - 使用 base64 編碼 */
+    /* 背景圖片設定 - 使用靜態檔案網址 */
     .hero-background {{
         {hero_bg_style}
         background-size: cover;
@@ -107,29 +161,44 @@ def load_css():
         line-height: 1.6;
     }}
     
-    /* Tab 樣式 */
-    .stTabs [data-baseweb="tab-list"] {{
+    /* 頁面導航樣式 */
+    .st-key-active_view [role="radiogroup"] {{
         gap: 8px;
         background-color: #f8f9fa;
         border-radius: 10px;
         padding: 5px;
     }}
     
-    .stTabs [data-baseweb="tab"] {{
-        height: 50px;
-        padding: 0px 24px;
+    .st-key-active_view [role="radiogroup"] label {{
+        padding: 10px 24px;
         background-color: transparent;
         border-radius: 8px;
         color: #495057;
         font-weight: 500;
     }}
     
-    .stTabs [aria-selected="true"] {{
-        background-color: white !important;
-        color: #28a745 !important;
+    .st-key-active_view [role="radiogroup"] label:has(input:checked) {{
+        background-color: white;
+        color: #28a745;
         box-shadow: 0 2px 4px rgba(0,0,0,0.1);
     }}
     
+    .route-columns {{
+        display: flex;
+        gap: 24px;
+        flex-wrap: wrap;
+    }}
+    
+    .route-columns > div:first-child {{
+        flex: 2;
+        min-width: 260px;
+    }}
+    
+    .route-columns > div:last-child {{
+        flex: 1;
+        min-width: 200px;
+    }}
+    
     /* 卡片樣式 */
     .info-card {{
         background: white;
@@ -244,9 +313,17 @@ def load_css():
         
         .hero-background {{
             min-height: 300px;
+            {hero_bg_mobile_style}
         }}
     }}
     
+    /* 響應式圖片 */
+    .responsive-image img {{
+        width: 100%;
+        height: auto;
+        border-radius: 15px;
+    }}
+    
     /* Streamlit 控制欄確保可見 */
     .stApp > header {{
         background-color: transparent;
@@ -258,36 +335,178 @@ def load_css():
     footer {{visibility: hidden;}}
     </style>
     """
-    st.markdown(css, unsafe_allow_html=True)
+    return css
 
 def main():
     """主應用程式函數"""
     
-    # 載入樣式
-    load_css()
-    
-    # 初始化 session state
-    if 'calculation_result' not in st.session_state:
-        st.session_state.calculation_result = None
+    start_metrics_endpoint()
     
-    # 首頁橫幅
-    render_hero_banner()
+    # ?profile=1 只剖析一次重新執行
+    profile_requested = tracing.is_truthy(st.query_params.get('profile'))
     
-    # 建立 Tab 導航
-    tab1, tab2, tab3, tab4 = st.tabs(["🧮 碳足跡計算", "🗺️ 旅遊路線", "📊 計算結果", "ℹ️ 關於我們"])
-    
-    with tab1:
-        render_carbon_calculator_tab()
-    
-    with tab2:
-        render_routes_tab()
-    
-    with tab3:
-        render_results_tab()
-    
-    with tab4:
-        render_about_tab()
+    with observe_rerun('full'), \
+            profiling.capture_profile('rerun', enabled=profile_requested) as capture, \
+            tracing.root_trace('rerun', enabled=tracing_requested(), on_finish=remember_trace) as trace:
+        # 載入樣式
+        load_css()
+        
+        # 初始化 session state
+        if 'calculation_result' not in st.session_state:
+            st.session_state.calculation_result = None
+        
+        # 首頁橫幅
+        render_hero_banner()
+        
+        # 建立頁面導航，只渲染目前選擇的頁面
+        active_view = st.radio(
+            "頁面導航",
+            options=list(VIEWS),
+            format_func=VIEWS.get,
+            horizontal=True,
+            key="active_view",
+            label_visibility="collapsed"
+        )
+        if trace is not None:
+            trace.attrs['view'] = active_view
+        
+        view_renderers = {
+            'calculator': render_carbon_calculator_tab,
+            'routes': render_routes_tab,
+            'results': render_results_tab,
+            'dashboard': render_dashboard_tab,
+            'about': render_about_tab,
+        }
+        view_renderers[active_view]()
+    
+    # 追蹤結束後才顯示，面板本身不計入耗時
+    if trace is not None:
+        render_trace_panel(trace)
+    if capture is not None:
+        del st.query_params['profile']
+        render_profile_panel(capture.result)
+    elif profile_requested:
+        st.info("另一個剖析正在進行中，本次重新執行未剖析；稍後重新整理頁面即可再試。")
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_endpoint():
+    """每個程序啟動一次本機 metrics 端點 (NANTOU_METRICS_PORT=0 停用)"""
+    metrics.register_cache_metrics(get_calculation_cache())
+    port = metrics.metrics_port()
+    if not port:
+        return None
+    try:
+        return metrics.start_metrics_server(port)
+    except OSError:
+        # 連接埠已被佔用 (例如同一台機器上的另一個程序) 時只停用端點，不影響頁面
+        return None
+
+def track_session():
+    """記錄 session 活躍狀態，新的 session 同時計入開始次數"""
+    if 'metrics_session_id' not in st.session_state:
+        st.session_state.metrics_session_id = uuid.uuid4().hex
+        metrics.SESSIONS_STARTED_TOTAL.inc()
+    metrics.ACTIVE_SESSIONS.touch(st.session_state.metrics_session_id)
+
+@contextmanager
+def observe_rerun(scope, view=None):
+    """記錄重新執行延遲 (未指定頁面時以目前選擇的頁面為標籤)"""
+    track_session()
+    token = _full_rerun.set(True) if scope == 'full' else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if token is not None:
+            _full_rerun.reset(token)
+        metrics.RERUN_SECONDS.observe(
+            time.perf_counter() - started,
+            view=view or st.session_state.get('active_view', 'calculator'),
+            scope=scope
+        )
+
+def observe_fragment_rerun(view):
+    """fragment 單獨重新執行時記錄延遲 (整頁重新執行已由 main 記錄)"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _full_rerun.get():
+                return func(*args, **kwargs)
+            with observe_rerun('fragment', view):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
+def tracing_requested():
+    """是否啟用效能追蹤 (環境變數 NANTOU_TRACE=1 或網址參數 ?trace=1)"""
+    return tracing.env_enabled() or tracing.is_truthy(st.query_params.get('trace'))
+
+def remember_trace(trace):
+    """保存最近幾次追蹤的摘要，供除錯面板比較 (fragment 單獨重新執行也會記錄)"""
+    history = st.session_state.setdefault('trace_history', [])
+    history.append({
+        '時間': trace.started_at[11:],
+        '名稱': trace.name,
+        '頁面': trace.attrs.get('view', ''),
+        '耗時 (ms)': round(trace.duration_ms, 2),
+        '區段數': len(trace.spans),
+    })
+    del history[:-TRACE_HISTORY_SIZE]
+
+def render_trace_panel(trace):
+    """渲染效能追蹤除錯面板"""
+    with st.expander("🔍 效能追蹤", expanded=True):
+        st.caption(
+            f"追蹤 {trace.trace_id}：總耗時 {trace.duration_ms:.1f} ms，"
+            f"共 {len(trace.spans)} 個區段，已附加寫入 {tracing.trace_file_path()}"
+        )
+        
+        total = trace.duration_ms or 1.0
+        st.dataframe(pd.DataFrame([
+            {
+                '區段': '\u3000' * span.depth + span.name,
+                '開始 (ms)': round(span.start_ms, 2),
+                '耗時 (ms)': round(span.duration_ms, 2),
+                '占比': f"{span.duration_ms / total:.0%}",
+                '錯誤': span.error or '',
+            }
+            for span in trace.spans
+        ]), hide_index=True)
+        
+        st.write("**依函數彙總**")
+        st.dataframe(pd.DataFrame(tracing.summarize_spans(trace)), hide_index=True)
+        
+        history = st.session_state.get('trace_history', [])
+        if len(history) > 1:
+            st.write("**最近的重新執行**")
+            st.dataframe(pd.DataFrame(history[::-1]), hide_index=True)
+
+def render_profile_panel(result):
+    """渲染 CPU 效能剖析結果 (輸出檔可下載後以 pstats 或火焰圖工具分析)"""
+    with st.expander("🔥 CPU 效能剖析", expanded=True):
+        st.caption(
+            f"本次重新執行耗時 {result.duration_ms:.1f} ms，取樣 {result.samples} 次；"
+            f"已寫入 {result.prof_path} 與 {result.collapsed_path}"
+        )
+        
+        st.dataframe(pd.DataFrame([
+            {
+                '函數': row['function'],
+                '位置': row['location'],
+                '呼叫次數': row['calls'],
+                '自身 (ms)': round(row['own_ms'], 2),
+                '累計 (ms)': round(row['cumulative_ms'], 2),
+            }
+            for row in result.top_functions
+        ]), hide_index=True)
+        
+        col1, col2 = st.columns(2)
+        for column, path, label in ((col1, result.prof_path, "下載 cProfile (.prof)"),
+                                    (col2, result.collapsed_path, "下載火焰圖堆疊 (.collapsed)")):
+            with open(path, 'rb') as f:
+                column.download_button(label, f.read(), file_name=os.path.basename(path))
+
+@traced()
 def render_hero_banner():
     """渲染首頁橫幅"""
     st.markdown("""
@@ -297,8 +516,11 @@ def render_hero_banner():
     </div>
     """, unsafe_allow_html=True)
 
+@st.fragment
+@observe_fragment_rerun('calculator')
+@traced(root_enabled=tracing_requested, on_finish=remember_trace)
 def render_carbon_calculator_tab():
-    """渲染碳足跡計算 Tab"""
+    """渲染碳足跡計算 Tab (表單送出時只重新執行此區塊)"""
     
     st.markdown('<div class="info-card">', unsafe_allow_html=True)
     st.subheader("🧮 碳足跡計算器")
@@ -409,13 +631,8 @@ def render_carbon_calculator_tab():
         # 計算按鈕
         submitted = st.form_submit_button("🧮 開始計算您的永續影響力", type="primary")
     
-    # 在表單外顯示圖片
-    try:
-        st.image("images/nantou_bridge.png", use_column_width=True)
-    except FileNotFoundError:
-        pass  # 如果圖片不存在就略過
-    except Exception as e:
-        pass  # 靜默處理其他錯誤
+    # 在表單外顯示圖片 (瀏覽器依畫面寬度挑選最小的縮圖版本)
+    render_responsive_image(HERO_IMAGE_PATH, "糯米橋")
     
     if submitted:
         # 驗證輸入
@@ -436,40 +653,68 @@ def render_carbon_calculator_tab():
         else:
             # 執行計算
             calculate_carbon_footprint(trip_data)
-            st.success("✅ 計算完成！請切換到「計算結果」頁籤查看您的永續影響力報告。")
+            st.success("✅ 計算完成！請切換到「計算結果」頁面查看您的永續影響力報告。")
+
+@traced()
+def render_responsive_image(image_path, alt):
+    """渲染響應式圖片；未啟用靜態檔案服務時退回 st.image"""
+    if st.get_option("server.enableStaticServing"):
+        image_html = responsive_image_html(image_path, alt)
+        if image_html:
+            st.markdown(image_html, unsafe_allow_html=True)
+        return
+    
+    try:
+        st.image(image_path, use_container_width=True)
+    except FileNotFoundError:
+        pass  # 如果圖片不存在就略過
+    except Exception as e:
+        pass  # 靜默處理其他錯誤
 
+@traced()
 def render_routes_tab():
     """渲染旅遊路線 Tab"""
     
     st.subheader("🗺️ 南投國姓旅遊路線")
     st.write("探索三條精心設計的國姓旅遊路線，每條路線都有獨特的魅力和體驗。")
     
-    routes = load_preset_routes()
-    
-    for route_id, route_data in routes.items():
-        st.markdown('<div class="route-card">', unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            st.subheader(f"📍 {route_data['name']}")
-            st.write(f"**路線描述：** {route_data['description']}")
-            st.write(f"**預估時間：** {route_data['estimated_duration']}")
-            st.write(f"**行程距離：** {route_data['internal_distance']} 公里")
-            st.write(f"**步行距離：** {route_data['walking_distance']} 公里")
-            
-            st.write("**主要景點：**")
-            for attraction in route_data['attractions']:
-                st.write(f"• {attraction}")
-        
-        with col2:
-            st.write("**路線特色：**")
-            for highlight in route_data['highlights']:
-                st.write(f"✨ {highlight}")
+    # 路線內容固定不變，以預先產生的 HTML 區塊一次輸出
+    st.markdown(build_routes_html(), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False)
+@traced()
+def build_routes_html():
+    """產生旅遊路線卡片的 HTML (每個程序只建立一次)"""
+    cards = []
+    
+    for route_id, route_data in load_preset_routes().items():
+        attractions = "".join(f"<li>{escape(a)}</li>" for a in route_data['attractions'])
+        highlights = "".join(f"<li>✨ {escape(h)}</li>" for h in route_data['highlights'])
         
-        st.markdown('</div>', unsafe_allow_html=True)
-        st.markdown("---")
+        cards.append(f"""
+<div class="route-card">
+<h3>📍 {escape(route_data['name'])}</h3>
+<div class="route-columns">
+<div>
+<p><strong>路線描述：</strong> {escape(route_data['description'])}</p>
+<p><strong>預估時間：</strong> {escape(route_data['estimated_duration'])}</p>
+<p><strong>行程距離：</strong> {route_data['internal_distance']} 公里</p>
+<p><strong>步行距離：</strong> {route_data['walking_distance']} 公里</p>
+<p><strong>主要景點：</strong></p>
+<ul>{attractions}</ul>
+</div>
+<div>
+<p><strong>路線特色：</strong></p>
+<ul style="list-style: none; padding-left: 0;">{highlights}</ul>
+</div>
+</div>
+</div>""")
+    
+    return "\n<hr>\n".join(cards)
 
+@st.fragment
+@observe_fragment_rerun('results')
+@traced(root_enabled=tracing_requested, on_finish=remember_trace)
 def render_results_tab():
     """渲染計算結果 Tab"""
     
@@ -482,6 +727,81 @@ def render_results_tab():
         st.info("🔍 尚未進行碳足跡計算。請先到「碳足跡計算」頁籤輸入您的旅程資訊。")
         st.markdown('</div>', unsafe_allow_html=True)
 
+# 營運儀表板的彙總維度與顯示名稱
+DASHBOARD_DIMENSIONS = (
+    ('route_option', "路線"),
+    ('transport_mode', "交通方式"),
+    ('departure_city', "出發城市"),
+)
+
+def dashboard_display_name(dimension, key):
+    """彙總鍵的顯示名稱 (路線與交通方式顯示中文名稱)"""
+    if dimension == 'route_option':
+        return load_preset_routes().get(key, {}).get('name', key)
+    if dimension == 'transport_mode':
+        return load_transport_options().get(key, {}).get('name', key)
+    return key
+
+def aggregate_table(dimension, groups):
+    """將某個維度的彙總結果轉為顯示用表格 (依總碳排放排序)"""
+    rows = [
+        {
+            "名稱": dashboard_display_name(dimension, key),
+            "計算次數": summary['trips'],
+            "旅客人數": summary['travelers'],
+            "總碳排放 (kg)": round(summary['total_emissions'], 1),
+            "每人平均 (kg)": round(summary['per_traveler_emissions'], 2),
+            "步行減碳 (kg)": round(summary['walking_carbon_saved'], 2),
+        }
+        for key, summary in groups.items()
+    ]
+    return pd.DataFrame(rows).sort_values("總碳排放 (kg)", ascending=False)
+
+@st.fragment
+@observe_fragment_rerun('dashboard')
+@traced(root_enabled=tracing_requested, on_finish=remember_trace)
+def render_dashboard_tab():
+    """渲染營運儀表板 Tab (直接讀取即時彙總，不查詢歷史紀錄)"""
+    
+    st.subheader("📈 營運儀表板")
+    st.button("🔄 重新整理", key="dashboard_refresh")
+    
+    snapshot = get_live_aggregates().snapshot()
+    overall = snapshot['overall']
+    if not overall['trips']:
+        st.info("🔍 目前尚無計算紀錄。")
+        return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("計算次數", f"{overall['trips']:,}")
+    col2.metric("旅客人數", f"{overall['travelers']:,}")
+    col3.metric("總碳排放", f"{overall['total_emissions']:,.1f} kg")
+    col4.metric("每人平均", f"{overall['per_traveler_emissions']:.2f} kg")
+    
+    daily = snapshot['by_day']
+    fig = build_daily_totals_figure(
+        list(daily),
+        [summary['total_emissions'] for summary in daily.values()],
+        [summary['trips'] for summary in daily.values()]
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    for dimension, label in DASHBOARD_DIMENSIONS:
+        table = aggregate_table(dimension, snapshot[f'by_{dimension}'])
+        st.markdown(f"#### 依{label}")
+        col_chart, col_table = st.columns([1, 1])
+        with col_chart:
+            fig = build_aggregate_bar_figure(f"各{label}每人平均碳排放", table["名稱"], table["每人平均 (kg)"],
+                                             axis_title='每人平均 CO2 (kg)')
+            st.plotly_chart(fig, use_container_width=True)
+        with col_table:
+            st.dataframe(table, hide_index=True)
+    
+    st.caption(
+        f"由歷史紀錄重建 {snapshot['rebuilt_rows']:,} 筆，之後即時累計 {snapshot['live_updates']:,} 筆"
+    )
+
+@traced()
 def render_about_tab():
     """渲染關於我們 Tab"""
     
@@ -520,29 +840,32 @@ def render_about_tab():
     # 數據來源說明
     render_data_source_footer()
 
+@traced()
 def calculate_carbon_footprint(trip_data):
     """計算碳足跡"""
     try:
-        # 創建計算物件
-        trip_calculation = NantouTripCalculation(
-            route_option=trip_data['route_option'],
-            traveler_count=trip_data['traveler_count'],
-            transport_mode=trip_data['transport_mode'],
-            departure_city=trip_data['departure_city'],
-            dining_choice=trip_data.get('dining_choice', 'local_meat'),
-            coffee_choice=trip_data.get('coffee_choice', 'black_coffee')
-        )
+        # 執行計算 (相同輸入跨 session 共用同一份唯讀結果)
+        with metrics.CALCULATION_SECONDS.time():
+            result = get_calculation_cache().get_or_compute(trip_data)
+        metrics.CALCULATIONS_TOTAL.inc(route=result.route_option, transport=result.transport_mode)
         
-        # 執行計算
-        calculator = NantouCarbonCalculator()
-        result = calculator.calculate_total_emissions(trip_calculation)
+        # 營運儀表板的即時彙總 (須在排入歷史紀錄之前，首次由歷史紀錄重建時才不會重複計入)
+        recorded_at = datetime.now()
+        get_live_aggregates().add(result, recorded_at)
+        get_emission_sketches().add(result)
         
-        # 儲存結果到 session state
+        # 選用的持久化歷史紀錄 (只排入背景寫入佇列，不等待磁碟)
+        history = get_calculation_history()
+        if history is not None:
+            history.record(result, session_id=st.session_state.get('metrics_session_id'), recorded_at=recorded_at)
+        
+        # 儲存結果到 session state (僅保存引用)
         st.session_state.calculation_result = result
         
     except Exception as e:
         st.error(f"計算過程中發生錯誤：{str(e)}")
 
+@traced()
 def render_calculation_results():
     """渲染計算結果"""
     result = st.session_state.calculation_result
@@ -592,6 +915,9 @@ def render_calculation_results():
     
     st.markdown('</div>', unsafe_allow_html=True)
     
+    # 與其他旅客比較
+    render_visitor_comparison(result)
+    
     # 減碳貢獻亮點區塊
     render_carbon_saving_highlight(formatted_result)
     
@@ -609,6 +935,7 @@ def render_calculation_results():
         # 交通方式比較圖表
         render_transport_comparison_chart(result)
 
+@traced()
 def render_tree_visualization(tree_equivalent):
     """渲染樹木等效視覺化"""
     tree_count = int(tree_equivalent)
@@ -624,6 +951,7 @@ def render_tree_visualization(tree_equivalent):
     </div>
     """, unsafe_allow_html=True)
 
+@traced()
 def render_carbon_saving_highlight(formatted_result):
     """渲染減碳貢獻亮點區塊"""
     
@@ -644,41 +972,48 @@ def render_carbon_saving_highlight(formatted_result):
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+@traced()
+def render_visitor_comparison(result):
+    """渲染每人碳足跡與同路線、同交通方式旅客的比較 (樣本不足時不顯示)"""
+    
+    sketches = get_emission_sketches()
+    comparisons = (
+        ('route_option', result.route_option, "此路線"),
+        ('transport_mode', result.transport_mode, f"搭乘{load_transport_options()[result.transport_mode]['name']}"),
+    )
+    for dimension, key, label in comparisons:
+        higher = sketches.fraction_higher(dimension, key, result.per_person_emissions)
+        if higher is None:
+            continue
+        if higher >= 0.5:
+            st.success(f"🏅 您的每人碳足跡低於{label} **{higher:.0%}** 的旅客！")
+        else:
+            st.info(f"📊 您的每人碳足跡低於{label} {higher:.0%} 的旅客，參考下方建議還能再減碳。")
+
+@traced()
 def render_detailed_emission_breakdown_chart(result):
     """渲染詳細的碳足跡結構分析圓餅圖"""
     
-    # 準備資料
-    labels = ['城際交通', '路線內交通', '飲食', '咖啡']
-    values = [
+    # 圖表物件依數值快取，相同結果不重新建立
+    fig = build_emission_breakdown_figure(
         result.intercity_emissions, 
         result.route_emissions,
         result.dining_emissions,
         result.coffee_emissions
-    ]
-    colors = ['#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
-    
-    # 創建圓餅圖
-    fig = px.pie(
-        values=values,
-        names=labels,
-        title='碳足跡結構分析',
-        color_discrete_sequence=colors
     )
     
-    fig.update_traces(textposition='inside', textinfo='percent+label')
-    fig.update_layout(height=400)
-    
     st.plotly_chart(fig, use_container_width=True)
 
 def render_emission_breakdown_chart(result):
     """渲染碳足跡分解圓餅圖（保持向後相容）"""
     render_detailed_emission_breakdown_chart(result)
 
+@traced()
 def render_transport_comparison_chart(result):
     """渲染交通方式比較長條圖"""
     
     # 生成替代方案
-    eco_engine = EcoRecommendationEngine()
+    eco_engine = get_recommendation_engine()
     alternatives = eco_engine.generate_transport_alternatives(
         result.transport_mode, 
         result.total_emissions, 
@@ -689,21 +1024,12 @@ def render_transport_comparison_chart(result):
         # 準備資料
         transport_modes = ['您的選擇'] + [alt.transport_mode for alt in alternatives]
         emissions = [result.total_emissions] + [result.total_emissions - alt.emissions_reduction for alt in alternatives]
-        colors = ['#dc3545'] + ['#28a745'] * len(alternatives)
-        
-        # 創建長條圖
-        fig = px.bar(
-            x=transport_modes,
-            y=emissions,
-            title='不同交通方式碳排放比較',
-            labels={'y': 'CO2排放量 (kg)', 'x': '交通方式'},
-            color=transport_modes,
-            color_discrete_sequence=colors
-        )
         
-        fig.update_layout(height=400, showlegend=False)
+        # 圖表物件依數值快取，相同結果不重新建立
+        fig = build_transport_comparison_figure(transport_modes, emissions)
         st.plotly_chart(fig, use_container_width=True)
 
+@traced()
 def render_eco_recommendations():
     """渲染個人化環保建議"""
     result = st.session_state.calculation_result
@@ -713,7 +1039,7 @@ def render_eco_recommendations():
     st.write("根據您的選擇，我們為您量身打造以下環保建議：")
     
     # 生成個人化建議
-    eco_engine = EcoRecommendationEngine()
+    eco_engine = get_recommendation_engine()
     personalized_recs = eco_engine.generate_personalized_recommendations(result)
     
     # 顯示個人化建議
@@ -761,26 +1087,30 @@ def render_eco_recommendations():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+@traced()
 def render_data_source_footer():
     """渲染數據來源說明"""
-    st.markdown('<div class="data-source">', unsafe_allow_html=True)
-    
-    st.subheader("📋 數據來源與計算假設")
-    
-    st.write("**碳排放係數來源：**")
-    st.write("• 交通工具：台灣環境部「生活碳足跡計算器」")
-    st.write("• 飲食碳排：蔬食餐約 1kg CO2e，肉食餐約 3kg CO2e 之平均值")
-    st.write("• 咖啡碳排：基於國際咖啡組織及乳製品生產碳排數據")
-    
-    st.write("**計算方法：**")
-    st.write("• 步行減碳效益以替代同等距離之小客車碳排計算")
-    st.write("• 樹木等效基於成年樹每日約吸收 0.06kg CO2 計算")
-    st.write("• 所有數據旨在提供旅程規劃之參考")
-    
-    st.write("**免責聲明：**")
-    st.write("計算結果僅供參考，實際碳排放量可能因個人行為、車輛效能、路況、食材來源等因素而有所差異。我們致力於推廣永續旅遊，邀請您一同為地球環境盡一份心力。")
-    
-    st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown(build_data_source_footer_html(), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False)
+@traced()
+def build_data_source_footer_html():
+    """產生數據來源說明的 HTML (每個程序只建立一次)"""
+    return """
+<div class="data-source">
+<h3>📋 數據來源與計算假設</h3>
+<p><strong>碳排放係數來源：</strong></p>
+<p>• 交通工具：台灣環境部「生活碳足跡計算器」<br>
+• 飲食碳排：蔬食餐約 1kg CO2e，肉食餐約 3kg CO2e 之平均值<br>
+• 咖啡碳排：基於國際咖啡組織及乳製品生產碳排數據</p>
+<p><strong>計算方法：</strong></p>
+<p>• 步行減碳效益以替代同等距離之小客車碳排計算<br>
+• 樹木等效基於成年樹每日約吸收 0.06kg CO2 計算<br>
+• 所有數據旨在提供旅程規劃之參考</p>
+<p><strong>免責聲明：</strong></p>
+<p>計算結果僅供參考，實際碳排放量可能因個人行為、車輛效能、路況、食材來源等因素而有所差異。我們致力於推廣永續旅遊，邀請您一同為地球環境盡一份心力。</p>
+</div>
+"""
 
 if __name__ == "__main__":
     main()